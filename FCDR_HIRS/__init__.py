@@ -14,3 +14,12 @@ The documentation is currently short on examples, but all code is being
 used, so the source code itself will serve as an example on how to use the
 source code.
 """
+
+import os as _os
+import sys as _sys
+
+# must happen before any heavy imports, see startup_profile
+if ("--profile-startup" in _sys.argv
+        or _os.environ.get("FCDR_HIRS_PROFILE_STARTUP")):
+    from . import startup_profile as _startup_profile
+    _startup_profile.install()
@@ -5,6 +5,13 @@ User's Guide, Table 3.2.1.1-1 and Table 3.2.2.1-1), but only uses 48
 elements (NOAA KLM User's Guide, page 3-30, PDF page 125, or Table J-2).
 That means that statistically, each of those 48 positions should on
 average measure the same.  Let's verify this.
+
+With --streaming, the mean, standard deviation, and extrema per
+position are accumulated granule by granule rather than reading the
+whole period into memory first, such that statistics over many years
+can be calculated.  Those statistics can be stored with --save_stats
+and statistics for different periods, calculated separately, merged
+with --stats_files.
 """
 
 from .. import common
@@ -16,6 +23,7 @@ import matplotlib
 import pathlib
 #pathlib.Path("/dev/shm/gerrit/cache").mkdir(parents=True, exist_ok=True)
 
+import collections
 import datetime
 import itertools
 import math
@@ -23,14 +31,19 @@ import scipy.stats
 import random
 
 import numpy
+import xarray
 import matplotlib.pyplot
 import matplotlib.ticker
 
 import typhon.plots
 matplotlib.pyplot.style.use(typhon.plots.styles("typhon"))
 
+import typhon.datasets.dataset
+import typhon.datasets.filters
+
 from .. import fcdr
 from .. import graphics
+from .. import running_stats
 
 logger = logging.getLogger(__name__)
 
@@ -86,11 +99,33 @@ def get_parser():
         action="store_false",
         dest="anomalies")
 
+    parser.add_argument("--streaming",
+        action="store_true",
+        default=False,
+        help="Plot mean, standard deviation, and extrema accumulated "
+             "granule by granule, rather than percentiles over all "
+             "calibration lines held in memory")
+
+    parser.add_argument("--save_stats",
+        action="store",
+        type=str,
+        default=None,
+        help="With --streaming, store accumulated statistics to this "
+             "NetCDF file, for later merging with --stats_files")
+
+    parser.add_argument("--stats_files",
+        action="store",
+        type=str,
+        nargs="+",
+        default=[],
+        help="With --streaming, merge statistics stored earlier with "
+             "--save_stats, rather than reading L1B data")
+
     return parser
 
 def parse_cmdline():
     p = get_parser()
-    return parser.parse_args()
+    return p.parse_args()
 
 def plot_calibcount_stats(h, Mall, channels,
         title="", filename=""):
@@ -174,6 +209,182 @@ def plot_calibcount_stats(h, Mall, channels,
         right=0.75 if nrow*ncol==len(channels) else 0.9)
     graphics.print_or_show(f, False, filename)
 
+def accumulate_calibcount_stats(h, from_date, to_date,
+        views=("space", "iwt")):
+    """Accumulate calibration count statistics granule by granule
+
+    Read L1B data one granule at a time, with the same orbit filters as
+    `~typhon.datasets.dataset.Dataset.read_period` uses by default, and
+    update running statistics per view, calibration position, and
+    channel.  Only one granule is held in memory at a time.  As the
+    filters are applied per granule, the overlap between consecutive
+    granules is removed here: only scanlines later than the last one
+    already used are added.
+
+    Parameters
+    ----------
+
+    h : typhon.datasets.tovs.HIRS
+        :class:`~typhon.datasets.tovs.HIRS` object
+    from_date : datetime.datetime
+        Starting datetime.
+    to_date : datetime.datetime
+        Ending datetime.
+    views : Sequence[str], optional
+        Calibration views, for which ``h`` must have an attribute
+        ``typ_{view}``.  Defaults to ``("space", "iwt")``.
+
+    Returns
+    -------
+
+    xarray.Dataset
+        Statistics as returned by
+        `~FCDR_HIRS.running_stats.RunningStats.to_xarray`, with
+        dimensions ``("view", "calibpos", "channel")``.  Pass to
+        `merge_calibcount_stats` to combine with statistics for other
+        periods.
+    """
+    orbit_filters = h.default_orbit_filters
+    for of in orbit_filters:
+        of.reset()
+    extra_filter_args = dict(collections.ChainMap(*(of.args_to_reader
+        for of in orbit_filters)))
+    ncalib = h.n_perline - h.start_space_calib
+    stats = [running_stats.RunningStats((ncalib, h.n_channels))
+             for view in views]
+    (start, end) = (numpy.datetime64(from_date), numpy.datetime64(to_date))
+    n = 0
+    last = None
+    for gran in h.find_granules_sorted(from_date, to_date,
+            include_last_before=True):
+        try:
+            (M, extra) = h.read(str(gran),
+                fields=["time", "counts", h.scantype_fieldname],
+                **extra_filter_args)
+            for of in orbit_filters:
+                M = of.filter(M, **extra)
+        except (typhon.datasets.dataset.DataFileError,
+                typhon.datasets.filters.FilterError) as exc:
+            logger.error("Can not read file {}: {}".format(
+                gran, exc.args[0]))
+            continue
+        M = M[(M["time"] >= start) & (M["time"] < end)]
+        if last is not None:
+            M = M[M["time"] > last]
+        if M.size == 0:
+            continue
+        last = M["time"].max()
+        for (view, view_stats) in zip(views, stats):
+            Mv = M[M[h.scantype_fieldname] == getattr(h, f"typ_{view:s}")]
+            view_stats.add(Mv["counts"][:, h.start_space_calib:, :])
+        n += 1
+    logger.info(f"Accumulated calibration count statistics from {n:d} "
+                "granules")
+    return xarray.concat(
+        [view_stats.to_xarray(("calibpos", "channel"),
+            coords={"calibpos": numpy.arange(1, ncalib+1),
+                    "channel": numpy.arange(1, h.n_channels+1)})
+         for view_stats in stats],
+        dim=xarray.DataArray(list(views), dims=("view",), name="view"))
+
+def merge_calibcount_stats(all_stats):
+    """Merge calibration count statistics for different periods
+
+    Parameters
+    ----------
+
+    all_stats : Sequence[xarray.Dataset]
+        Statistics as returned by `accumulate_calibcount_stats`.
+
+    Returns
+    -------
+
+    xarray.Dataset
+        Statistics for all periods together.
+    """
+    stats = running_stats.RunningStats.from_xarray(all_stats[0])
+    for other in all_stats[1:]:
+        stats.merge(running_stats.RunningStats.from_xarray(other))
+    return stats.to_xarray(all_stats[0]["count"].dims,
+        coords=all_stats[0]["count"].coords)
+
+def plot_calibcount_moments(stats, channels, title="", filename=""):
+    """Plot accumulated statistics on calibration counts
+
+    For all requested channels, plot the mean space and IWCT counts per
+    "scan position", with one standard deviation around the mean and
+    the extrema, into a figure with one subplot per channel.  Equivalent
+    to `plot_calibcount_stats`, but from statistics accumulated with
+    `accumulate_calibcount_stats`.
+
+    Parameters
+    ----------
+
+    stats : xarray.Dataset
+        Statistics as returned by `accumulate_calibcount_stats`.
+    channels : List[int]
+        Channels to plot
+    title : str, optional
+        Set figure suptitle to this.
+    filename : str, optional
+        Write output to this filename (inside the plot directory) using
+        `graphics.print_or_show`
+    """
+    N = len(channels)
+
+    (nrow, ncol) = typhon.plots.common.get_subplot_arrangement(N)
+
+    (f, ax_all) = matplotlib.pyplot.subplots(nrow, ncol,
+        sharex=True,
+        figsize=(4+3*nrow, 4+2*ncol), squeeze=False)
+    x = stats["calibpos"].values
+    for (a1, c) in zip(ax_all.ravel(), channels):
+        a2 = a1.twinx()
+        for (view, a, color, lab) in (
+                ("space", a1, "blue", "space"),
+                ("iwt", a2, "green", "IWCT")):
+            st = stats.sel(view=view, channel=c)
+            a.plot(x, st["mean"], color=color, linestyle="-",
+                linewidth=1.0, label=f"{lab:s} mean")
+            a.fill_between(x, st["mean"]-st["std"], st["mean"]+st["std"],
+                color=color, alpha=0.2, label=f"{lab:s} ±1σ")
+            for ext in ("minimum", "maximum"):
+                a.plot(x, st[ext], color=color, linestyle=":",
+                    linewidth=1.0,
+                    label=f"{lab:s} extrema" if ext=="minimum" else None)
+            a.grid(True, which="major")
+            for ax in (a.xaxis, a.yaxis):
+                ax.set_major_locator(
+                    matplotlib.ticker.MaxNLocator(nbins=4, prune=None))
+            a.yaxis.set_minor_locator(
+                matplotlib.ticker.AutoMinorLocator(5))
+            a.set_xlim(0, x[-1])
+        a1.xaxis.set_minor_locator(
+            matplotlib.ticker.MultipleLocator(1))
+        if c == channels[-1]:
+            lines, labels = a1.get_legend_handles_labels()
+            lines2, labels2 = a2.get_legend_handles_labels()
+            a1.legend(lines + lines2, labels + labels2,
+                loc="upper left", bbox_to_anchor=(1.5, 1.15))
+        for tl in a1.get_yticklabels():
+            tl.set_color("blue")
+        for tl in a2.get_yticklabels():
+            tl.set_color("green")
+        a1.set_title("Ch. {:d}".format(c))
+        if a1 in ax_all[:, -1] or c == channels[-1]:
+            a2.set_ylabel("IWCT counts")
+        if a1 in ax_all[:, 0]:
+            a1.set_ylabel("space counts")
+        if a1 in ax_all[-1, :] or c==len(channels)//ncol*ncol:
+            a1.set_xlabel("Calib. scanpos")
+    # set remaining invisible
+    for a in ax_all.ravel()[len(channels):]:
+        a.set_visible(False)
+    f.suptitle(title, y=1.02)
+    f.subplots_adjust(hspace=0.5, wspace=0.5,
+        right=0.75 if nrow*ncol==len(channels) else 0.9)
+    graphics.print_or_show(f, False, filename)
+
 def plot_calibcount_anomaly_examples(h, M, channels, N,
         mode="random", typ="space", anomaly=True):
     """Plot examples of calibcount anomalies
@@ -284,7 +495,10 @@ def read_and_plot_calibcount_stats(sat, from_date, to_date, channels,
         random_seed=0,
         sample_mode="random",
         typ="iwt",
-        anomaly=True):
+        anomaly=True,
+        streaming=False,
+        stats_files=(),
+        save_stats=None):
     """Read and plot calibration count statistics.
 
     Read data for period, then pass it on to `plot_calibcount_stats` and
@@ -321,11 +535,41 @@ def read_and_plot_calibcount_stats(sat, from_date, to_date, channels,
     anomaly : bool, optional
         If true, plot anomalies.  If false, plot actual count values.
         Defaults to True.
+    streaming : bool, optional
+        If true, accumulate statistics granule by granule with
+        `accumulate_calibcount_stats` and plot those with
+        `plot_calibcount_moments`, rather than reading the whole period
+        into memory.  Examples still need the whole period.  Defaults
+        to False.
+    stats_files : Sequence[str], optional
+        With ``streaming``, merge statistics from these files, written
+        earlier with ``save_stats``, rather than reading L1B data.
+    save_stats : str, optional
+        With ``streaming``, write the statistics to this NetCDF file.
     """
     h = fcdr.which_hirs_fcdr(sat)
+    if streaming:
+        if stats_files:
+            stats = merge_calibcount_stats(
+                [xarray.open_dataset(f).load() for f in stats_files])
+        else:
+            stats = accumulate_calibcount_stats(h, from_date, to_date)
+        if save_stats:
+            stats.to_netcdf(save_stats)
+            logger.info(f"Wrote calibration count statistics to {save_stats:s}")
+        if plot_stats:
+            plot_calibcount_moments(stats, channels,
+                title="HIRS calibration consistency check per scanpos\n"
+                      "{sat:s} {from_date:%Y-%m-%d} -- {to_date:%Y-%m-%d}".format(
+                        **locals()),
+                filename="hirs_calib_moments_per_scanpos_{sat:s}_{from_date:%Y%m%d%H%M}-"
+                         "{to_date:%Y%m%d%H%M}_{ch:s}.".format(
+                                ch=",".join([str(x) for x in channels]), **locals()))
+        if plot_examples == 0:
+            return
     M = h.read_period(from_date, to_date,
             fields=["time", "counts", h.scantype_fieldname])
-    if plot_stats:
+    if plot_stats and not streaming:
         plot_calibcount_stats(h, M, channels,
             title="HIRS calibration consistency check per scanpos\n"
                   "{sat:s} {from_date:%Y-%m-%d} -- {to_date:%Y-%m-%d}".format(
@@ -350,7 +594,7 @@ def main():
     from_date = datetime.datetime.strptime(p.from_date, p.datefmt)
     to_date = datetime.datetime.strptime(p.to_date, p.datefmt)
     common.set_logger(
-        logging.DEBUG if p.verbose else logging.info,
+        logging.DEBUG if p.verbose else logging.INFO,
         p.log,
         loggers={"FCDR_HIRS", "typhon"})
     read_and_plot_calibcount_stats(p.satname, from_date, to_date,
@@ -358,4 +602,7 @@ def main():
         p.random_seed, 
         p.examples_mode,
         p.calibtype,
-        p.anomalies)
+        p.anomalies,
+        p.streaming,
+        p.stats_files,
+        p.save_stats)
@@ -3,6 +3,11 @@
 """Convert HIRS l1b to NetCDF-4, granule per granule.
 
 Designed to be used as a script, see `hirs-convert-l1b-to-l1c`.
+
+With ``--bulk``, granules are converted in parallel by a pool of worker
+processes.  A manifest records, for each converted granule, the size and
+modification time of the source, such that an interrupted or repeated
+conversion skips those granules that are already done.
 """
 
 import datetime
@@ -11,14 +16,12 @@ import os
 import pathlib
 import logging
 import argparse
+import json
+import tempfile
+import time
+import concurrent.futures
 
 import numpy
-p = pathlib.Path("/home/users/gholl/.cache/matplotlib/tex.cache")
-if p.is_symlink() and not p.exists():
-    (p.parent / os.readlink(str(p))).mkdir(parents=True, exist_ok=True)
-import matplotlib.pyplot
-import matplotlib.dates
-import scipy.stats
 import netCDF4
 import progressbar
 
@@ -43,6 +46,14 @@ def get_parser():
     parser.add_argument("-o", "--overwrite", action="store_true",
                         help="Write destination file/s even when they exist",
                         default=False)
+    parser.add_argument("--bulk", action="store_true",
+                        help=("Convert granules in parallel and skip "
+                              "those listed in the manifest as already "
+                              "converted from an unchanged source"),
+                        default=False)
+    parser.add_argument("--workers", action="store", type=int,
+                        help="Number of worker processes for --bulk",
+                        default=os.cpu_count())
     return parser
 
 def parse_cmdline():
@@ -51,6 +62,53 @@ def parse_cmdline():
 outdir = pathlib.Path(typhon.config.conf["main"]["fiddatadir"],
     "HIRS_L1C_NC", "{sat:s}", "{year:04d}", "{month:02d}", "{day:02d}")
 
+manifest_file = pathlib.Path(typhon.config.conf["main"]["fiddatadir"],
+    "HIRS_L1C_NC", "{sat:s}", "manifest.json")
+
+def get_orbit_filters(h):
+    """Get orbit filters to apply to each granule before writing
+
+    Parameters
+    ----------
+
+    h : typhon.datasets.tovs.HIRS
+        Relevant HIRS-object (HIRS2, HIRS3, HIRS4)
+
+    Returns
+    -------
+
+    Tuple[typhon.datasets.filters.OrbitFilter]
+        Orbit filters, to be applied in this order.
+    """
+    return (
+        filters.FirstlineDBFilter(h, h.granules_firstline_file),
+        filters.TimeMaskFilter(h),
+        filters.HIRSTimeSequenceDuplicateFilter(),
+        filters.HIRSFlagger(h, max_flagged=0.5),
+            )
+
+def get_outfile(satname, dt, gran):
+    """Get path to NetCDF file for granule
+
+    Parameters
+    ----------
+
+    satname : str
+        Name of satellite
+    dt : datetime.datetime
+        Corresponding datetime for granule
+    gran : pathlib.Path
+        Full path to granule
+
+    Returns
+    -------
+
+    pathlib.Path
+        Path to which converted granule is written.
+    """
+    return pathlib.Path(str((outdir / gran.name).with_suffix(".nc")).format(
+            sat=satname, year=dt.year, month=dt.month, day=dt.day))
+
 def convert_granule(h, satname, dt, gran, orbit_filters, overwrite=False):
     """Reads granule and writes NetCDF file with same contents
 
@@ -70,27 +128,59 @@ def convert_granule(h, satname, dt, gran, orbit_filters, overwrite=False):
         implementations to apply, order is important.
     overwrite : bool, optional
         Whether to overwrite existing files.  Defaults to False.
+
+    Returns
+    -------
+
+    pathlib.Path or None
+        Path to the NetCDF file, or None if the granule was empty after
+        filtering.
     """
 
+    outfile = get_outfile(satname, dt, gran)
+
+    if outfile.exists() and not overwrite:
+        logger.info("Already exists: {!s}".format(outfile))
+        return outfile
+
     (lines, extra) = h.read(gran, 
         apply_scale_factors=True,
         apply_calibration=True, radiance_units="classic")
-    head = extra["header"]
     for of in orbit_filters:
         lines = of.filter(lines, **extra) # this is where flags are applied now
     if lines.size == 0:
         logger.error("Apparently empty: {!s}".format(gran))
-        return
-
-    outfile = pathlib.Path(str((outdir / gran.name).with_suffix(".nc")).format(
-            sat=satname, year=dt.year, month=dt.month, day=dt.day))
-
-    if outfile.exists() and not overwrite:
-        logger.info("Already exists: {!s}".format(outfile))
-        return
+        return None
 
     logger.debug("{!s} → {!s}".format(gran, outfile))
     outfile.parent.mkdir(parents=True, exist_ok=True)
+    # write to temporary file first, such that an interrupted conversion
+    # never leaves a partial file that looks like a completed one
+    tmpfile = str(outfile.with_name(".{:s}.{:d}.tmp".format(
+        outfile.name, os.getpid())))
+    try:
+        write_granule(h, lines, extra["header"], tmpfile)
+        os.replace(tmpfile, str(outfile))
+    finally:
+        if os.path.exists(tmpfile):
+            os.remove(tmpfile)
+    return outfile
+
+def write_granule(h, lines, head, outfile):
+    """Write filtered scanlines to NetCDF file
+
+    Parameters
+    ----------
+
+    h : typhon.datasets.tovs.HIRS
+        Relevant HIRS-object (HIRS2, HIRS3, HIRS4)
+    lines : numpy.ndarray
+        Scanlines after filtering
+    head : numpy.ndarray
+        Header for granule
+    outfile : str
+        File to write to.  Will be overwritten if it exists.
+    """
     with netCDF4.Dataset(str(outfile), mode="w", clobber=True, 
             format="NETCDF4") as ds:
         ds.description = "HIRS L1C"
@@ -220,12 +310,7 @@ def convert_period(h, sat, start_date, end_date, **kwargs):
     logger.info("Converting NOAA to NetCDF, {:s} "
         "{:%Y-%m-%d %H:%M:%S}–{:%Y-%m-%d %H:%M:%S}".format(
             sat, start_date, end_date))
-    orbit_filters = (
-        filters.FirstlineDBFilter(h, h.granules_firstline_file),
-        filters.TimeMaskFilter(h),
-        filters.HIRSTimeSequenceDuplicateFilter(),
-        filters.HIRSFlagger(h, max_flagged=0.5),
-            )
+    orbit_filters = get_orbit_filters(h)
     bar = progressbar.ProgressBar(maxval=1,
         widgets=common.my_pb_widget)
     bar.start()
@@ -250,6 +335,177 @@ def convert_period(h, sat, start_date, end_date, **kwargs):
     bar.update(1)
     bar.finish()
 
+def load_manifest(sat):
+    """Load manifest of converted granules for satellite
+
+    Parameters
+    ----------
+
+    sat : str
+        Name of satellite
+
+    Returns
+    -------
+
+    Dict[str, dict]
+        For each converted source granule, a dictionary with the
+        ``size`` and ``mtime_ns`` of the source at the time of
+        conversion and the ``output`` file, which is None if the granule
+        was empty.  For granules that could not be converted, ``output``
+        is None and ``error`` describes what went wrong; those are tried
+        again on the next conversion.  Empty if there is no manifest
+        yet.
+    """
+    path = pathlib.Path(str(manifest_file).format(sat=sat))
+    if not path.exists():
+        return {}
+    with path.open("r", encoding="utf-8") as fp:
+        return json.load(fp)
+
+def store_manifest(sat, manifest):
+    """Atomically store manifest of converted granules for satellite
+
+    Parameters
+    ----------
+
+    sat : str
+        Name of satellite
+    manifest : Dict[str, dict]
+        Manifest as returned by `load_manifest`.
+    """
+    path = pathlib.Path(str(manifest_file).format(sat=sat))
+    path.parent.mkdir(parents=True, exist_ok=True)
+    (fd, tmpfile) = tempfile.mkstemp(dir=str(path.parent),
+        prefix=".{:s}.".format(path.name))
+    with os.fdopen(fd, "w", encoding="utf-8") as fp:
+        json.dump(manifest, fp, indent=0, sort_keys=True)
+    os.replace(tmpfile, str(path))
+
+def _is_done(entry, st):
+    return (entry is not None and
+            entry.get("error") is None and
+            entry["size"] == st.st_size and
+            entry["mtime_ns"] == st.st_mtime_ns and
+            (entry["output"] is None or os.path.exists(entry["output"])))
+
+_worker_state = {}
+def _init_worker(sat):
+    h = fcdr.which_hirs_fcdr(sat)
+    h.my_pseudo_fields.clear()
+    _worker_state["h"] = h
+    _worker_state["orbit_filters"] = get_orbit_filters(h)
+
+def _convert_in_worker(sat, dt, gran, overwrite):
+    h = _worker_state["h"]
+    orbit_filters = _worker_state["orbit_filters"]
+    for of in orbit_filters:
+        of.reset()
+    try:
+        outfile = convert_granule(h, sat, dt, gran, orbit_filters,
+                                  overwrite=overwrite)
+    except (typhon.datasets.dataset.InvalidDataError,
+            typhon.datasets.dataset.InvalidFileError) as exc:
+        logger.error("Unable to process {!s}: {:s}: {!s}".format(
+            gran, type(exc).__name__, exc))
+        return (None, "{:s}: {!s}".format(type(exc).__name__, exc))
+    # any other failure is confined to this granule as well, such that
+    # the results of the other granules still make it into the manifest
+    except Exception as exc:
+        logger.exception("Unexpected error processing {!s}".format(gran))
+        return (None, "{:s}: {!s}".format(type(exc).__name__, exc))
+    return (None if outfile is None else str(outfile), None)
+
+def convert_period_bulk(h, sat, start_date, end_date, workers=None,
+                        overwrite=False, flush_every=100):
+    """Convert entire period of granules in parallel, resumably
+
+    Granules are converted by a pool of worker processes, each with its
+    own HIRS object and orbit filters.  Granules listed in the manifest
+    as converted from a source with the same size and modification time
+    are skipped, unless `overwrite` is set.  Granules that fail are
+    recorded in the manifest as such and tried again next time.  The
+    manifest is stored every `flush_every` granules and at the end, also
+    if interrupted.
+
+    Parameters
+    ----------
+
+    h : HIRS
+        :class:`~typhon.datasets.tovs.HIRS` object for satellite, used
+        to find granules
+    sat : str
+        Name of satellite
+    start_date : datetime.datetime
+        Datetime for starting point
+    end_date : datetime.datetime
+        Datetime for ending point
+    workers : int, optional
+        Number of worker processes.  Defaults to the number of CPUs.
+    overwrite : bool, optional
+        Whether to convert granules even if the manifest lists them as
+        done.  Defaults to False.
+    flush_every : int, optional
+        Store manifest after this many granules.  Defaults to 100.
+    """
+
+    logger.info("Bulk converting NOAA to NetCDF, {:s} "
+        "{:%Y-%m-%d %H:%M:%S}–{:%Y-%m-%d %H:%M:%S}".format(
+            sat, start_date, end_date))
+    manifest = load_manifest(sat)
+    todo = []
+    n_skipped = 0
+    for (dt, gran) in h.find_granules_sorted(start_date, end_date,
+            return_time=True, satname=sat):
+        st = gran.stat()
+        if not overwrite and _is_done(manifest.get(str(gran)), st):
+            n_skipped += 1
+            continue
+        todo.append((dt, gran, st))
+    logger.info("{:d} granules to convert, {:d} already done".format(
+        len(todo), n_skipped))
+
+    n_done = n_bytes = n_failed = 0
+    t0 = time.perf_counter()
+    bar = progressbar.ProgressBar(maxval=max(len(todo), 1),
+        widgets=common.my_pb_widget)
+    bar.start()
+    try:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers,
+                initializer=_init_worker, initargs=(sat,)) as executor:
+            futures = {executor.submit(_convert_in_worker, sat, dt, gran,
+                                       overwrite): (gran, st)
+                       for (dt, gran, st) in todo}
+            for fut in concurrent.futures.as_completed(futures):
+                (gran, st) = futures[fut]
+                try:
+                    (outfile, error) = fut.result()
+                except Exception as exc:
+                    # worker died, such as when killed for running out
+                    # of memory
+                    logger.error("Unable to process {!s}: {:s}: {!s}".format(
+                        gran, type(exc).__name__, exc))
+                    (outfile, error) = (None,
+                        "{:s}: {!s}".format(type(exc).__name__, exc))
+                manifest[str(gran)] = {"size": st.st_size,
+                    "mtime_ns": st.st_mtime_ns, "output": outfile}
+                if error is None:
+                    n_done += 1
+                    n_bytes += st.st_size
+                else:
+                    manifest[str(gran)]["error"] = error
+                    n_failed += 1
+                bar.update(n_done + n_failed)
+                if (n_done + n_failed) % flush_every == 0:
+                    store_manifest(sat, manifest)
+    finally:
+        store_manifest(sat, manifest)
+        bar.finish()
+    duration = time.perf_counter() - t0
+    logger.info("Converted {:d} granules ({:.1f} MB of L1B) in {:.1f} s, "
+        "{:.2f} granules/s, {:.2f} MB/s, {:d} failed".format(
+            n_done, n_bytes/1e6, duration, n_done/duration,
+            n_bytes/1e6/duration, n_failed))
+
 def main():
     """Main function
 
@@ -259,7 +515,14 @@ def main():
     common.set_logger(logging.INFO,
         loggers={"FCDR_HIRS", "typhon"})
     h = fcdr.which_hirs_fcdr(p.satname)
-    convert_period(h, p.satname, 
-            datetime.datetime.strptime(p.from_date, p.datefmt),
-            datetime.datetime.strptime(p.to_date, p.datefmt),
-            overwrite=p.overwrite)
+    if p.bulk:
+        convert_period_bulk(h, p.satname,
+                datetime.datetime.strptime(p.from_date, p.datefmt),
+                datetime.datetime.strptime(p.to_date, p.datefmt),
+                workers=p.workers,
+                overwrite=p.overwrite)
+    else:
+        convert_period(h, p.satname, 
+                datetime.datetime.strptime(p.from_date, p.datefmt),
+                datetime.datetime.strptime(p.to_date, p.datefmt),
+                overwrite=p.overwrite)
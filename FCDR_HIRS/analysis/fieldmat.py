@@ -13,6 +13,12 @@ implemented in :func:`~analysis.fieldmat.plot_field_matrix`.
 The module also contains functionality to calculate the FFT for space or
 IWCT anomalies (for want of a better place to put it).
 
+Correlation matrices and FFTs are calculated from count anomalies
+extracted once per satellite and period by
+`~FCDR_HIRS.analysis.noise_matrices.CountAnomalies`, which are cached on
+disk per period and version of the L1B data, such that repeating plots
+for the same periods does not need to read L1B data again.
+
 For the full documentation of the script, see :ref:`plot-hirs-field-matrix`.
 
 Otherwise this module contains the functionality to plot correlation
@@ -32,6 +38,8 @@ import pathlib
 
 
 import datetime
+import hashlib
+import json
 import scipy.stats
 import numpy
 import itertools
@@ -40,15 +48,18 @@ import abc
 import matplotlib.pyplot
 import matplotlib.ticker
 import matplotlib.gridspec
+import typhon
 import typhon.plots
 import typhon.plots.plots
 
 from typhon.physics.units.common import ureg
+from typhon import config
 from .. import fcdr
 from typhon.datasets import tovs
 from typhon.datasets.dataset import DataFileError
 from .. import cached
 from .. import graphics
+from . import noise_matrices
 
 logger = logging.getLogger(__name__)
 
@@ -141,6 +152,11 @@ def get_parser():
              "for early in satellite life and upper triangle for late "
              "in satellite life.")
 
+    parser.add_argument("--refresh_anomalies", action="store_true",
+        help="Extract count anomalies from L1B data even if they are "
+             "already cached on disk, for example after L1B data have "
+             "changed.")
+
     return parser
 def parse_cmdline():
     return get_parser().parse_args()
@@ -410,7 +426,7 @@ class _SatPlotFFT(_SatPlotHelper):
         self.late_cnt = {}
 
     def _extract_counts(self, mp, channel):
-        """Extract space, IWCT, and Earth counts
+        """Get FFT amplitudes of space, IWCT, and Earth counts
 
         Parameters
         ----------
@@ -419,28 +435,37 @@ class _SatPlotFFT(_SatPlotHelper):
             MatrixPlotter instance
         channel : int
             Channel for which we're extracting counts
+
+        Returns
+        -------
+
+        spc, iwctc, ec : ndarray
+            Mean FFT amplitude for space, IWCT, and Earth count
+            anomalies, see
+            `~FCDR_HIRS.analysis.noise_matrices.CountAnomalies.fft_amplitude`.
+        cnt : int
+            Number of space lines.
         """
-        spc = mp._get_accnt("space")[:, :, channel-1]
-        spc = spc[(~spc.mask).all(1), :]
-        iwctc = mp._get_accnt("iwt")[:, :, channel-1]
-        iwctc = iwctc[(~iwctc.mask).all(1), :]
-        ec = mp._get_accnt("Earth")[:, :, channel-1]
-        ec = ec[(~ec.mask).all(1), :]
-        return (spc, iwctc, ec)
+        ca = mp.get_count_anomalies(n_fft=self.n)
+        (spc, cnt) = ca.fft_amplitude("space")
+        (iwctc, _) = ca.fft_amplitude("iwt")
+        (ec, _) = ca.fft_amplitude("Earth")
+        return (spc[channel-1], iwctc[channel-1], ec[channel-1],
+                int(cnt[channel-1]))
 
     def prepare_early(self, mp, channel):
-        (spc, iwctc, ec) = self._extract_counts(mp, channel)
+        (spc, iwctc, ec, cnt) = self._extract_counts(mp, channel)
         self.early_spc[channel] = spc
         self.early_iwctc[channel] = iwctc
         self.early_ec[channel] = ec
-        self.early_cnt[channel] = spc.shape[0]
+        self.early_cnt[channel] = cnt
 
     def prepare_late(self, mp, channel):
-        (spc, iwctc, ec) = self._extract_counts(mp, channel)
+        (spc, iwctc, ec, cnt) = self._extract_counts(mp, channel)
         self.late_spc[channel] = spc
         self.late_iwctc[channel] = iwctc
         self.late_ec[channel] = ec
-        self.late_cnt[channel] = spc.shape[0]
+        self.late_cnt[channel] = cnt
 
     def plot_both(self, mp, ax, gs, sat, r, c, ep, lp, channel,
                   solo=False, c_max=3, r_max=3, custom=False):
@@ -454,16 +479,13 @@ class _SatPlotFFT(_SatPlotHelper):
         # rather do pixels than seconds (feedback CM)
         x = numpy.fft.fftfreq(n, d=1)
 
-        logging.debug("Calculating FFTs")
-
-        fft_e_ec = abs(numpy.fft.fft(self.early_ec[channel], axis=1, n=n)[:, 1:n//2]).mean(0)
-        fft_e_spc = abs(numpy.fft.fft(self.early_spc[channel], axis=1, n=n)[:, 1:n//2]).mean(0)
-        fft_e_iwctc = abs(numpy.fft.fft(self.early_iwctc[channel], axis=1, n=n)[:, 1:n//2]).mean(0)
-        fft_l_ec = abs(numpy.fft.fft(self.late_ec[channel], axis=1, n=n)[:, 1:n//2]).mean(0)
-        fft_l_spc = abs(numpy.fft.fft(self.late_spc[channel], axis=1, n=n)[:, 1:n//2]).mean(0)
-        fft_l_iwctc = abs(numpy.fft.fft(self.late_iwctc[channel], axis=1, n=n)[:, 1:n//2]).mean(0)
-
-        logging.debug("Done calculating, now plotting FFTs")
+        # FFTs were calculated when extracting the count anomalies
+        fft_e_ec = self.early_ec[channel]
+        fft_e_spc = self.early_spc[channel]
+        fft_e_iwctc = self.early_iwctc[channel]
+        fft_l_ec = self.late_ec[channel]
+        fft_l_spc = self.late_spc[channel]
+        fft_l_iwctc = self.late_iwctc[channel]
 
         ax.plot(
             x[1:n//2],
@@ -616,23 +638,57 @@ class MatrixPlotter:
 
     #: List of all satellites
     all_sats = ["tirosn"] + [f"noaa{no:02d}" for no in range(6, 20) if no!=13] + ["metopa", "metopb"]
-#    def __init__(self, sat, from_date, to_date):
-#        self.reset(sat, from_date, to_date)
 
-    #: ndarray : Attribute that will hold data after calling :meth:`reset`
-    M = None
+    def __init__(self, cachedir=None, refresh=False):
+        """Initialise matrix plotter
+
+        Parameters
+        ----------
+
+        cachedir : str or pathlib.Path, optional
+            Directory in which to cache count anomalies, see
+            `get_count_anomalies`.  Defaults to
+            ``hirs_count_anomalies`` in the ``myscratchdir`` in the
+            ``[main]`` section of the configuration.
+        refresh : bool, optional
+            If True, extract count anomalies again even if cached on
+            disk.  Defaults to False.
+        """
+        if cachedir is None:
+            cachedir = pathlib.Path(config.conf["main"]["myscratchdir"],
+                "hirs_count_anomalies")
+        self.cachedir = pathlib.Path(cachedir)
+        self.refresh = refresh
+        self._M = None
+        self._count_anomalies = {}
+
+    @property
+    def M(self):
+        """ndarray : L1B data for the period set by :meth:`reset`
+
+        Read on first access.
+        """
+        if self._M is None:
+            h = self.hirs
+            self._M = cached.read_tovs_hirs_period(self.satname,
+                self.start_date, self.end_date,
+                fields=["temp_{:s}".format(t) for t in sorted(h.temperature_fields)] +
+                       ["counts", "time", h.scantype_fieldname])
+        return self._M
 
     def reset(self, sat, from_date, to_date):
         """Reset matrix plotter to an initial state
 
-        This methods reads the data needed to subsequently make plots
-        related to ``sat`` between the period ``from_date`` and
-        ``to_date``.  Call this method before any of the plotting methods
+        This methods sets the satellite ``sat`` and the period between
+        ``from_date`` and ``to_date`` for which to subsequently make plots.
+        Call this method before any of the plotting methods
         as well as when you want to redo any of the plotting methods for a
         different satellite and time period.
 
-        This method returns nothing, but after calling this method, the
-        data will be stored in the :attr:`M` attribute.
+        This method returns nothing.  The data are read on first access
+        of the :attr:`M` attribute.  Plots of count anomalies, such as
+        correlation matrices, do not need :attr:`M` if the count
+        anomalies are cached, see :meth:`get_count_anomalies`.
 
         Parameters
         ----------
@@ -648,16 +704,76 @@ class MatrixPlotter:
         """
         h = tovs.which_hirs(sat)
         self.hirs = h
-        M = cached.read_tovs_hirs_period(sat, from_date, to_date, 
-            fields=["temp_{:s}".format(t) for t in sorted(h.temperature_fields)] + 
-                   ["counts", "time", h.scantype_fieldname])
-        self.M = M
+        self.satname = sat
+        self._M = None
         self.start_date = from_date
         self.end_date = to_date
 
         self.title_sat_date = f"{sat:s} {from_date:%Y-%m-%d} -- {to_date:%Y-%m-%d}"
         self.filename_sat_date = f"{sat:s}_{from_date:%Y}/{sat:s}_{from_date:%Y%m%d%H%M}--{to_date:%Y%m%d%H%M}"
 
+    def get_count_anomalies(self, n_fft=48):
+        """Get count anomalies for the period set by :meth:`reset`
+
+        Count anomalies are extracted from :attr:`M` once per satellite
+        and period, and kept in memory and on disk in :attr:`cachedir`,
+        such that correlation matrices and FFTs for the same period,
+        such as by :meth:`plot_all_sats_early_late` for several
+        plotters, do not read L1B data again.  On disk, they are keyed
+        on :meth:`get_data_version` as well.
+
+        Parameters
+        ----------
+
+        n_fft : int, optional
+            Length of the FFT.  Defaults to 48.
+
+        Returns
+        -------
+
+        `~FCDR_HIRS.analysis.noise_matrices.CountAnomalies`
+            Count anomalies.
+        """
+        key = (self.satname, self.start_date, self.end_date, n_fft)
+        if key not in self._count_anomalies:
+            p = self.cachedir / (f"{self.satname:s}_"
+                f"{self.start_date:%Y%m%d%H%M}--{self.end_date:%Y%m%d%H%M}_"
+                f"fft{n_fft:d}_{self.get_data_version():s}.npz")
+            if p.exists() and not self.refresh:
+                logger.debug(f"Loading count anomalies from {p!s}")
+                ca = noise_matrices.CountAnomalies.load(p)
+            else:
+                ca = noise_matrices.CountAnomalies.extract(self.hirs,
+                    self.M, n_fft=n_fft)
+                p.parent.mkdir(parents=True, exist_ok=True)
+                ca.save(p)
+            # only keep the current period in memory
+            self._count_anomalies = {key: ca}
+        return self._count_anomalies[key]
+
+    def get_data_version(self):
+        """Identify the L1B data for the period set by :meth:`reset`
+
+        The identifier is a digest of the version of typhon, which
+        decodes and filters the L1B data, and of the name, size, and
+        modification time of each L1B granule read for the period.
+
+        Returns
+        -------
+
+        str
+            Identifier of the L1B data, which changes when the granules
+            or the software reading them change.
+        """
+        granules = []
+        for gran in self.hirs.find_granules_sorted(self.start_date,
+                self.end_date, include_last_before=True):
+            st = gran.stat()
+            granules.append([gran.name, st.st_size, st.st_mtime_ns])
+        desc = json.dumps({"typhon": typhon.__version__,
+                           "granules": granules})
+        return hashlib.sha256(desc.encode("ascii")).hexdigest()[:16]
+
     def _get_temps(self, temp_fields):
         """Extract temperatures from data
 
@@ -788,6 +904,9 @@ class MatrixPlotter:
             What calibration line to estimate the anomalies for: "iwt",
             "ict", or "space".
         """
+        ca = self.get_count_anomalies()
+        if noise_typ in ca.anomalies:
+            return numpy.ma.masked_invalid(ca.anomalies[noise_typ])
         views = self.M[self.hirs.scantype_fieldname] == getattr(self.hirs, "typ_{:s}".format(noise_typ))
         ccnt = self.M["counts"][views, 8:, :]
         mccnt = ccnt.mean(1, keepdims=True)
@@ -995,15 +1114,8 @@ class MatrixPlotter:
             Number of lines with count anomalies from which this was
             calculated
         """
-        # although there is a scipy.stats.mstats module,
-        # scipy.stats.mstats.spearman can only calculate individual
-        # covariances, not covariance matrices (it's not vectorised) and
-        # explicit looping is too slow
-        accnt = self._get_accnt(noise_typ)
-        unmasked = ~(accnt[:, calibpos, :].mask.any(1))
-        S = numpy.corrcoef(accnt[:, calibpos,  channels-1].T[:, unmasked])
-        ρ = scipy.stats.spearmanr(accnt[:, calibpos, channels-1][unmasked, :])[0]
-        return (S, ρ, unmasked.sum())
+        return self.get_count_anomalies().channel_corrmat(
+            noise_typ, calibpos, channels)
 
     @staticmethod
     def _plot_ch_corrmat(S, a, channels, add_x=False, add_y=False, each=2):
@@ -1130,10 +1242,19 @@ class MatrixPlotter:
             Number of valid calibration lines over which the calibration
             matrix was calculated
        """
-        accnt = self._get_accnt(noise_typ)
-        unmasked = ~(accnt[:, :, ch-1].mask.any(1))
-        (S, p) = typhon.math.stats.corrcoef(accnt[unmasked, :, ch-1].T)
-        return (S, p, unmasked.sum())
+        (S, p, cnt) = self._get_pos_corrmats([ch], noise_typ)
+        return (S[0], p[0], int(cnt[0]))
+
+    def _get_pos_corrmats(self, channels, noise_typ):
+        """Get correlation matrices between scan positions for channels
+
+        Like :meth:`_get_pos_corrmat`, but for several channels in one
+        pass, see
+        `~FCDR_HIRS.analysis.noise_matrices.CountAnomalies.position_corrmat`.
+        Returns arrays with a leading dimension along ``channels``.
+        """
+        return self.get_count_anomalies().position_corrmat(noise_typ,
+            channels)
 
     def plot_noise_value_scanpos_corr(self, channels,
             noise_typ="iwt"):
@@ -1572,13 +1693,13 @@ class MatrixPlotter:
 
             logging.info("Getting early period")
             self.reset(sat, *ep)
-            (S_each, _, ecnt_each) = zip(*[
-                self._get_pos_corrmat(ch, noise_typ) for ch in channels])
+            (S_each, _, ecnt_each) = self._get_pos_corrmats(channels,
+                noise_typ)
             S_low = [numpy.tril(S, k=-1) for S in S_each]
             logging.info("Getting late period")
             self.reset(sat, *lp)
-            (S_each, _, lcnt_each) = zip(*[
-                self._get_pos_corrmat(ch, noise_typ) for ch in channels])
+            (S_each, _, lcnt_each) = self._get_pos_corrmats(channels,
+                noise_typ)
             S_hi = [numpy.triu(S, k=1) for S in S_each]
             #
             logging.info("Plotting all channels")
@@ -1642,7 +1763,7 @@ def read_and_plot_field_matrices(p):
 #    h = fcdr.which_hirs_fcdr(sat)
         
     #temp_fields_full = ["temp_{:s}".format(t) for t in p.temp_fields]
-    mp = MatrixPlotter()
+    mp = MatrixPlotter(refresh=p.refresh_anomalies)
 #    if p.plot_all_fft:
 #        mp.plot_fft()
 
@@ -0,0 +1,516 @@
+"""Grid easy FCDR brightness temperatures into a monthly Level-3 product
+
+This module and script accumulate brightness temperatures from the easy
+FCDR on a regular latitude/longitude grid, for example to produce
+monthly means.  Orbit files are read one at a time, with the same
+`~FCDR_HIRS.fcdr.which_hirs_fcdr` reading path as used by
+`~FCDR_HIRS.analysis.map`, and every pixel is added to the statistics
+for the grid cell it falls in, for all cells at once with
+`~FCDR_HIRS.running_stats.RunningStats.add_grouped`.  Scanlines covered
+by more than one orbit file are counted once.
+
+For each grid cell and channel, the product contains the number of
+pixels, the mean, standard deviation, minimum, and maximum brightness
+temperature, the mean weighted by the inverse square of the
+independent uncertainty with its uncertainty due to independent
+effects, and the mean structured and common uncertainties.  As
+structured and common effects are correlated between pixels, their
+uncertainties are not reduced by averaging.  Pixels are only used if
+the brightness temperature and all its uncertainties are valid, and if
+neither the scanline nor the channel is flagged as bad, and the
+structured uncertainty is less than half the brightness temperature,
+as in `~FCDR_HIRS.analysis.summarise_fcdr`.
+
+Partial grids, such as for different days calculated by different
+workers (``--workers``) or for different runs, are merged with
+`GriddedFCDR.merge`, or from stored files with ``--merge``.
+"""
+
+import argparse
+import calendar
+import concurrent.futures
+import datetime
+import logging
+import os
+import pathlib
+import tempfile
+
+import numpy
+import xarray
+
+from typhon import config
+from typhon.datasets.dataset import DataFileError
+
+from .. import common
+from .. import fcdr
+from .. import running_stats
+
+logger = logging.getLogger(__name__)
+
+#: List[str] : Fields read from the easy FCDR
+easy_fields = ["time", "latitude", "longitude", "bt", "u_independent",
+               "u_structured", "u_common", "quality_scanline_bitmask",
+               "quality_channel_bitmask"]
+
+#: Tuple[str] : Global attributes describing the gridded product
+product_attrs = ("satellite", "data_version", "format_version", "period")
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser = common.add_to_argparse(parser,
+        include_period=True,
+        include_sat=1,
+        include_channels=False,
+        include_temperatures=False,
+        include_version=("0.8rc1", "2.0.0"))
+
+    parser.add_argument("--resolution", action="store", type=float,
+        default=1.0,
+        help="Grid resolution in degrees latitude and longitude.  Must "
+             "divide 180.")
+
+    parser.add_argument("--workers", action="store", type=int,
+        default=1,
+        help="Number of worker processes gridding days in parallel.")
+
+    parser.add_argument("--merge", action="store", type=str,
+        nargs="+",
+        help="Rather than reading the FCDR, merge these partial grids "
+             "into the product for the month starting at from_date.")
+
+    return parser
+
+def parse_cmdline():
+    return get_parser().parse_args()
+
+class GriddedFCDR:
+    """Accumulate easy FCDR brightness temperatures on a lat/lon grid
+
+    Parameters
+    ----------
+
+    resolution : float, optional
+        Grid spacing in degrees, the same for latitude and longitude.
+        Must divide 180.  Defaults to 1.
+    channels : array_like, optional
+        Channels to grid.  Defaults to 1–19.
+
+    Attributes
+    ----------
+
+    bt : `~FCDR_HIRS.running_stats.RunningStats`
+        Brightness temperature statistics with shape ``(lat, lon,
+        channel)``.
+    sum_weights : ndarray
+        Per cell and channel, sum of the inverse squared independent
+        uncertainty.
+    sum_weighted_bt : ndarray
+        Per cell and channel, sum of brightness temperature times weight.
+    sum_u_structured : ndarray
+        Per cell and channel, sum of structured uncertainty.
+    sum_u_common : ndarray
+        Per cell and channel, sum of common uncertainty.
+
+    Examples
+    --------
+
+    >>> g = GriddedFCDR(2.5)
+    >>> for ds in iter_easy_orbits(h, start, end, "0.8rc1", "2.0.0"):
+    ...     g.add(ds)
+    >>> g.merge(g_other_days).to_xarray()
+    """
+
+    _sums = ("sum_weights", "sum_weighted_bt", "sum_u_structured",
+             "sum_u_common")
+
+    def __init__(self, resolution=1.0, channels=range(1, 20)):
+        nlat = int(round(180/resolution))
+        if not numpy.isclose(nlat*resolution, 180):
+            raise ValueError(f"Resolution must divide 180, got "
+                             f"{resolution:g}")
+        self.resolution = resolution
+        self.channels = numpy.asarray(channels)
+        self.lat = -90 + resolution*(numpy.arange(nlat) + 0.5)
+        self.lon = -180 + resolution*(numpy.arange(2*nlat) + 0.5)
+        shape = (self.lat.size, self.lon.size, self.channels.size)
+        self.bt = running_stats.RunningStats(shape)
+        for k in self._sums:
+            setattr(self, k, numpy.zeros(shape))
+
+    @property
+    def shape(self):
+        return self.bt.shape
+
+    def cell_index(self, lat, lon):
+        """Flat index of grid cell for each location
+
+        Parameters
+        ----------
+
+        lat : array_like
+            Latitude in degrees.
+        lon : array_like
+            Longitude in degrees, any range.
+
+        Returns
+        -------
+
+        ndarray, int
+            Flat index into the first two dimensions of `shape`, -1
+            where latitude or longitude are invalid.
+        """
+        lat = numpy.ma.filled(numpy.ma.asanyarray(lat).astype("f8"),
+                              numpy.nan)
+        lon = numpy.ma.filled(numpy.ma.asanyarray(lon).astype("f8"),
+                              numpy.nan)
+        ok = numpy.isfinite(lat) & numpy.isfinite(lon) & (abs(lat) <= 90)
+        (nlat, nlon) = self.shape[:2]
+        with numpy.errstate(invalid="ignore"):
+            i = numpy.clip(numpy.floor((lat+90)/self.resolution),
+                           0, nlat-1)
+            j = numpy.clip(numpy.floor(((lon+180) % 360)/self.resolution),
+                           0, nlon-1)
+        return numpy.where(ok, numpy.where(ok, i*nlon + j, 0), -1).astype("i8")
+
+    def add(self, ds):
+        """Add easy FCDR data
+
+        Parameters
+        ----------
+
+        ds : xarray.Dataset
+            Easy FCDR, such as one orbit, with at least the fields in
+            `easy_fields` and the dimensions ``y``, ``x``, and
+            ``channel``.
+        """
+        ds = ds.sel(channel=self.channels)
+        bad = ((2*ds["u_structured"] > ds["bt"]) |
+               ((ds["quality_scanline_bitmask"].astype("uint8") & 1)!=0) |
+               ((ds["quality_channel_bitmask"].astype("uint8") & 1)!=0))
+        dims = ("y", "x", "channel")
+        nch = self.channels.size
+        (bt, u_ind, u_str, u_com) = (
+            ds[f].broadcast_like(ds["bt"]).transpose(*dims).values.reshape(
+                -1, nch).astype("f8")
+            for f in ("bt", "u_independent", "u_structured", "u_common"))
+        ok = (~bad.broadcast_like(ds["bt"]).transpose(*dims).values.reshape(
+                -1, nch)
+              & numpy.isfinite(bt) & numpy.isfinite(u_ind) & (u_ind > 0)
+              & numpy.isfinite(u_str) & numpy.isfinite(u_com))
+        cells = self.cell_index(
+            ds["latitude"].transpose("y", "x").values.ravel(),
+            ds["longitude"].transpose("y", "x").values.ravel())
+        ok &= (cells >= 0)[:, numpy.newaxis]
+        self.bt.add_grouped(numpy.where(ok, bt, numpy.nan), cells)
+        idx = (cells[:, numpy.newaxis]*nch + numpy.arange(nch))[ok]
+        size = int(numpy.prod(self.shape))
+        w = 1/u_ind[ok]**2
+        for (k, v) in (("sum_weights", w),
+                       ("sum_weighted_bt", w*bt[ok]),
+                       ("sum_u_structured", u_str[ok]),
+                       ("sum_u_common", u_com[ok])):
+            setattr(self, k, getattr(self, k)
+                + numpy.bincount(idx, v, minlength=size).reshape(self.shape))
+
+    def merge(self, other):
+        """Merge grid accumulated by another accumulator
+
+        Parameters
+        ----------
+
+        other : GriddedFCDR
+            Accumulator on the same grid for the same channels.
+
+        Returns
+        -------
+
+        GriddedFCDR
+            This accumulator, updated in place.
+        """
+        if (other.shape != self.shape
+                or other.resolution != self.resolution
+                or not numpy.array_equal(other.channels, self.channels)):
+            raise ValueError("Cannot merge grids with different "
+                             "resolution or channels")
+        self.bt.merge(other.bt)
+        for k in self._sums:
+            setattr(self, k, getattr(self, k) + getattr(other, k))
+        return self
+
+    def to_xarray(self):
+        """Convert to dataset, for storage or plotting
+
+        Returns
+        -------
+
+        xarray.Dataset
+            Gridded product with dimensions ``("lat", "lon",
+            "channel")``.  See module documentation for the contents.
+            Variables starting with ``sum_`` and ``bt_m2`` are needed by
+            `from_xarray` to merge products further.
+        """
+        dims = ("lat", "lon", "channel")
+        coords = {"lat": self.lat, "lon": self.lon,
+                  "channel": self.channels}
+        ds = self.bt.to_xarray(dims, coords).rename(
+            {k: f"bt_{k:s}" for k in ("mean", "m2", "minimum", "maximum",
+                                      "std")})
+        n = self.bt.count
+        with numpy.errstate(invalid="ignore", divide="ignore"):
+            ds["bt_weighted_mean"] = (dims,
+                self.sum_weighted_bt / self.sum_weights)
+            ds["u_independent"] = (dims, 1/numpy.sqrt(self.sum_weights))
+            ds["u_structured"] = (dims,
+                numpy.where(n > 0, self.sum_u_structured / n, numpy.nan))
+            ds["u_common"] = (dims,
+                numpy.where(n > 0, self.sum_u_common / n, numpy.nan))
+        for k in self._sums:
+            ds[k] = (dims, getattr(self, k))
+        for k in ("bt_mean", "bt_std", "bt_minimum", "bt_maximum",
+                  "bt_weighted_mean", "u_independent", "u_structured",
+                  "u_common", "sum_u_structured", "sum_u_common"):
+            ds[k].attrs["units"] = "K"
+        ds["bt_m2"].attrs["units"] = "K^2"
+        ds["sum_weights"].attrs["units"] = "K^-2"
+        ds["sum_weighted_bt"].attrs["units"] = "K^-1"
+        ds["lat"].attrs["units"] = "degrees_north"
+        ds["lon"].attrs["units"] = "degrees_east"
+        ds.attrs["resolution"] = self.resolution
+        return ds
+
+    @classmethod
+    def from_xarray(cls, ds):
+        """Reconstruct accumulator from dataset written by `to_xarray`
+
+        Parameters
+        ----------
+
+        ds : xarray.Dataset
+            Dataset as returned by `to_xarray`.
+
+        Returns
+        -------
+
+        GriddedFCDR
+            Accumulator that can be updated and merged further.
+        """
+        g = cls(float(ds.attrs["resolution"]), ds["channel"].values)
+        g.bt = running_stats.RunningStats.from_xarray(xarray.Dataset(
+            {"count": ds["count"],
+             **{k: ds[f"bt_{k:s}"]
+                for k in ("mean", "m2", "minimum", "maximum")}}))
+        for k in cls._sums:
+            setattr(g, k, ds[k].values.astype("f8"))
+        return g
+
+def iter_easy_orbits(hirs, start, end, data_version, format_version):
+    """Read easy FCDR orbit by orbit
+
+    Orbit files that cannot be read are skipped with a warning.
+
+    Parameters
+    ----------
+
+    hirs : `~FCDR_HIRS.fcdr.HIRSFCDR`
+        HIRS FCDR object in L1C read mode.
+    start : datetime.datetime
+        Start of period.
+    end : datetime.datetime
+        End of period.
+    data_version : str
+        FCDR data version.
+    format_version : str
+        FCDR format version.
+
+    Yields
+    ------
+
+    xarray.Dataset
+        Fields `easy_fields` for each orbit file, only for scanlines in
+        the period and later than those in any preceding orbit file.
+    """
+    last = None
+    for gran in hirs.find_granules_sorted(start, end,
+            include_last_before=True,
+            data_version=data_version,
+            format_version=format_version,
+            fcdr_type="easy"):
+        try:
+            (ds, _) = hirs.read(gran, fields=easy_fields)
+        except (DataFileError, OSError, KeyError) as e:
+            logger.warning(f"Cannot read {gran!s}, skipping: {e!r}")
+            continue
+        t = ds["time"].values
+        keep = (t >= numpy.datetime64(start)) & (t < numpy.datetime64(end))
+        if last is not None:
+            keep &= t > last
+        if not keep.any():
+            continue
+        last = t[keep].max()
+        yield ds.isel(y=keep)
+
+def grid_period(satname, start, end, resolution=1.0,
+        data_version="0.8rc1", format_version="2.0.0"):
+    """Grid easy FCDR for period
+
+    Parameters
+    ----------
+
+    satname : str
+        Satellite name.
+    start : datetime.datetime
+        Start of period.
+    end : datetime.datetime
+        End of period.
+    resolution : float, optional
+        Grid spacing in degrees.  Defaults to 1.
+    data_version : str, optional
+        FCDR data version.
+    format_version : str, optional
+        FCDR format version.
+
+    Returns
+    -------
+
+    GriddedFCDR
+        Accumulated grid.
+    """
+    h = fcdr.which_hirs_fcdr(satname, read="L1C")
+    g = GriddedFCDR(resolution)
+    for ds in iter_easy_orbits(h, start, end, data_version,
+                               format_version):
+        g.add(ds)
+    return g
+
+def _grid_in_worker(*args):
+    return grid_period(*args).to_xarray()
+
+def grid_month(satname, year, month, resolution=1.0,
+        data_version="0.8rc1", format_version="2.0.0", workers=1):
+    """Grid easy FCDR for one month
+
+    With more than one worker, each worker grids a single day, and the
+    days are merged.
+
+    Parameters
+    ----------
+
+    satname : str
+        Satellite name.
+    year : int
+        Year.
+    month : int
+        Month.
+    resolution : float, optional
+        Grid spacing in degrees.  Defaults to 1.
+    data_version : str, optional
+        FCDR data version.
+    format_version : str, optional
+        FCDR format version.
+    workers : int, optional
+        Number of worker processes.  Defaults to 1.
+
+    Returns
+    -------
+
+    GriddedFCDR
+        Grid for the month.
+    """
+    start = datetime.datetime(year, month, 1)
+    ndays = calendar.monthrange(year, month)[1]
+    end = start + datetime.timedelta(days=ndays)
+    logger.info(f"Gridding {satname:s} easy FCDR for {start:%Y-%m} at "
+                f"{resolution:g}°")
+    if workers == 1:
+        return grid_period(satname, start, end, resolution, data_version,
+                           format_version)
+    g = GriddedFCDR(resolution)
+    days = [start + datetime.timedelta(days=i) for i in range(ndays)]
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers) as executor:
+        futures = [executor.submit(_grid_in_worker, satname, sd,
+                       sd + datetime.timedelta(days=1), resolution,
+                       data_version, format_version)
+                   for sd in days]
+        for fut in concurrent.futures.as_completed(futures):
+            g.merge(GriddedFCDR.from_xarray(fut.result()))
+    return g
+
+def get_product_file(satname, year, month, resolution, data_version):
+    """Path to the monthly gridded product
+
+    Located under ``HIRS_L3_monthly/{satname}`` in the ``fiddatadir`` in
+    the ``[main]`` section of the configuration.
+    """
+    return pathlib.Path(config.conf["main"]["fiddatadir"],
+        "HIRS_L3_monthly", satname,
+        f"hirs_l3_{satname:s}_{year:04d}{month:02d}_"
+        f"{resolution:g}deg_v{data_version:s}.nc")
+
+def store_product(ds, path):
+    """Store gridded product
+
+    Written to a temporary file first, which is then moved into place.
+    """
+    path = pathlib.Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    (fd, tmp) = tempfile.mkstemp(dir=path.parent,
+        prefix=f".{path.stem:s}.", suffix=".nc")
+    os.close(fd)
+    try:
+        ds.to_netcdf(tmp,
+            encoding={k: {"zlib": True, "complevel": 4}
+                      for k in ds.data_vars})
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+def main():
+    """Main function, expects commandline input
+
+    Grids each calendar month starting between from_date and to_date.
+    """
+    p = parse_cmdline()
+    common.set_logger(
+        logging.DEBUG if p.verbose else logging.INFO,
+        p.log,
+        loggers={"FCDR_HIRS", "typhon"})
+    start = datetime.datetime.strptime(p.from_date, p.datefmt)
+    end = datetime.datetime.strptime(p.to_date, p.datefmt)
+    if p.merge:
+        g = None
+        attrs = None
+        for f in p.merge:
+            with xarray.open_dataset(f) as ds:
+                part = GriddedFCDR.from_xarray(ds.load())
+                part_attrs = {k: ds.attrs[k] for k in product_attrs
+                              if k in ds.attrs}
+            g = part if g is None else g.merge(part)
+            # keep attributes on which all parts agree
+            attrs = part_attrs if attrs is None else {
+                k: v for (k, v) in attrs.items() if part_attrs.get(k) == v}
+        attrs = {"satellite": p.satname, "data_version": p.version,
+                 "format_version": p.format_version,
+                 "period": f"{start:%Y-%m}", **attrs}
+        ds = g.to_xarray()
+        ds.attrs.update(attrs)
+        of = get_product_file(p.satname, start.year, start.month,
+            g.resolution, attrs["data_version"])
+        logger.info(f"Writing merged grid to {of!s}")
+        store_product(ds, of)
+        return
+    (y, m) = (start.year, start.month)
+    while datetime.datetime(y, m, 1) < end:
+        ds = grid_month(p.satname, y, m, p.resolution, p.version,
+            p.format_version, p.workers).to_xarray()
+        ds.attrs.update(satellite=p.satname, data_version=p.version,
+                        format_version=p.format_version,
+                        period=f"{y:04d}-{m:02d}")
+        of = get_product_file(p.satname, y, m, p.resolution, p.version)
+        logger.info(f"Writing {of!s}")
+        store_product(ds, of)
+        (y, m) = (y + m//12, m%12 + 1)
@@ -0,0 +1,297 @@
+"""Daily store of IWCT temperature statistics
+
+Time series of the internal warm calibration target (IWCT) temperature,
+as plotted by `~FCDR_HIRS.analysis.timeseries`, used to be calculated
+from intermediate files with every IWCT PRT reading, or from L1B
+directly, each time a plot was made.  This module implements a store
+holding, for each satellite, day, and IWCT PRT, the count, mean, sum of
+squared deviations, minimum, and maximum of the temperature.  The store
+is appended to as new days arrive, with `IWTDailyStore.update`, such
+that plots for the full period of several satellites only need to read
+the store.
+
+Statistics are calculated by reading L1B data one day at a time,
+with the default orbit filters, and averaging the readings of each PRT
+per scanline.  Days without data are stored with a count of zero.  Along
+with the statistics, the store records when each day was summarised.  As
+L1B data may arrive late, days at the end of the store that had no data
+or that were summarised less than `IWTDailyStore.settle_days` days after
+they ended are summarised again on the next update and overwritten in
+place.  Other days already in the store are not updated.  Statistics for
+several days can be combined with `FCDR_HIRS.running_stats.RunningStats`.
+
+The store is a Zarr store with one group, chunked along the ``date``
+dimension.  This requires the optional dependency `zarr`.
+"""
+
+import datetime
+import logging
+import pathlib
+
+import numpy
+import xarray
+
+import typhon.datasets.dataset
+import typhon.datasets.tovs
+from typhon import config
+
+from .. import running_stats
+
+logger = logging.getLogger(__name__)
+
+class IWTDailyStore:
+    """Daily IWCT temperature statistics for one satellite
+
+    Parameters
+    ----------
+
+    satname : str
+        Name of satellite.
+    path : str or pathlib.Path, optional
+        Location of the store.  Defaults to
+        ``HIRS_iwt_daily/{satname}.zarr`` in the ``fiddatadir`` in the
+        ``[main]`` section of the configuration.
+
+    Examples
+    --------
+
+    >>> st = IWTDailyStore("noaa18")
+    >>> st.update(end=datetime.datetime(2017, 1, 1))
+    >>> anom = st.anomalies(st.read())
+    """
+
+    #: int : Number of days to collect before appending to the store
+    days_per_write = 30
+
+    #: int : Chunk size along date
+    date_chunk = 366
+
+    #: int : Days after the end of a day after which its L1B is complete
+    settle_days = 7
+
+    def __init__(self, satname, path=None):
+        self.satname = satname
+        if path is None:
+            path = pathlib.Path(config.conf["main"]["fiddatadir"],
+                "HIRS_iwt_daily", f"{satname:s}.zarr")
+        self.path = pathlib.Path(path)
+
+    def last_date(self):
+        """Last day in store
+
+        Returns
+        -------
+
+        datetime.date or None
+            Last day in the store, or None if the store does not exist.
+        """
+        if not self.path.exists():
+            return None
+        with xarray.open_zarr(str(self.path)) as ds:
+            if ds.sizes["date"] == 0:
+                return None
+            return ds["date"].values[-1].astype("M8[D]").astype(
+                datetime.date)
+
+    def summarise_day(self, h, day):
+        """Calculate IWCT temperature statistics for one day
+
+        Parameters
+        ----------
+
+        h : typhon.datasets.tovs.HIRS
+            HIRS dataset object to read L1B data with.
+        day : datetime.date
+            Day to summarise.
+
+        Returns
+        -------
+
+        `~FCDR_HIRS.running_stats.RunningStats` or None
+            Statistics per PRT, or None if there are no data for the
+            day.
+        """
+        start = datetime.datetime.combine(day, datetime.time())
+        try:
+            M = h.read_period(start, start + datetime.timedelta(days=1),
+                fields=["time", "temp_iwt"])
+        except typhon.datasets.dataset.DataFileError as e:
+            logger.debug(f"No IWCT temperatures for {day:%Y-%m-%d}: "
+                         f"{e.args[0]!s}")
+            return None
+        # average readings per PRT, one value per PRT per scanline
+        T = numpy.ma.asanyarray(M["temp_iwt"]).astype("f8")
+        T = T.reshape(T.shape[:2] + (-1,)).mean(axis=2)
+        stats = running_stats.RunningStats(T.shape[1:])
+        stats.add(T)
+        return stats
+
+    def _write(self, days, nprt):
+        ds = xarray.concat(
+            [(stats if stats is not None
+              else running_stats.RunningStats((nprt,))).to_xarray(
+                ("prt",)).drop_vars("std").expand_dims(
+                    date=[numpy.datetime64(day, "D")])
+             for (day, stats) in days], dim="date")
+        ds["count"] = ds["count"].astype("u4")
+        for k in ("mean", "minimum", "maximum"):
+            ds[k].attrs["units"] = "K"
+        ds["m2"].attrs["units"] = "K^2"
+        ds["summarised"] = ("date",
+            numpy.full(len(days), numpy.datetime64(
+                datetime.datetime.now(), "s")))
+        first = self.first_date()
+        if first is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            ds.to_zarr(str(self.path), mode="w", consolidated=True,
+                encoding={k: {"chunks": (self.date_chunk,) +
+                                        ((nprt,) if "prt" in v.dims else ())}
+                          for (k, v) in ds.data_vars.items()})
+            return
+        # the store has every day from its first day, so days already in
+        # it are overwritten in place and later days appended
+        last = self.last_date()
+        old = [i for (i, (day, _)) in enumerate(days) if day <= last]
+        if old:
+            i0 = (days[old[0]][0] - first).days
+            ds.isel(date=old).to_zarr(str(self.path), mode="r+",
+                region={"date": slice(i0, i0+len(old))})
+        if len(old) < len(days):
+            ds.isel(date=slice(len(old), None)).to_zarr(str(self.path),
+                mode="a", append_dim="date", consolidated=True)
+
+    def first_date(self):
+        """First day in store
+
+        Returns
+        -------
+
+        datetime.date or None
+            First day in the store, or None if the store does not exist.
+        """
+        if not self.path.exists():
+            return None
+        with xarray.open_zarr(str(self.path)) as ds:
+            if ds.sizes["date"] == 0:
+                return None
+            return ds["date"].values[0].astype("M8[D]").astype(
+                datetime.date)
+
+    def first_unsettled_date(self):
+        """First day from which the store is to be summarised again
+
+        Returns
+        -------
+
+        datetime.date or None
+            First of the days at the end of the store that have no data
+            or were summarised less than `settle_days` days after they
+            ended, or None if there are no such days.
+        """
+        if self.last_date() is None:
+            return None
+        with xarray.open_zarr(str(self.path)) as ds:
+            date = ds["date"].values.astype("M8[D]")
+            empty = ds["count"].sum("prt").values == 0
+            early = (ds["summarised"].values <
+                     date + numpy.timedelta64(self.settle_days + 1, "D"))
+        settled = (~(empty | early)).nonzero()[0]
+        i = settled[-1] + 1 if settled.size else 0
+        if i == date.size:
+            return None
+        return date[i].astype(datetime.date)
+
+    def update(self, start=None, end=None):
+        """Summarise days not yet in the store or not yet settled
+
+        Parameters
+        ----------
+
+        start : datetime.date, optional
+            First day to summarise, if the store is empty.  Defaults to
+            the start of the dataset.  Ignored if the store already
+            contains days.
+        end : datetime.date, optional
+            Day up to which to summarise, exclusive.  Defaults to the end
+            of the dataset or to today, whichever is earlier.
+        """
+        h = typhon.datasets.tovs.which_hirs(self.satname)
+        if isinstance(start, datetime.datetime):
+            start = start.date()
+        if isinstance(end, datetime.datetime):
+            end = end.date()
+        last = self.last_date()
+        nprt = None
+        if last is not None:
+            start = (self.first_unsettled_date()
+                     or last + datetime.timedelta(days=1))
+            with xarray.open_zarr(str(self.path)) as ds:
+                nprt = ds.sizes["prt"]
+        start = start or h.start_date.date()
+        end = end or min(h.end_date.date(), datetime.date.today())
+        logger.info(f"Updating IWCT store for {self.satname:s}, "
+                    f"{start:%Y-%m-%d} – {end:%Y-%m-%d}")
+        pending = []
+        day = start
+        while day < end:
+            stats = self.summarise_day(h, day)
+            if stats is not None:
+                nprt = stats.shape[0]
+            # days without data before the first day with data are not
+            # stored, as the number of PRTs is not yet known
+            if nprt is not None:
+                pending.append((day, stats))
+            day += datetime.timedelta(days=1)
+            if pending and (len(pending) >= self.days_per_write
+                            or day >= end):
+                self._write(pending, nprt)
+                pending = []
+
+    def read(self, start=None, end=None):
+        """Read statistics from store
+
+        Parameters
+        ----------
+
+        start : datetime.date, optional
+            First day to read.  Defaults to the start of the store.
+        end : datetime.date, optional
+            Day up to which to read, exclusive.  Defaults to the end of
+            the store.
+
+        Returns
+        -------
+
+        xarray.Dataset
+            Statistics with dimensions ``("date", "prt")``, and the
+            time each day was summarised.
+        """
+        with xarray.open_zarr(str(self.path)) as ds:
+            if end is not None:
+                end = numpy.datetime64(end, "D") - numpy.timedelta64(1, "D")
+            return ds.sel(date=slice(
+                None if start is None else numpy.datetime64(start, "D"),
+                end)).load()
+
+    @staticmethod
+    def anomalies(ds):
+        """Daily mean temperature of each PRT relative to all PRTs
+
+        Parameters
+        ----------
+
+        ds : xarray.Dataset
+            Statistics as returned by `read`.
+
+        Returns
+        -------
+
+        xarray.DataArray
+            For each day and PRT, the mean temperature of that PRT minus
+            the mean temperature of all PRTs, NaN for days without data.
+        """
+        total = ds["count"].sum("prt")
+        overall = (ds["mean"].fillna(0) * ds["count"]).sum("prt") / total
+        anom = ds["mean"] - overall.where(total > 0)
+        anom.attrs["units"] = "K"
+        return anom
@@ -1,6 +1,9 @@
 """Show field on map
 
 Note that this could be more generic than just for HIRS FCDR
+
+Gridded monthly products written by `~FCDR_HIRS.analysis.grid_fcdr` can
+be shown with `plot_gridded_field`.
 """
 
 import argparse
@@ -8,6 +11,9 @@ import argparse
 import logging
 
 import datetime
+import pathlib
+import numpy
+import xarray
 import matplotlib.pyplot
 import mpl_toolkits.basemap
 
@@ -91,6 +97,56 @@ def plot_field(lon, lat, fld, filename, tit, cblabel, **kwargs):
     graphics.print_or_show(
         f, False, filename)
 
+def plot_gridded_field(path, field="bt_mean", channels=range(1, 20),
+        vmin=None, vmax=None, label=None):
+    """Plot field from gridded product on map
+
+    Plot one map per channel of a product written by
+    `~FCDR_HIRS.analysis.grid_fcdr`.  Cells are drawn with their true
+    extent, so unlike `plot_field` no cells are masked near the
+    dateline.  Figures are named after ``path``.
+
+    Parameters
+    ----------
+
+    path : str or pathlib.Path
+        Gridded product file.
+    field : str, optional
+        Name of field to plot.  Defaults to ``bt_mean``.
+    channels : array_like, optional
+        Channels to plot.  Defaults to all.
+    vmin : list[float], optional
+        Lower range per channel
+    vmax : list[float], optional
+        Upper range per channel
+    label : str, optional
+        Colorbar label, one for all.  Defaults to field name and units.
+    """
+    with xarray.open_dataset(str(path)) as ds:
+        da = ds[field].load()
+        attrs = dict(ds.attrs)
+    res = float(attrs["resolution"])
+    lon_edges = numpy.append(da["lon"].values - res/2, 180)
+    lat_edges = numpy.append(da["lat"].values - res/2, 90)
+    label = label or "{:s} [{:s}]".format(field, da.attrs.get("units", "1"))
+    vmin = vmin or [None] * len(channels)
+    vmax = vmax or [None] * len(channels)
+    for (ch, mn, mx) in zip(channels, vmin, vmax):
+        (f, a) = matplotlib.pyplot.subplots(figsize=(14, 8))
+        m = mpl_toolkits.basemap.Basemap(projection="moll", resolution="c",
+            lon_0=0, ax=a)
+        c = m.pcolormesh(lon_edges, lat_edges,
+            numpy.ma.masked_invalid(da.sel(channel=ch).values),
+            latlon=True, cmap="viridis", vmin=mn, vmax=mx)
+        m.drawcoastlines()
+        cb = m.colorbar(c)
+        cb.set_label(label)
+        a.set_title("{:s} {:s} {:s}, ch. {:d}".format(
+            attrs.get("satellite", ""), attrs.get("period", ""), field, ch))
+        graphics.print_or_show(f, False,
+            "{:s}_{:s}_{:d}.png".format(
+                pathlib.Path(path).stem, field, ch))
+
 def read_and_plot_field(satname, field, start_time, duration, channels=[],
         vmin=None, vmax=None, label="",
         **kwargs):
@@ -1,6 +1,16 @@
 """Plot some monitoring info on FCDR
 
-This needs the debug FCDR.
+This needs the debug FCDR, either as NetCDF files or in the Zarr store
+written by the ``zarr`` mode of FCDR generation (see
+`FCDR_HIRS.zarr_store`).
+
+By default, the entire period is read into memory before plotting.  With
+``--lazy``, the data for each channel are read piece by piece, one file
+or one day at a time, and reduced to binned time series, histograms, and
+joint histograms as they are read, such that memory use does not depend
+on the length of the period.  Before plotting, the pieces are read once
+for all channels to find the range of each variable, such that the
+histograms span the same range as when plotting in memory.
 """
 
 import matplotlib
@@ -23,6 +33,8 @@ from .. import fcdr
 from .. import _fcdr_defs
 from .. import common
 from .. import graphics
+from .. import factored_uncertainty
+from ..zarr_store import FCDRZarrStore
 
 
 logger = logging.getLogger(__name__)
@@ -39,11 +51,200 @@ def get_parser():
         include_temperatures=False,
         include_version=("0.8rc1", "2.0.0"))
 
+    parser.add_argument("--backend", action="store", type=str,
+        choices=("netcdf", "zarr"),
+        default="netcdf",
+        help="Read debug FCDR from NetCDF files or from the Zarr store.")
+
+    parser.add_argument("--lazy", action="store_true",
+        default=False,
+        help="Read one piece of the period at a time and reduce it "
+             "before reading the next, rather than reading the whole "
+             "period at once.  Time series are shown as means and "
+             "ranges per time bin.")
+
     return parser
 def parse_cmdline():
     return get_parser().parse_args()
 
+class ReducedVariable:
+    """Time series and histogram of a variable, accumulated piece by piece
+
+    Used by `FCDRMonitor` in lazy mode, such that memory use does not
+    depend on the length of the period.  For each time bin, the count,
+    sum, minimum, and maximum of the values are kept, as well as a
+    histogram with fixed bins over the whole period.
+
+    Parameters
+    ----------
+
+    name : str
+        Name of the variable.
+    time_edges : ndarray, datetime64
+        Edges of the time bins.
+    hist_edges : ndarray
+        Edges of the histogram bins.  Values outside are counted in the
+        outermost bins.
+    """
+
+    def __init__(self, name, time_edges, hist_edges):
+        self.name = name
+        self.attrs = {}
+        self.time_edges = time_edges
+        self.hist_edges = hist_edges
+        n = time_edges.size - 1
+        self.count = numpy.zeros(n, dtype="i8")
+        self.sum = numpy.zeros(n, dtype="f8")
+        self.min = numpy.full(n, numpy.inf)
+        self.max = numpy.full(n, -numpy.inf)
+        self.hist = numpy.zeros(hist_edges.size-1, dtype="i8")
+
+    @property
+    def units(self):
+        return self.attrs["units"]
+
+    def add(self, time, values):
+        """Add values
+
+        Parameters
+        ----------
+
+        time : ndarray, datetime64
+            Time for each value.
+        values : ndarray
+            Values, same shape as ``time``.  Non-finite values are
+            ignored.
+        """
+        ok = numpy.isfinite(values)
+        (time, values) = (time[ok], values[ok].astype("f8"))
+        idx = numpy.searchsorted(self.time_edges, time, side="right") - 1
+        inside = (idx >= 0) & (idx < self.count.size)
+        (idx, values) = (idx[inside], values[inside])
+        self.count += numpy.bincount(idx, minlength=self.count.size)
+        self.sum += numpy.bincount(idx, values, minlength=self.count.size)
+        numpy.minimum.at(self.min, idx, values)
+        numpy.maximum.at(self.max, idx, values)
+        self.hist += numpy.histogram(
+            numpy.clip(values, self.hist_edges[0], self.hist_edges[-1]),
+            bins=self.hist_edges)[0]
+
+    def all_null(self):
+        """Return True if no valid values were added
+        """
+        return self.count.sum() == 0
+
+    def mean(self):
+        """Return mean over the whole period
+        """
+        return self.sum.sum() / max(self.count.sum(), 1)
+
+    def plot(self, ax, **kwargs):
+        """Plot mean per time bin, with the range shaded
+
+        Parameters
+        ----------
+
+        ax : matplotlib.axes.Axes
+            Axes to plot in.
+        **kwargs
+            Passed on to `matplotlib.axes.Axes.plot`.
+        """
+        ok = self.count > 0
+        t = self.time_edges[:-1] + (self.time_edges[1:]-self.time_edges[:-1])/2
+        (ln,) = ax.plot(t[ok], self.sum[ok]/self.count[ok], **kwargs)
+        ax.fill_between(t[ok], self.min[ok], self.max[ok],
+            color=ln.get_color(), alpha=0.3, linewidth=0)
+
+    def plot_hist(self, ax, bins=50, **kwargs):
+        """Plot histogram over the occupied range
+
+        Parameters
+        ----------
+
+        ax : matplotlib.axes.Axes
+            Axes to plot in.
+        bins : int, optional
+            Number of bins to show.  Defaults to 50.
+        **kwargs
+            Passed on to `matplotlib.axes.Axes.hist`.
+        """
+        occupied = numpy.nonzero(self.hist)[0]
+        if occupied.size == 0:
+            return
+        centres = (self.hist_edges[1:] + self.hist_edges[:-1])/2
+        ax.hist(centres, weights=self.hist, bins=bins,
+            range=(self.hist_edges[occupied[0]],
+                   self.hist_edges[occupied[-1]+1]),
+            **kwargs)
+
+class JointHistogram:
+    """Joint histogram of two variables, accumulated piece by piece
+
+    Parameters
+    ----------
+
+    xedges : ndarray
+        Bin edges for the first variable.
+    yedges : ndarray
+        Bin edges for the second variable.
+
+    Values outside the bins are counted in the outermost bins.
+    """
+
+    def __init__(self, xedges, yedges):
+        self.xedges = xedges
+        self.yedges = yedges
+        self.counts = numpy.zeros((xedges.size-1, yedges.size-1), dtype="i8")
+
+    def add(self, x, y):
+        """Add pairs of values, ignoring pairs with any non-finite value
+        """
+        ok = numpy.isfinite(x) & numpy.isfinite(y)
+        self.counts += numpy.histogram2d(
+            numpy.clip(x[ok], self.xedges[0], self.xedges[-1]),
+            numpy.clip(y[ok], self.yedges[0], self.yedges[-1]),
+            bins=(self.xedges, self.yedges))[0].astype("i8")
+
+    def plot(self, ax, **kwargs):
+        """Plot as hexbin
+
+        Parameters
+        ----------
+
+        ax : matplotlib.axes.Axes
+            Axes to plot in.
+        **kwargs
+            Passed on to `matplotlib.axes.Axes.hexbin`.
+        """
+        (i, j) = numpy.nonzero(self.counts)
+        xc = (self.xedges[1:] + self.xedges[:-1])/2
+        yc = (self.yedges[1:] + self.yedges[:-1])/2
+        return ax.hexbin(xc[i], yc[j], C=self.counts[i, j],
+            reduce_C_function=numpy.sum, **kwargs)
+
 class FCDRMonitor:
+    """Plot overview of debug FCDR for a period
+
+    Parameters
+    ----------
+
+    start_date : datetime.datetime
+        Start of period.
+    end_date : datetime.datetime
+        End of period.
+    satname : str
+        Satellite name.
+    version : str, optional
+        FCDR data version.
+    format_version : str, optional
+        FCDR format version.
+    backend : str, optional
+        Read from "netcdf" files (default) or "zarr" store.
+    lazy : bool, optional
+        If True, read data piece by piece when plotting, see `reduce`.
+        Defaults to False.
+    """
+
     figname = ("fcdr_perf/{self.satname:s}_{tb:%Y}/ch{ch:d}/"
                "fcdr_perf_{self.satname:s}_hirs_{self.version:s}_ch{ch:d}_{tb:%Y%m%d%H%M}"
                "-{te:%Y%m%d%H%M}.png")
@@ -58,21 +259,70 @@ class FCDRMonitor:
         "quality_scanline_bitmask", "quality_channel_bitmask",
         "quality_minorframe_bitmask", "quality_pixel_bitmask"]
 
+    #: int : Number of time bins for time series in lazy mode
+    n_time_bins = 2000
+
+    #: int : Number of histogram bins per variable in lazy mode
+    n_hist_bins = 1000
+
+    #: datetime.timedelta : Length of pieces read from Zarr in lazy mode
+    piece_period = datetime.timedelta(days=1)
+
+    #: Set[str] : Fields to convert to radiance units per wavenumber
+    radiance_fields = {"R_e", "u_R_Earth_random", "u_R_Earth_nonrandom"}
+
+    #: List[Tuple[str, str]] : Pairs shown as joint distributions
+    joint_pairs = [("T_b", "u_T_b_random"), ("T_b", "u_T_b_nonrandom"),
+                   ("R_e", "u_R_Earth_random"),
+                   ("R_e", "u_R_Earth_nonrandom")]
+
+    ds = None
+    files = None
+
     def __init__(self, start_date, end_date, satname,
-            version="0.8rc1", format_version="2.0.0"):
+            version="0.8rc1", format_version="2.0.0", backend="netcdf",
+            lazy=False):
         self.hirsfcdr = fcdr.which_hirs_fcdr(satname, read="L1C")
         self.version = version
-        self.ds = self.hirsfcdr.read_period(
-            start_date,
-            end_date,
-            locator_args={"data_version": version, "fcdr_type": "debug",
-                          "format_version": format_version},
-            fields=self.fields)
+        self.backend = backend
+        self.lazy = lazy
+        self.start_date = start_date
+        self.end_date = end_date
+        if backend == "zarr":
+            # lazy; channels are loaded one by one in plot_timeseries
+            self.ds = FCDRZarrStore(satname, version).open(
+                start_date, end_date, fields=self.fields)
+        elif lazy:
+            # files are read one by one in reduce
+            self.files = list(self.hirsfcdr.find_granules_sorted(
+                start_date, end_date, include_last_before=True,
+                data_version=version, fcdr_type="debug",
+                format_version=format_version))
+        else:
+            self.ds = self.hirsfcdr.read_period(
+                start_date,
+                end_date,
+                locator_args={"data_version": version, "fcdr_type": "debug",
+                              "format_version": format_version},
+                fields=self.fields)
         self.satname = satname
 
-    def plot_timeseries(self, ch, sp=28):
+    def plot_timeseries(self, ch, sp=28, ranges=None):
         counter = itertools.count()
-        ds = self.ds.sel(calibrated_channel=ch, scanpos=sp, minor_frame=sp)
+        if self.lazy:
+            reduced = self.reduce(ch, sp, ranges)
+            if reduced is None or reduced[0]["T_b"].all_null():
+                logger.warning("Found no valid BTs for "
+                    f"channel {ch:d}, skipping")
+                return
+            (V, joints, (perc, labels), (tb, te)) = reduced
+        else:
+            (V, (perc, labels), (tb, te)) = self._load(ch, sp)
+            if not numpy.isfinite(V["T_b"]).any():
+                logger.warning("Found no valid BTs for "
+                    f"channel {ch:d}, skipping")
+                return
+            joints = {}
         nrow = 8
         gs = matplotlib.gridspec.GridSpec(nrow, 4)
         fig = matplotlib.pyplot.figure(figsize=(18, 3*nrow))
@@ -84,11 +334,6 @@ class FCDRMonitor:
 #        for v in self.fields:
 #            ds[v][bad] = numpy.nan 
 
-        if not numpy.isfinite(ds["T_b"]).any():
-            logger.warning("Found no valid BTs for "
-                f"channel {ch:d}, skipping")
-            return
-
         c = next(counter)
         a_tb = fig.add_subplot(gs[c, :3])
         a_tb_h = fig.add_subplot(gs[c, 3])
@@ -102,26 +347,13 @@ class FCDRMonitor:
         a_tb_ucmp = fig.add_subplot(gs[c, :3])
         a_tb_ucmp_h = fig.add_subplot(gs[c, 3])
         
-        bad = (
-            (ds["quality_scanline_bitmask"]&_fcdr_defs.FlagsScanline.DO_NOT_USE) |
-            (ds["quality_channel_bitmask"]&_fcdr_defs.FlagsChannel.DO_NOT_USE) |
-            (ds["quality_pixel_bitmask"]&_fcdr_defs.FlagsPixel.DO_NOT_USE)
-            )!=0
-        
-        # This doesn't work
-        # ds[["T_b","u_T_b_random","u_T_b_nonrandom"]][{"scanline_earth": bad}] = numpy.nan
-        for fld in {f for f in self.fields
-                    if f.startswith("u_")
-                    or f in {"T_b", "R_e"}}:
-            ds[fld].loc[{"scanline_earth": bad}] = numpy.nan
-
         self._plot_var_with_unc(
-            ds["T_b"],
-            ds["u_T_b_random"],
-            ds["u_T_b_nonrandom"],
+            V["T_b"],
+            V["u_T_b_random"],
+            V["u_T_b_nonrandom"],
             a_tb, a_tb_h, a_tb_u, a_tb_u_h)
 
-        dsu = ds[[x for x in ds.data_vars.keys() if x.startswith("u_from_")]]
+        dsu = {k: v for (k, v) in V.items() if k.startswith("u_from_")}
         self._plot_unc_comps(dsu, a_tb_ucmp, a_tb_ucmp_h)
 
         # flags
@@ -132,17 +364,6 @@ class FCDRMonitor:
         # because there are many flags and each should be readable
         # individually.
         a_flags = fig.add_subplot(gs[c:c+2, :])
-        perc_all = []
-        labels = []
-        period = ("5min" if
-            (ds["time"][-1]-ds["time"][0]).values.astype("m8[s]") < numpy.timedelta64(2, 'h')
-            else "1H")
-        for f in ("scanline", "channel", "minorframe", "pixel"):
-            da = ds[f"quality_{f:s}_bitmask"]
-            (perc, meanings) = common.sample_flags(da, period, "scanline_earth")
-            perc_all.append(perc)
-            labels.extend(f"{f:s}_{mean:s}" for mean in meanings)
-        perc = xarray.concat(perc_all, dim="flag")
         # this causes trouble when all values become nan (no flags set
         # during plotting period); and there are real nans (no data in
         # period)
@@ -169,28 +390,17 @@ class FCDRMonitor:
         a_L_u_h = fig.add_subplot(gs[c, 3])
 
         self._plot_var_with_unc(
-            UADA(ds["R_e"]).to(rad_u["ir"], "radiance"),
-            UADA(ds["u_R_Earth_random"]).to(rad_u["ir"], "radiance"),
-            UADA(ds["u_R_Earth_nonrandom"]).to(rad_u["ir"], "radiance"),
+            V["R_e"],
+            V["u_R_Earth_random"],
+            V["u_R_Earth_nonrandom"],
             a_L, a_L_h, a_L_u, a_L_u_h)
 
         c = next(counter)
         gridsize = 50
         cmap = "viridis"
-        self._plot_hexbin(
-            ds["T_b"], ds["u_T_b_random"],
-            fig.add_subplot(gs[c, 0]))
-        self._plot_hexbin(
-            ds["T_b"], ds["u_T_b_nonrandom"],
-            fig.add_subplot(gs[c, 1]))
-        self._plot_hexbin(
-            UADA(ds["R_e"]).to(rad_u["ir"], "radiance"),
-            UADA(ds["u_R_Earth_random"]).to(rad_u["ir"], "radiance"),
-            fig.add_subplot(gs[c, 2]))
-        hb = self._plot_hexbin(
-            UADA(ds["R_e"]).to(rad_u["ir"], "radiance"),
-            UADA(ds["u_R_Earth_nonrandom"]).to(rad_u["ir"], "radiance"),
-            fig.add_subplot(gs[c, 3]))
+        for (i, (x, y)) in enumerate(self.joint_pairs):
+            hb = self._plot_hexbin(V[x], V[y],
+                fig.add_subplot(gs[c, i]), joints.get((x, y)))
         # todo: colorbar
 
         fig.subplots_adjust(right=0.8, bottom=0.2, top=0.9, hspace=1.0,
@@ -218,22 +428,290 @@ class FCDRMonitor:
         a_L_h.set_xlabel(a_L.get_ylabel())
         a_L_u_h.set_xlabel(a_L_u.get_ylabel())
 
-        tb = ds["time"].values[0].astype("M8[s]").astype(datetime.datetime)
-        te = ds["time"].values[-1].astype("M8[s]").astype(datetime.datetime)
+        tb = tb.astype("M8[s]").astype(datetime.datetime)
+        te = te.astype("M8[s]").astype(datetime.datetime)
         fig.suptitle(self.figtit.format(tb=tb, te=te,
             self=self, ch=ch, sp=sp))
 
         graphics.print_or_show(fig, False,
             self.figname.format(tb=tb, te=te, self=self, ch=ch))
 
+    def _load(self, ch, sp):
+        """Load channel and scan position for entire period
+
+        Returns variables to plot, with radiances in radiance units per
+        wavenumber, flag percentages and labels, and first and last time.
+        """
+        ds = self.ds.sel(calibrated_channel=ch, scanpos=sp, minor_frame=sp).load()
+
+        bad = (
+            (ds["quality_scanline_bitmask"]&_fcdr_defs.FlagsScanline.DO_NOT_USE) |
+            (ds["quality_channel_bitmask"]&_fcdr_defs.FlagsChannel.DO_NOT_USE) |
+            (ds["quality_pixel_bitmask"]&_fcdr_defs.FlagsPixel.DO_NOT_USE)
+            )!=0
+        
+        # This doesn't work
+        # ds[["T_b","u_T_b_random","u_T_b_nonrandom"]][{"scanline_earth": bad}] = numpy.nan
+        for fld in {f for f in self.fields
+                    if f.startswith("u_")
+                    or f in {"T_b", "R_e"}}:
+            ds[fld].loc[{"scanline_earth": bad}] = numpy.nan
+
+        perc_all = []
+        labels = []
+        period = ("5min" if
+            (ds["time"][-1]-ds["time"][0]).values.astype("m8[s]") < numpy.timedelta64(2, 'h')
+            else "1H")
+        for f in ("scanline", "channel", "minorframe", "pixel"):
+            da = ds[f"quality_{f:s}_bitmask"]
+            (perc, meanings) = common.sample_flags(da, period, "scanline_earth")
+            perc_all.append(perc)
+            labels.extend(f"{f:s}_{mean:s}" for mean in meanings)
+        perc = xarray.concat(perc_all, dim="flag")
+
+        V = dict(ds.data_vars)
+        for k in self.radiance_fields:
+            V[k] = UADA(ds[k]).to(rad_u["ir"], "radiance")
+        return (V, (perc, labels), (ds["time"].values[0], ds["time"].values[-1]))
+
+    def _hist_edges(self, k, ranges):
+        """Histogram bin edges for lazy mode
+
+        Spanning the range of the values found by `value_ranges`, as
+        the automatic range when plotting in memory does.
+        """
+        (lo, hi) = ranges.get(k, (0, 1))
+        if not hi > lo:
+            (lo, hi) = (lo - max(abs(lo)*1e-6, 1e-12),
+                        hi + max(abs(hi)*1e-6, 1e-12))
+        return numpy.linspace(lo, hi, self.n_hist_bins+1)
+
+    def _iter_valid(self, channels, sp):
+        """Yield scanlines within period and not seen before, per piece
+
+        For each piece and each channel, yields the channel, the piece
+        for that channel restricted to those scanlines, their times, and
+        the values of each variable to reduce, with values flagged as do
+        not use set to NaN.
+        """
+        t0 = numpy.datetime64(self.start_date, "ms")
+        t1 = numpy.datetime64(self.end_date, "ms")
+        last = None
+        for piece in self._iter_pieces(channels, sp):
+            t = piece["scanline_earth"].values.astype("M8[ms]")
+            keep = (t >= t0) & (t < t1)
+            if last is not None:
+                keep &= t > last
+            if not keep.any():
+                continue
+            piece = piece.isel(scanline_earth=numpy.nonzero(keep)[0])
+            t = t[keep]
+            last = t.max()
+            for ch in channels:
+                chpiece = (piece.sel(calibrated_channel=ch)
+                    if "calibrated_channel" in piece.dims else piece)
+                yield (ch, chpiece, t, self._valid_values(chpiece, t))
+
+    def _valid_values(self, piece, t):
+        """Values to reduce for a piece with a single channel
+        """
+        bad = ((
+            (piece["quality_scanline_bitmask"]&_fcdr_defs.FlagsScanline.DO_NOT_USE) |
+            (piece["quality_channel_bitmask"]&_fcdr_defs.FlagsChannel.DO_NOT_USE) |
+            (piece["quality_pixel_bitmask"]&_fcdr_defs.FlagsPixel.DO_NOT_USE)
+            )!=0).transpose("scanline_earth", ...).values.reshape(
+                t.size, -1).any(axis=1)
+        values = {}
+        for k in piece.data_vars:
+            if not (k.startswith("u_") or k in {"T_b", "R_e"}):
+                continue
+            da = piece[k]
+            if k in self.radiance_fields:
+                da = UADA(da).to(rad_u["ir"], "radiance")
+            v = da.transpose("scanline_earth", ...).values.reshape(
+                t.size, -1).astype("f8")
+            v[bad, :] = numpy.nan
+            values[k] = (da.attrs, v)
+        return values
+
+    def value_ranges(self, channels, sp=28):
+        """Find range of each variable, in one pass over all pieces
+
+        The pieces are read once for all channels, such that plotting
+        several channels in lazy mode reads each piece only once more
+        per channel, see `reduce`.
+
+        Parameters
+        ----------
+
+        channels : Sequence[int]
+            Channels for which to find the ranges.
+        sp : int, optional
+            Scan position.  Defaults to 28.
+
+        Returns
+        -------
+
+        Dict[int, Dict[str, Tuple[float, float]]]
+            Per channel, smallest and largest finite value per variable.
+        """
+        ranges = {ch: {} for ch in channels}
+        for (ch, _, _, values) in self._iter_valid(channels, sp):
+            for (k, (_, v)) in values.items():
+                v = v[numpy.isfinite(v)]
+                if v.size == 0:
+                    continue
+                (lo, hi) = ranges[ch].get(k, (numpy.inf, -numpy.inf))
+                ranges[ch][k] = (min(lo, v.min()), max(hi, v.max()))
+        return ranges
+
+    def _iter_pieces(self, channels, sp):
+        """Yield data for channels and scan position, one piece at a time
+        """
+        sel = {"calibrated_channel": list(channels), "scanpos": sp,
+               "minor_frame": sp}
+        if self.backend == "zarr":
+            ds = self.ds.sel({d: v for (d, v) in sel.items() if d in self.ds.dims})
+            t = self.start_date
+            while t < self.end_date:
+                yield factored_uncertainty.expand(
+                    FCDRZarrStore.select_period(ds, t, t+self.piece_period).load())
+                t += self.piece_period
+            return
+        for path in self.files:
+            logger.debug(f"Reading {path!s}")
+            with xarray.open_dataset(str(path)) as ds:
+                names = [f for f in self.fields if f in ds.data_vars]
+                for f in self.fields:
+                    if f"{f:s}_magnitude" in ds.data_vars:
+                        names.extend([f"{f:s}_magnitude",
+                            ds[f"{f:s}_magnitude"].attrs["sensitivity"]])
+                piece = ds[list(dict.fromkeys(names))]
+                yield factored_uncertainty.expand(piece.sel(
+                    {d: v for (d, v) in sel.items() if d in piece.dims}).load())
+
+    def reduce(self, ch, sp=28, ranges=None):
+        """Read channel and scan position piece by piece and reduce
+
+        Pieces are files with the NetCDF backend and `piece_period` with
+        the Zarr backend.  Only the selected channel and scan position
+        are loaded from each piece.  Scanlines already seen in a previous
+        piece are skipped.  Histogram bins span the range of each
+        variable, which unless passed is found in a first pass over all
+        pieces, see `value_ranges`.  In a second pass, each piece is reduced to binned time series and
+        histograms (see `ReducedVariable`), joint histograms for the
+        pairs in `joint_pairs` (see `JointHistogram`), and flag counts,
+        before the next piece is read.
+
+        Parameters
+        ----------
+
+        ch : int
+            Channel.
+        sp : int, optional
+            Scan position.  Defaults to 28.
+        ranges : Dict[str, Tuple[float, float]], optional
+            Range of each variable for this channel, as returned per
+            channel by `value_ranges`.
+
+        Returns
+        -------
+
+        Tuple or None
+            Dictionary of `ReducedVariable`, dictionary of
+            `JointHistogram` per pair, flag percentages with labels as
+            for `~FCDR_HIRS.common.sample_flags`, and first and last
+            time.  None if no data were found.
+        """
+        t0 = numpy.datetime64(self.start_date, "ms")
+        t1 = numpy.datetime64(self.end_date, "ms")
+        time_edges = t0 + numpy.arange(self.n_time_bins+1)*(
+            (t1-t0)//self.n_time_bins)
+        time_edges[-1] = t1
+        step = (numpy.timedelta64(5, "m")
+                if t1-t0 < numpy.timedelta64(2, "h")
+                else numpy.timedelta64(1, "h"))
+        flag_edges = numpy.arange(t0, t1+step, step)
+        if ranges is None:
+            ranges = self.value_ranges([ch], sp)[ch]
+        V = {}
+        joints = {}
+        flags = {}
+        (first, last) = (None, None)
+        for (_, piece, t, values) in self._iter_valid([ch], sp):
+            first = t.min() if first is None else first
+            last = t.max()
+            for (k, (attrs, v)) in values.items():
+                if k not in V:
+                    V[k] = ReducedVariable(k, time_edges,
+                        self._hist_edges(k, ranges))
+                    V[k].attrs = dict(attrs)
+                V[k].add(numpy.repeat(t, v.shape[1]), v.ravel())
+            values = {k: v.ravel() for (k, (_, v)) in values.items()}
+            for (x, y) in self.joint_pairs:
+                if x not in values or y not in values:
+                    continue
+                if (x, y) not in joints:
+                    joints[(x, y)] = JointHistogram(
+                        self._hist_edges(x, ranges),
+                        self._hist_edges(y, ranges))
+                joints[(x, y)].add(values[x], values[y])
+            idx = numpy.searchsorted(flag_edges, t, side="right") - 1
+            for f in ("scanline", "channel", "minorframe", "pixel"):
+                da = piece[f"quality_{f:s}_bitmask"]
+                masks = numpy.atleast_1d(da.flag_masks).astype("i8")
+                if f not in flags:
+                    flags[f] = (da.flag_meanings.split(),
+                        numpy.zeros((flag_edges.size-1, masks.size)),
+                        numpy.zeros(flag_edges.size-1))
+                v = da.transpose("scanline_earth", ...).values.reshape(
+                    t.size, -1).astype("i8")
+                numpy.add.at(flags[f][1], idx,
+                    ((v[:, :, numpy.newaxis] & masks) != 0).mean(axis=1))
+                flags[f][2][:] += numpy.bincount(idx,
+                    minlength=flag_edges.size-1)
+        if first is None:
+            return None
+        perc_all = []
+        labels = []
+        for (f, (meanings, n_set, n)) in flags.items():
+            with numpy.errstate(invalid="ignore", divide="ignore"):
+                perc_all.append(xarray.DataArray(
+                    100*n_set/n[:, numpy.newaxis],
+                    dims=("time", "flag"),
+                    coords={"time": flag_edges[:-1]}))
+            labels.extend(f"{f:s}_{mean:s}" for mean in meanings)
+        perc = xarray.concat(perc_all, dim="flag")
+        return (V, joints, (perc, labels), (first, last))
+
+    @staticmethod
+    def _all_null(da):
+        if isinstance(da, ReducedVariable):
+            return da.all_null()
+        return bool(da.isnull().all())
+
+    @staticmethod
+    def _plot_series(da, ax, **kwargs):
+        if isinstance(da, ReducedVariable):
+            da.plot(ax, **kwargs)
+        else:
+            da.plot(ax=ax, **kwargs)
+
+    @staticmethod
+    def _plot_hist(da, ax, **kwargs):
+        if isinstance(da, ReducedVariable):
+            da.plot_hist(ax, **kwargs)
+        else:
+            da.plot.hist(ax=ax, **kwargs)
+
     def _plot_var_with_unc(self, da, da_rand, da_nonrand, a, a_h, a_u, a_u_h):
         unit = ureg(da.units).u
         name = getattr(da.attrs, "long_name", da.name)
-        if da.isnull().all():
+        if self._all_null(da):
             logger.error("All nans :(")
             return
-        da.plot(ax=a)
-        da.plot.hist(ax=a_h)
+        self._plot_series(da, a)
+        self._plot_hist(da, a_h)
         a.set_xlabel("Time")
         a.set_ylabel("{name:s}\n[{unit:~}]".format(
             name=name, unit=unit))
@@ -241,8 +719,8 @@ class FCDRMonitor:
         a_h.set_title("Histogram of {:s}".format(name))
 
         for d in (da_rand, da_nonrand):
-            d.plot(ax=a_u, label=d.name)
-            d.plot.hist(ax=a_u_h, label=d.name, histtype="step")
+            self._plot_series(d, a_u, label=d.name)
+            self._plot_hist(d, a_u_h, label=d.name, histtype="step")
         
         a_u_h.legend(loc="upper left", bbox_to_anchor=(1.0, 1.0))
         a_u.set_title("Uncertainty timeseries of {:s}".format(name))
@@ -251,12 +729,12 @@ class FCDRMonitor:
 
     def _plot_unc_comps(self, ds, a, a_h, n=8):
         # take 8 largest
-        for k in [x[-1] for x in sorted([(x.mean(), k) for (k, x) in ds.data_vars.items()])[-1:-n-1:-1]]:
+        for k in [x[-1] for x in sorted([(x.mean(), k) for (k, x) in ds.items()])[-1:-n-1:-1]]:
             da = ds[k]
-            if da.isnull().all():
+            if self._all_null(da):
                 continue
-            da.plot(ax=a, label=k[7:])
-            da.plot.hist(ax=a_h, label=k[7:], histtype="step")
+            self._plot_series(da, a, label=k[7:])
+            self._plot_hist(da, a_h, label=k[7:], histtype="step")
 
         a_h.legend(loc="upper left", bbox_to_anchor=(1.0, 1.0))
         a.set_title("Uncertainty components")
@@ -266,14 +744,18 @@ class FCDRMonitor:
         a.set_xlabel("Time")
         a_h.set_title("Uncertainty hists")
 
-    def _plot_hexbin(self, da, Δda, a):
+    def _plot_hexbin(self, da, Δda, a, joint=None):
         unit = ureg(da.units).u
         name = getattr(da.attrs, "long_name", da.name)
-        if da.isnull().all():
+        if self._all_null(da):
             logger.error("still all nans ☹")
             return
-        hb = a.hexbin(da, Δda, gridsize=50, cmap="viridis", mincnt=1,
-            marginals=False)
+        if joint is None:
+            hb = a.hexbin(da, Δda, gridsize=50, cmap="viridis", mincnt=1,
+                marginals=False)
+        else:
+            hb = joint.plot(a, gridsize=50, cmap="viridis", mincnt=1,
+                marginals=False)
         a.set_xlabel("{name:s}\n[{unit:~}]".format(name=name, unit=unit))
         a.set_ylabel(Δda.name.split("_")[-1] + r" $\Delta$" + a.get_xlabel())
         a.set_title("Joint distribution for {name:s}".format(name=name))
@@ -284,10 +766,14 @@ def plot(p):
         datetime.datetime.strptime(p.from_date, p.datefmt),
         datetime.datetime.strptime(p.to_date, p.datefmt),
         p.satname,
-        version=p.version)
+        version=p.version,
+        backend=p.backend,
+        lazy=p.lazy)
 
+    # in lazy mode, find the histogram ranges for all channels at once
+    ranges = fm.value_ranges(p.channels) if p.lazy else {}
     for ch in p.channels:
-        fm.plot_timeseries(ch)
+        fm.plot_timeseries(ch, ranges=ranges.get(ch))
 
 def main():
     # NB: https://github.com/pydata/xarray/issues/1661#issuecomment-339525582
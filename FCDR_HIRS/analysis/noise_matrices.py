@@ -0,0 +1,309 @@
+"""Count anomalies and the correlation matrices and spectra derived from them
+
+The plots in `~FCDR_HIRS.analysis.fieldmat` of the correlated noise
+between channels and between scan positions, and of its spectrum, are
+all derived from the count anomalies: the deviations of the calibration
+(or Earth) counts from their mean over a scanline.  This module
+implements `CountAnomalies`, which extracts those from L1B data once per
+satellite and period, into a compact single precision array with NaN for
+missing values, and calculates from those all channel correlation
+matrices, scan position correlation matrices, and amplitude spectra
+requested in one batched pass each.
+
+Correlation matrices are calculated by centring the valid samples,
+setting invalid samples to zero, and multiplying the resulting matrices,
+such that the matrices for all calibration positions or all channels are
+calculated at once.  Spearman correlations are calculated in the same
+way from ranks.  Amplitude spectra are calculated for every view type
+at extraction, such that Earth view anomalies, by far the largest part
+of the data, need not be kept.
+
+Count anomalies can be stored to and loaded from disk with
+`CountAnomalies.save` and `CountAnomalies.load`, such that plotting the
+same period again does not need to read L1B data at all.
+"""
+
+import logging
+
+import numpy
+import scipy.special
+import scipy.stats
+
+logger = logging.getLogger(__name__)
+
+def _corr(X, valid):
+    """Correlation matrices between variables, batched
+
+    Parameters
+    ----------
+
+    X : ndarray, shape (samples, batch, variables)
+        Values.  Values in invalid samples are ignored.
+    valid : ndarray, bool, shape (samples, batch)
+        Samples to use, per batch element.
+
+    Returns
+    -------
+
+    S : ndarray, shape (batch, variables, variables)
+        Pearson correlation matrix per batch element.
+    count : ndarray, int, shape (batch,)
+        Number of valid samples per batch element.
+    """
+    count = valid.sum(0)
+    Z = numpy.where(valid[..., numpy.newaxis], X, 0).astype("f8")
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        Z -= Z.sum(0) / count[:, numpy.newaxis]
+    Z[~valid, :] = 0
+    C = Z.transpose(1, 2, 0) @ Z.transpose(1, 0, 2)
+    d = numpy.sqrt(numpy.diagonal(C, axis1=1, axis2=2))
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        return (C / (d[:, :, numpy.newaxis] * d[:, numpy.newaxis, :]),
+                count)
+
+def _ranks(X, valid):
+    """Rank valid samples per batch element and variable, ties averaged
+    """
+    R = numpy.zeros(X.shape, dtype="f8")
+    for b in range(X.shape[1]):
+        R[valid[:, b], b, :] = scipy.stats.rankdata(
+            X[valid[:, b], b, :], axis=0)
+    return R
+
+class CountAnomalies:
+    """Count anomalies for one satellite and period
+
+    Use `extract` to create from L1B data.
+
+    Parameters
+    ----------
+
+    anomalies : Mapping[str, ndarray]
+        For each calibration view type, count anomalies with shape
+        ``(lines, positions, channels)``, NaN where missing.
+    spectra : Mapping[str, ndarray]
+        For each view type, the sum of the FFT amplitudes of all lines
+        without missing values, with shape ``(channels, frequencies)``.
+    spectra_count : Mapping[str, ndarray]
+        For each view type, the number of lines summed in ``spectra``,
+        per channel.
+    n_fft : int
+        Length of the FFT.
+
+    Examples
+    --------
+
+    >>> ca = CountAnomalies.extract(h, M)
+    >>> (S, ρ, cnt) = ca.channel_corrmat("iwt", [10, 20, 30], range(1, 20))
+    >>> (amp, cnt) = ca.fft_amplitude("Earth")
+    """
+
+    #: int : Number of lines processed at once in `extract`
+    block_size = 10000
+
+    #: Tuple[str] : View types for which anomalies may be extracted
+    view_types = ("space", "iwt", "ict", "Earth")
+
+    def __init__(self, anomalies, spectra, spectra_count, n_fft):
+        self.anomalies = dict(anomalies)
+        self.spectra = dict(spectra)
+        self.spectra_count = dict(spectra_count)
+        self.n_fft = n_fft
+
+    @classmethod
+    def extract(cls, hirs, M, n_fft=48, keep=("space", "iwt", "ict")):
+        """Extract count anomalies from L1B data
+
+        Parameters
+        ----------
+
+        hirs : typhon.datasets.tovs.HIRS
+            HIRS object with which ``M`` was read.
+        M : ndarray
+            L1B data with at least ``counts`` and the scan type field.
+        n_fft : int, optional
+            Length of FFT along scan positions.  Defaults to 48.
+        keep : Sequence[str], optional
+            View types for which to keep the anomalies.  Spectra are
+            calculated for all view types in `view_types` that ``hirs``
+            has.  Defaults to all calibration views.
+
+        Returns
+        -------
+
+        CountAnomalies
+            Count anomalies.
+        """
+        anomalies = {}
+        spectra = {}
+        spectra_count = {}
+        scantype = M[hirs.scantype_fieldname]
+        for typ in cls.view_types:
+            if not hasattr(hirs, f"typ_{typ:s}"):
+                continue
+            idx = (scantype == getattr(hirs, f"typ_{typ:s}")).nonzero()[0]
+            blocks = []
+            amp = 0
+            cnt = 0
+            for i in range(0, idx.size, cls.block_size):
+                c = numpy.ma.filled(numpy.ma.asanyarray(
+                    M["counts"][idx[i:i+cls.block_size], 8:, :]).astype("f4"),
+                    numpy.nan)
+                valid = ~numpy.isnan(c)
+                with numpy.errstate(invalid="ignore", divide="ignore"):
+                    a = c - (numpy.where(valid, c, 0).sum(1, keepdims=True)
+                             / valid.sum(1, keepdims=True))
+                complete = valid.all(1)
+                A = abs(numpy.fft.rfft(numpy.where(valid, a, 0), n=n_fft,
+                        axis=1))[:, 1:n_fft//2, :]
+                amp = amp + (A * complete[:, numpy.newaxis, :]).sum(0).T
+                cnt = cnt + complete.sum(0)
+                if typ in keep:
+                    blocks.append(a)
+            if idx.size == 0:
+                continue
+            spectra[typ] = amp
+            spectra_count[typ] = cnt
+            if typ in keep:
+                anomalies[typ] = numpy.concatenate(blocks, 0)
+            logger.debug(f"Extracted {idx.size:d} {typ:s} count anomalies")
+        return cls(anomalies, spectra, spectra_count, n_fft)
+
+    def save(self, path):
+        """Store count anomalies and spectra to ``path``
+
+        Parameters
+        ----------
+
+        path : str or pathlib.Path
+            File to write, in `numpy.savez` format.
+        """
+        numpy.savez(str(path), n_fft=self.n_fft,
+            **{f"anomalies_{k:s}": v for (k, v) in self.anomalies.items()},
+            **{f"spectra_{k:s}": v for (k, v) in self.spectra.items()},
+            **{f"lines_{k:s}": v for (k, v) in self.spectra_count.items()})
+
+    @classmethod
+    def load(cls, path):
+        """Load count anomalies stored with `save`
+
+        Parameters
+        ----------
+
+        path : str or pathlib.Path
+            File written by `save`.
+
+        Returns
+        -------
+
+        CountAnomalies
+            Count anomalies.
+        """
+        with numpy.load(str(path)) as D:
+            get = lambda pre: {k[len(pre):]: D[k] for k in D.files
+                               if k.startswith(pre)}
+            return cls(get("anomalies_"), get("spectra_"),
+                       get("lines_"), int(D["n_fft"]))
+
+    def fft_amplitude(self, typ):
+        """Mean FFT amplitude of count anomalies
+
+        Calculated from lines without missing values only.  The zero
+        frequency is excluded, as it is zero by definition.
+
+        Parameters
+        ----------
+
+        typ : str
+            View type.
+
+        Returns
+        -------
+
+        amplitude : ndarray, shape (channels, n_fft//2-1)
+            Mean amplitude per channel, for the frequencies
+            ``numpy.fft.fftfreq(n_fft)[1:n_fft//2]``.
+        count : ndarray, int, shape (channels,)
+            Number of lines per channel.
+        """
+        cnt = self.spectra_count[typ]
+        with numpy.errstate(invalid="ignore", divide="ignore"):
+            return (self.spectra[typ] / cnt[:, numpy.newaxis], cnt)
+
+    def channel_corrmat(self, typ, calibpos, channels):
+        """Correlation matrices between channels
+
+        Calculated from lines for which all channels, not only those in
+        ``channels``, have a valid anomaly at the calibration position.
+
+        Parameters
+        ----------
+
+        typ : str
+            Calibration view type.
+        calibpos : int or array_like
+            Calibration position(s).  Matrices for several positions are
+            calculated in one pass.
+        channels : array_like
+            Channel numbers.
+
+        Returns
+        -------
+
+        S : ndarray
+            Pearson correlation matrix, shape ``(channels, channels)``,
+            preceded by the shape of ``calibpos``.
+        ρ : ndarray
+            Spearman correlation matrix, same shape as ``S``.
+        count : int or ndarray
+            Number of lines used, same shape as ``calibpos``.
+        """
+        shape = numpy.shape(calibpos)
+        pos = numpy.atleast_1d(calibpos)
+        channels = numpy.asarray(channels)
+        A = self.anomalies[typ][:, pos, :]
+        valid = ~numpy.isnan(A).any(2)
+        X = A[:, :, channels-1]
+        (S, count) = _corr(X, valid)
+        (ρ, _) = _corr(_ranks(X, valid), valid)
+        nch = channels.size
+        return (S.reshape(shape + (nch, nch)),
+                ρ.reshape(shape + (nch, nch)),
+                count.reshape(shape) if shape else int(count[0]))
+
+    def position_corrmat(self, typ, channels):
+        """Correlation matrices between scan positions
+
+        Calculated for each channel from lines for which all positions
+        are valid, with p-values as by
+        `typhon.math.stats.corrcoef`.
+
+        Parameters
+        ----------
+
+        typ : str
+            Calibration view type.
+        channels : array_like
+            Channel numbers.  Matrices for all channels are calculated in
+            one pass.
+
+        Returns
+        -------
+
+        S : ndarray, shape (channels, positions, positions)
+            Pearson correlation matrix per channel.
+        p : ndarray, shape (channels, positions, positions)
+            p-value per channel.
+        count : ndarray, int, shape (channels,)
+            Number of lines used per channel.
+        """
+        channels = numpy.asarray(channels)
+        X = self.anomalies[typ][:, :, channels-1].transpose(0, 2, 1)
+        valid = ~numpy.isnan(X).any(2)
+        (S, count) = _corr(X, valid)
+        df = (count - 2)[:, numpy.newaxis, numpy.newaxis]
+        with numpy.errstate(invalid="ignore", divide="ignore"):
+            ts = S**2 * (df / (1 - S**2))
+            p = scipy.special.betainc(0.5*df, 0.5, df / (df + ts))
+        p[:, numpy.arange(S.shape[1]), numpy.arange(S.shape[1])] = 1
+        return (S, p, count)
@@ -0,0 +1,419 @@
+"""Determine optimal encodings for FCDR variables
+
+The encodings in :mod:`~FCDR_HIRS._fcdr_defs` have been chosen by hand,
+with some early experiments in :mod:`determine_optimal_uncertainty_format`
+and :mod:`determine_latlon_compression_ratio`.  This script takes a
+sample of generated FCDR orbits and, for each variable, writes it with
+a range of candidate encodings: data types and scale factors, zlib
+compression levels, shuffle, and chunk shapes.  For each it measures the
+file size, the write time, the read time, and the largest error after
+reading it back.  Among the candidates meeting the precision requirement,
+it selects the one with the lowest cost, where the cost combines file
+size and write time relative to the best candidate.
+
+The precision requirement for a variable is, in order of preference,
+taken from the ``--precision`` flag, from half the scale factor in its
+current encoding (such that the result is never less precise than what
+is stored now), or from ``--rel-precision`` times the largest absolute
+value.  Integer variables, such as flags, must be reproduced exactly and
+are only stored as integers, also if they have a fill value and are
+therefore decoded to floating point.
+
+The result is written as a JSON table, which can be passed to
+`~FCDR_HIRS.processing.generate_fcdr` with ``--encoding-table``.  When
+the output file exists, the entries for the FCDR type considered are
+replaced and others are kept, so that one can run the optimiser for the
+debug and the easy FCDR in turn.
+
+See also :ref:`optimise-hirs-fcdr-encoding`.
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import math
+import pathlib
+import tempfile
+import time
+
+import numpy
+import xarray
+
+from .. import common
+from .. import fcdr
+
+logger = logging.getLogger(__name__)
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description=__doc__.strip().split("\n")[0],
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser = common.add_to_argparse(parser,
+        include_period=True,
+        include_sat=1,
+        include_channels=False,
+        include_temperatures=False,
+        include_version=("0.8pre", "0.7"))
+
+    parser.add_argument("out", action="store", type=str,
+        help="JSON file to write encoding table to.")
+
+    parser.add_argument("--type", action="store", type=str,
+        choices=("debug", "easy"),
+        default="debug",
+        help="Type of FCDR to consider.")
+
+    parser.add_argument("--fields", action="store", type=str,
+        nargs="+",
+        help="Fields to consider.  Defaults to all numeric fields.")
+
+    parser.add_argument("--precision", action="store", type=str,
+        nargs="*",
+        default=[],
+        metavar="FIELD=VALUE",
+        help="Required absolute precision per field.")
+
+    parser.add_argument("--rel-precision", action="store", type=float,
+        default=1e-6,
+        help="Required precision relative to largest absolute value, "
+             "for fields without another requirement.")
+
+    parser.add_argument("--complevels", action="store", type=int,
+        nargs="+",
+        default=[1, 4, 9],
+        help="zlib compression levels to try.")
+
+    parser.add_argument("--write-weight", action="store", type=float,
+        default=0.5,
+        help="Weight of write time relative to file size in the cost.")
+
+    parser.add_argument("--repeat", action="store", type=int,
+        default=3,
+        help="Write and read each candidate this many times and take "
+             "the fastest.")
+
+    return parser
+
+def parse_cmdline():
+    return get_parser().parse_args()
+
+#: List[str] : Integer types considered for scaled storage, smallest first
+int_dtypes = ["int8", "uint8", "int16", "uint16", "int32", "uint32",
+              "int64", "uint64"]
+
+def _fill_value(dtype):
+    dtype = numpy.dtype(dtype)
+    if dtype.kind == "f":
+        return numpy.nan
+    return (numpy.iinfo(dtype).max if dtype.kind == "u"
+            else numpy.iinfo(dtype).min)
+
+def _fitting_int_dtype(lo, hi, kinds="iu"):
+    """Smallest integer type holding [lo, hi], keeping one value for fill
+    """
+    for dt in int_dtypes:
+        if numpy.dtype(dt).kind not in kinds:
+            continue
+        ii = numpy.iinfo(dt)
+        fill = _fill_value(dt)
+        if (ii.min <= lo and hi <= ii.max and
+                not lo <= fill <= hi):
+            return dt
+    return None
+
+def _integer_kind(da):
+    """Kind of integer variable, or None if not an integer variable
+
+    Decided from the stored type, as integer variables with a fill value,
+    such as flags, are decoded to floating point with NaN.  Scaled
+    integers are not integer variables.
+    """
+    if da.dtype.kind in "iub":
+        return da.dtype.kind
+    stored = da.encoding.get("dtype")
+    if (stored is not None and numpy.dtype(stored).kind in "iub"
+            and "scale_factor" not in da.encoding
+            and "add_offset" not in da.encoding):
+        return numpy.dtype(stored).kind
+    return None
+
+def get_required_precision(da, precision=None, rel_precision=1e-6):
+    """Get required absolute precision for variable
+
+    Parameters
+    ----------
+
+    da : xarray.DataArray
+        Variable as read from the FCDR, with its current encoding.
+    precision : float, optional
+        Explicitly required absolute precision.
+    rel_precision : float, optional
+        Precision relative to the largest absolute value, used if no
+        other requirement can be determined.
+
+    Returns
+    -------
+
+    float
+        Largest acceptable absolute error.  Zero for integer variables.
+    """
+    if _integer_kind(da) is not None:
+        return 0
+    if precision is not None:
+        return precision
+    if "scale_factor" in da.encoding:
+        return da.encoding["scale_factor"]/2
+    return rel_precision * float(abs(da).max())
+
+def get_candidates(da, precision, complevels=(1, 4, 9)):
+    """Get candidate encodings for variable
+
+    Parameters
+    ----------
+
+    da : xarray.DataArray
+        Variable for which to get candidates.
+    precision : float
+        Largest acceptable absolute error.
+    complevels : Sequence[int]
+        zlib compression levels to consider.
+
+    Returns
+    -------
+
+    Dict[str, dict]
+        Candidate encodings, with a short description as key.
+    """
+    dtypes = {}
+    values = (da.values[numpy.isfinite(da.values)] if da.dtype.kind == "f"
+              else da.values.ravel())
+    if values.size == 0:
+        return {}
+    (lo, hi) = (values.min(), values.max())
+    kind = _integer_kind(da)
+    if kind is not None:
+        # keep signedness, flags should stay unsigned
+        dt = (_fitting_int_dtype(lo, hi, "i" if kind == "i" else "u")
+              or str(numpy.dtype(da.encoding.get("dtype", da.dtype))))
+        dtypes[dt] = {"dtype": dt}
+        if values.size < da.size:
+            # decoded from integers with fill value
+            dtypes[dt]["_FillValue"] = _fill_value(dt)
+    else:
+        dtypes["float64"] = {"dtype": "float64"}
+        dtypes["float32"] = {"dtype": "float32", "_FillValue": numpy.nan}
+        if precision > 0:
+            # largest power of ten such that rounding error <= precision
+            scale = 10**math.floor(math.log10(2*precision))
+            dt = _fitting_int_dtype(math.floor(lo/scale), math.ceil(hi/scale))
+            if dt is not None:
+                dtypes[f"{dt:s}*{scale:g}"] = {"dtype": dt,
+                    "scale_factor": scale, "_FillValue": _fill_value(dt)}
+    chunkings = {"auto": {}}
+    if da.ndim > 1:
+        # one chunk per channel, as most analyses read a single channel
+        chandims = [i for (i, d) in enumerate(da.dims) if "channel" in d]
+        if chandims:
+            chunkings["perchan"] = {"chunksizes": tuple(
+                1 if i in chandims else n for (i, n) in enumerate(da.shape))}
+    compressions = {"raw": {"zlib": False}}
+    for lev in complevels:
+        for shuffle in (False, True):
+            compressions[f"z{lev:d}{'s' if shuffle else ''}"] = {
+                "zlib": True, "complevel": lev, "shuffle": shuffle}
+    return {f"{dk:s}/{ck:s}/{chk:s}": {**dv, **cv, **chv}
+        for (dk, dv) in dtypes.items()
+        for (ck, cv) in compressions.items()
+        for (chk, chv) in chunkings.items()}
+
+def measure(da, encoding, td, repeat=1):
+    """Write and read variable with encoding, measuring cost
+
+    Parameters
+    ----------
+
+    da : xarray.DataArray
+        Variable to write.
+    encoding : dict
+        Encoding to use.
+    td : pathlib.Path
+        Directory for temporary files.
+    repeat : int, optional
+        Repeat this many times and take the fastest.
+
+    Returns
+    -------
+
+    dict
+        With keys ``size`` (bytes), ``write`` and ``read`` (seconds),
+        and ``error`` (largest absolute error, infinite if missing data
+        are not preserved).
+    """
+    ds = xarray.Dataset({da.name: da.variable})
+    ds[da.name].attrs = {k: v for (k, v) in da.attrs.items()
+        if k not in {"_FillValue", "scale_factor", "add_offset"}}
+    ds[da.name].encoding = {}
+    outfile = td / "candidate.nc"
+    t_write = t_read = math.inf
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        ds.to_netcdf(str(outfile), encoding={da.name: encoding})
+        t_write = min(t_write, time.perf_counter() - t0)
+        t0 = time.perf_counter()
+        with xarray.open_dataset(str(outfile)) as dsr:
+            back = dsr[da.name].load()
+        t_read = min(t_read, time.perf_counter() - t0)
+    size = outfile.stat().st_size
+    outfile.unlink()
+    if da.dtype.kind == "f":
+        orig_ok = numpy.isfinite(da.values)
+        if not (numpy.isfinite(back.values) == orig_ok).all():
+            error = math.inf
+        else:
+            error = float(numpy.abs(back.values[orig_ok] -
+                                    da.values[orig_ok]).max(initial=0))
+    else:
+        error = float(numpy.abs(back.values.astype("f8") -
+                                da.values.astype("f8")).max(initial=0))
+    return {"size": size, "write": t_write, "read": t_read, "error": error}
+
+def optimise_variable(da, precision, td, complevels=(1, 4, 9),
+                      write_weight=0.5, repeat=1):
+    """Find best encoding for variable
+
+    Parameters
+    ----------
+
+    da : xarray.DataArray
+        Variable for which to find encoding.
+    precision : float
+        Largest acceptable absolute error.
+    td : pathlib.Path
+        Directory for temporary files.
+    complevels : Sequence[int], optional
+        zlib compression levels to consider.
+    write_weight : float, optional
+        Weight of write time relative to file size in the cost.
+    repeat : int, optional
+        Repeat each measurement this many times.
+
+    Returns
+    -------
+
+    (str, dict, Dict[str, dict])
+        Description of the best candidate, its encoding, and the
+        measurements for all candidates.
+    """
+    candidates = get_candidates(da, precision, complevels)
+    current = {k: v for (k, v) in da.encoding.items()
+        if k in common.netcdf_encoding_keys - {"chunksizes", "contiguous"}}
+    if current:
+        candidates["current"] = current
+    results = {}
+    for (k, enc) in candidates.items():
+        try:
+            results[k] = measure(da, enc, td, repeat=repeat)
+        except (ValueError, TypeError, OverflowError, RuntimeError) as e:
+            logger.debug(f"Cannot write {da.name:s} as {k:s}: {e!s}")
+    ok = {k: v for (k, v) in results.items()
+          if v["error"] <= precision*(1+1e-6)}
+    if not ok:
+        raise ValueError(f"No candidate encoding for {da.name:s} meets "
+                         f"precision {precision:g}")
+    min_size = min(v["size"] for v in ok.values())
+    min_write = min(v["write"] for v in ok.values())
+    cost = {k: v["size"]/min_size + write_weight*v["write"]/min_write
+            for (k, v) in ok.items()}
+    best = min(cost, key=cost.get)
+    for (k, v) in results.items():
+        v["cost"] = cost.get(k, math.inf)
+    return (best, candidates[best], results)
+
+def _jsonable(enc):
+    return {k: (v.item() if isinstance(v, numpy.generic)
+                else None if isinstance(v, float) and math.isnan(v)
+                else list(v) if isinstance(v, tuple)
+                else v)
+            for (k, v) in enc.items()}
+
+def optimise(ds, fields=None, precision=None, rel_precision=1e-6, **kwargs):
+    """Find best encodings for variables in dataset
+
+    Parameters
+    ----------
+
+    ds : xarray.Dataset
+        Sample of the FCDR.
+    fields : Collection[str], optional
+        Variables to consider.  Defaults to all numeric variables.
+    precision : Mapping[str, float], optional
+        Required absolute precision per variable.
+    rel_precision : float, optional
+        See `get_required_precision`.
+    **kwargs
+        Remaining arguments passed to `optimise_variable`.
+
+    Returns
+    -------
+
+    Dict[str, dict]
+        Encoding per variable.
+    """
+    precision = precision or {}
+    if fields is None:
+        fields = [k for (k, v) in ds.variables.items()
+                  if v.dtype.kind in "iubf"]
+    table = {}
+    with tempfile.TemporaryDirectory() as td:
+        for k in fields:
+            da = ds[k]
+            prec = get_required_precision(da, precision.get(k),
+                                          rel_precision)
+            try:
+                (best, enc, results) = optimise_variable(
+                    da, prec, pathlib.Path(td), **kwargs)
+            except ValueError as e:
+                logger.error(e.args[0])
+                continue
+            ref = results.get("current") or results.get(
+                min(results, key=lambda c: results[c]["size"]))
+            logger.info(f"{k:s}: {best:s}, "
+                f"{results[best]['size']:d} bytes "
+                f"({results[best]['size']/ref['size']:.0%} of current), "
+                f"write {results[best]['write']:.3f} s, "
+                f"read {results[best]['read']:.3f} s, "
+                f"max error {results[best]['error']:.3g} "
+                f"(required {prec:.3g})")
+            table[k] = _jsonable(enc)
+    return table
+
+def main():
+    """Main function.
+
+    For information on how to call, see module docstring.
+    """
+    p = parse_cmdline()
+    common.set_logger(
+        logging.DEBUG if p.verbose else logging.INFO,
+        p.log,
+        loggers={"FCDR_HIRS", "typhon"})
+    hirs = fcdr.which_hirs_fcdr(p.satname, read="L1C")
+    ds = hirs.read_period(
+        datetime.datetime.strptime(p.from_date, p.datefmt),
+        datetime.datetime.strptime(p.to_date, p.datefmt),
+        locator_args={"data_version": p.version, "fcdr_type": p.type,
+                      "format_version": p.format_version},
+        fields=p.fields if p.fields else "all")
+    precision = {k: float(v) for (k, v) in
+                 (pr.split("=") for pr in p.precision)}
+    table = optimise(ds, fields=p.fields, precision=precision,
+        rel_precision=p.rel_precision, complevels=p.complevels,
+        write_weight=p.write_weight, repeat=p.repeat)
+    out = pathlib.Path(p.out)
+    full = common.load_encoding_table(out) if out.exists() else {}
+    full[p.type] = table
+    with out.open("w", encoding="utf-8") as fp:
+        json.dump(full, fp, indent=2, sort_keys=True)
+    logger.info(f"Wrote encoding table to {out!s}")
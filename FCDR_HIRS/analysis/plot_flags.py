@@ -1,4 +1,7 @@
 """Plot flags.
+
+Flags are read from L1B data, or, with --from-index, from the flag index
+built with --build-index, see FCDR_HIRS.flag_index.
 """
 
 import matplotlib
@@ -13,10 +16,12 @@ import logging
 import datetime
 import xarray
 import numpy
+import pandas
 import matplotlib.pyplot
 import typhon.datasets.tovs
 import typhon.datasets.filters
 from .. import graphics
+from .. import flag_index
 
 logger = logging.getLogger(__name__)
 def get_parser():
@@ -30,12 +35,28 @@ def get_parser():
         include_channels=False,
         include_temperatures=False)
 
+    parser.add_argument("--build-index", action="store_true",
+        help="Build or update the flag index for the period from L1B "
+             "data, rather than plotting.  Granules already indexed and "
+             "not modified since are skipped.")
+
+    parser.add_argument("--from-index", action="store_true",
+        help="Plot from the flag index rather than from L1B data.  "
+             "The index must have been built for the period with "
+             "--build-index.")
+
+    parser.add_argument("--period", action="store", type=str,
+        help="Period over which to aggregate flags, as understood by "
+             "xarray.Dataset.resample.  Defaults to 1H, or to 1D with "
+             "--from-index, which needs at least a day.")
+
     return parser
 def parse_cmdline():
     return get_parser().parse_args()
 
-def plot(sat, start, end):
-    h = typhon.datasets.tovs.which_hirs(sat)
+def read_flags(h, start, end, period="1H"):
+    """Read L1B flags for period and calculate percentage set per period
+    """
     #h15 = typhon.datasets.tovs.HIRS3(satname="noaa15")
     M = h.read_period(
         start, end,
@@ -62,21 +83,38 @@ def plot(sat, start, end):
 #        for d in set(perc.dims) - {"time", "flag"}:
 #            perc = perc.mean(dim=d)
 #        perc_all.append(perc)
-        (perc, meanings) = common.sample_flags(da, "1H", "time")
+        (perc, meanings) = common.sample_flags(da, period, "time")
 #        labels.extend(da.flag_meanings.split())
         perc_all.append(perc)
         labels.extend(meanings)
 
+    return (xarray.concat(perc_all, dim="flag"), labels)
+
+def plot(sat, start, end, period=None, from_index=False):
+    if period is None:
+        period = "1D" if from_index else "1H"
+    h = typhon.datasets.tovs.which_hirs(sat)
+    if from_index:
+        # the index attributes each granule to the period it starts in
+        t0 = pandas.Timestamp("2000-01-01")
+        if t0 + pandas.tseries.frequencies.to_offset(period) < \
+                t0 + pandas.Timedelta(days=1):
+            raise ValueError("Plotting from the flag index needs a "
+                             f"period of at least a day, got {period:s}")
+        fi = flag_index.FlagIndex(h)
+        (perc, labels) = fi.percentages(fi.read(start, end), period)
+    else:
+        (perc, labels) = read_flags(h, start, end, period)
+
     (f, a) = matplotlib.pyplot.subplots(1, 1, figsize=(14, 9))
 
-    perc = xarray.concat(perc_all, dim="flag")
     # I want 0 distinct from >0
     perc.values[perc.values==0] = numpy.nan
     perc.T.plot.pcolormesh(ax=a)
     a.set_yticks(numpy.arange(len(labels)))
     a.set_yticklabels(labels)
-    a.set_title("Percentage of flag set per hour "
-        "{:s} {:%Y%m%d}-{:%Y%m%d}".format(sat, start, end))
+    a.set_title("Percentage of flag set per {:s} "
+        "{:s} {:%Y%m%d}-{:%Y%m%d}".format(period, sat, start, end))
     a.grid(axis="x")
     #f.subplots_adjust(left=0.2)
 
@@ -94,4 +132,8 @@ def main():
     sat = p.satname
     start = datetime.datetime.strptime(p.from_date, p.datefmt)
     end = datetime.datetime.strptime(p.to_date, p.datefmt)
-    plot(sat, start, end)
+    if p.build_index:
+        flag_index.FlagIndex(typhon.datasets.tovs.which_hirs(sat)).build(
+            start, end)
+    else:
+        plot(sat, start, end, period=p.period, from_index=p.from_index)
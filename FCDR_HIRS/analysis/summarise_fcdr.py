@@ -7,7 +7,14 @@ This module and script fulfills two roles:
   a non-normalised histogram (total counts per bin) as well as percentiles
   for the field.  The location that the summaries are written to is
   determined by the ``fcdr_hirs_summary`` field in the configuration file
-  (see :ref:`configuration`).
+  (see :ref:`configuration`).  With ``--incremental``, one summary file
+  is written per day, and only days without a summary or whose FCDR
+  files have changed since are summarised, such that a regular run after
+  new FCDR data have arrived only processes the new days.  With
+  ``--workers``, days are summarised in parallel worker processes.
+  Next to the percentiles, a mergeable quantile sketch is stored for each
+  day, see `FCDR_HIRS.quantile_sketch`, from which percentiles for any
+  longer period can be estimated without reading the FCDR again.
 
 - Or it can create a plot based on the information contained within the
   summary files.  When in plotting mode, can choose either one satellite or "all"
@@ -40,6 +47,9 @@ import argparse
 import inspect
 import functools
 import errno
+import os
+import tempfile
+import concurrent.futures
 
 import logging
 
@@ -62,6 +72,8 @@ from typhon.physics.units.tools import UnitsAwareDataArray as UADA
 from typhon.datasets.tovs import norm_tovs_name
 from .. import graphics
 from .. import fcdr
+from .. import quantile_sketch
+from ..zarr_store import FCDRZarrStore
 
 logger = logging.getLogger(__name__)
 
@@ -128,6 +140,23 @@ def get_parser():
              "arguments, with a format: FIELD lower high FIELD lower "
              "higher.  This argument does not support channel-dependence.")
 
+    parser.add_argument("--backend", action="store", type=str,
+        choices=("netcdf", "zarr"),
+        default="netcdf",
+        help="Applicable when mode=summarise and type=debug.  Read the "
+             "debug FCDR from NetCDF files or from the Zarr store.")
+
+    parser.add_argument("--incremental", action="store_true",
+        default=False,
+        help="Applicable when mode=summarise.  Write one summary file "
+             "per day and only summarise days that have no summary yet "
+             "or whose FCDR has changed since.")
+
+    parser.add_argument("--workers", action="store", type=int,
+        default=1,
+        help="Applicable when mode=summarise.  Number of worker "
+             "processes summarising days in parallel.")
+
     parser.add_argument("--version", action="store", type=str,
         default="0.8pre",
         help="Version to use.")
@@ -141,6 +170,13 @@ def get_parser():
         default=[5, 25, 50, 75, 95],
         help="Percentiles to plot.  Recommended to plot at least always 50.")
 
+    parser.add_argument("--resample", action="store", type=str,
+        default=None,
+        help="Applicable when mode=plot.  Plot percentiles per period "
+             "of this pandas frequency, such as M or Y, estimated by "
+             "merging the daily quantile sketches, rather than daily "
+             "percentiles.")
+
     parser.add_argument("--pstyles", action="store", type=str,
         default=": -- - -- :",
         help="Style for percentiles.  Should be single string argument "
@@ -203,6 +239,9 @@ class FCDRSummary(HomemadeDataset):
     format_version = "0.7"
     time_field = "date"
     read_returns = "xarray"
+    #: str : Read debug FCDR from "netcdf" files or "zarr" store
+    backend = "netcdf"
+    _zarr_ds = None
     plot_file = ("hirs_summary/"
         "FCDR_hirs_summary_{satname:s}_ch{channel:d}_{start:%Y%m%d}-{end:%Y%m%d}_p{ptilestr:s}"
         "f{fieldstr:s}_tp{type:s}_"
@@ -282,27 +321,18 @@ class FCDRSummary(HomemadeDataset):
         self.satname = satname
         self.hirs = fcdr.which_hirs_fcdr(satname, read="L1C")
 
-    def create_summary(self, start_date, end_date,
-            fields=None,
-            fcdr_type="debug",
-            field_ranges=None):
-        dates = pandas.date_range(start_date, end_date+datetime.timedelta(days=1),
-            freq="D")
-        fields = fields if fields is not None else []
-        fields.extend([f for f in self.fields[fcdr_type] if f not in fields])
-        logging.debug("Summarising fields: " + " ".join(fields))
-        if field_ranges is None:
-            field_ranges = {}
-        chandim = "channel" if fcdr_type=="easy" else "calibrated_channel"
+    def _new_summary(self, dates, fields, field_ranges=None):
+        """Allocate summary for days starting at dates[:-1]
+        """
         channels = numpy.arange(1, 20)
-
+        ncent = quantile_sketch.max_centroids()
         hist_range = self.hist_range.copy()
 
-        for (field, (lo, hi)) in field_ranges.items():
+        for (field, (lo, hi)) in (field_ranges or {}).items():
             hist_range[field] = ("edges", [lo, hi])
 
         #bins = numpy.linspace(self.hist_range, self.nbins)
-        summary = xarray.Dataset(
+        return xarray.Dataset(
             {
             **{field: 
                   (("date", "ptile", "channel"),
@@ -314,6 +344,16 @@ class FCDRSummary(HomemadeDataset):
                     numpy.zeros((dates.size-1, self.nbins+1,
                                  channels.size), dtype="u4"))
                 for field in fields},
+            **{f"sketch_mean_{field:s}":
+                  (("date", "centroid", "channel"),
+                    numpy.full((dates.size-1, ncent, channels.size),
+                               numpy.nan, dtype="f4"))
+                for field in fields},
+            **{f"sketch_weight_{field:s}":
+                  (("date", "centroid", "channel"),
+                    numpy.zeros((dates.size-1, ncent, channels.size),
+                                dtype="u4"))
+                for field in fields},
             **{f"bins_{field:s}":
                 (("channel", "bin_edges"),
                 # numpy.concatenate([[numpy.concatenate([[0],
@@ -338,88 +378,231 @@ class FCDRSummary(HomemadeDataset):
                     for ch in channels]))
                 for field in fields},
             },
-            coords={"date": dates[:-1], "ptile": self.ptiles, "channel": channels}
+            coords={"date": dates[:-1], "ptile": self.ptiles,
+                    "channel": channels, "centroid": numpy.arange(ncent)}
         )
 
-        for (sd, ed) in zip(dates[:-1], dates[1:]):
-            try:
-                ds = self.hirs.read_period(sd, ed,
-                    onerror="skip",
-                    excs=inspect.signature(self.hirs.read_period).parameters["excs"].default + (KeyError, OSError),
-                    locator_args={"data_version": self.data_version,
-                                  "format_version": self.format_version,
-                                  "fcdr_type": fcdr_type},
-                    fields=fields+[f for f in self.extra_fields[fcdr_type] if f not in fields])
-                if fcdr_type=="easy" and ds["u_structured"].dims == ():
-                    raise DataFileError("See https://github.com/FIDUCEO/FCDR_HIRS/issues/171")
-            #except (DataFileError, KeyError) as e:
-            except DataFileError as e:
-                logger.warning("Could not read "
-                    f"{sd:%Y-%m-%d}--{ed:%Y-%m-%d}: {e!r}: {e.args[0]:s}")
+    def _open_zarr(self, fields):
+        """Open Zarr store lazily, once per set of fields
+        """
+        key = tuple(sorted(fields))
+        if self._zarr_ds is None or self._zarr_ds[0] != key:
+            self._zarr_ds = (key, FCDRZarrStore(self.satname,
+                self.data_version).open(fields=list(key)))
+        return self._zarr_ds[1]
+
+    def _read_day(self, sd, ed, fields, fcdr_type):
+        allfields = fields+[f for f in self.extra_fields[fcdr_type] if f not in fields]
+        if self.backend == "zarr":
+            if fcdr_type != "debug":
+                raise ValueError("Zarr backend only available for debug "
+                                 f"FCDR, not {fcdr_type:s}")
+            # one lazy open for all days, then load day by day
+            ds = FCDRZarrStore.select_period(
+                self._open_zarr(allfields), sd, ed).load()
+            if ds.sizes["scanline_earth"] == 0:
+                raise DataFileError("No data in Zarr store")
+        else:
+            ds = self.hirs.read_period(sd, ed,
+                onerror="skip",
+                excs=inspect.signature(self.hirs.read_period).parameters["excs"].default + (KeyError, OSError),
+                locator_args={"data_version": self.data_version,
+                              "format_version": self.format_version,
+                              "fcdr_type": fcdr_type},
+                fields=allfields)
+        if fcdr_type=="easy" and ds["u_structured"].dims == ():
+            raise DataFileError("See https://github.com/FIDUCEO/FCDR_HIRS/issues/171")
+        return ds
+
+    def summarise_day(self, sd, ed, fields, fcdr_type, bins):
+        """Calculate percentiles and histograms for a single day
+
+        Parameters
+        ----------
+
+        sd : datetime.datetime
+            Start of the day.
+        ed : datetime.datetime
+            End of the day.
+        fields : List[str]
+            Fields to summarise.
+        fcdr_type : str
+            Either "debug" or "easy".
+        bins : xarray.Dataset
+            Dataset with a variable ``bins_{field}`` with the histogram
+            bin edges per channel for each field, as allocated by
+            `create_summary`.
+
+        Returns
+        -------
+
+        Dict[str, Tuple[ndarray, ndarray, ndarray, ndarray]] or None
+            For each field that could be summarised, percentiles with
+            dimensions ``(ptile, channel)``, histogram counts with
+            dimensions ``(bin_index, channel)``, and quantile sketch
+            centroid means and weights with dimensions ``(centroid,
+            channel)``.  None if no data could be read for the day.
+        """
+        chandim = "channel" if fcdr_type=="easy" else "calibrated_channel"
+        channels = numpy.arange(1, 20)
+        try:
+            ds = self._read_day(sd, ed, fields, fcdr_type)
+        #except (DataFileError, KeyError) as e:
+        except DataFileError as e:
+            logger.warning("Could not read "
+                f"{sd:%Y-%m-%d}--{ed:%Y-%m-%d}: {e!r}: {e.args[0]:s}")
+            return None
+        if fcdr_type == "debug":
+            bad = ((2*ds["u_R_Earth_nonrandom"] > ds["R_e"]) |
+                    ((ds["quality_scanline_bitmask"] & 1)!=0) |
+                    ((ds["quality_channel_bitmask"] & 1)!=0))
+        else: # should be "easy"
+            bad = ((2*ds["u_structured"] > ds["bt"]) |
+                   ((ds["quality_scanline_bitmask"].astype("uint8") & 1)!=0) |
+                   ((ds["quality_channel_bitmask"].astype("uint8") & 1)!=0))
+        for field in fields:
+            if field != "u_C_Earth":
+                # workaround for https://github.com/FIDUCEO/FCDR_HIRS/issues/152
+                try:
+                    ds[field].values[bad.transpose(*ds[field].dims).values] = numpy.nan 
+                except ValueError:
+                    # I seem to be unabel to mask this field
+                    pass
+        result = {}
+        for field in fields:
+            if "hertz" in ds[field].units:
+                da = UADA(ds[field]).to(rad_u["ir"], "radiance")
+            else:
+                da = ds[field]
+            if not da.notnull().any():
+                # hopeless
+                logger.warning(f"All bad data for {self.satname:s} "
+                    f"{sd.year:d}-{sd.month:d}-{sd.day:d}–{ed.year:d}-{ed.month:d}-{ed.day}, not "
+                    f"summarising {field:s}.")
                 continue
-            if fcdr_type == "debug":
-                bad = ((2*ds["u_R_Earth_nonrandom"] > ds["R_e"]) |
-                        ((ds["quality_scanline_bitmask"] & 1)!=0) |
-                        ((ds["quality_channel_bitmask"] & 1)!=0))
-            else: # should be "easy"
-                bad = ((2*ds["u_structured"] > ds["bt"]) |
-                       ((ds["quality_scanline_bitmask"].astype("uint8") & 1)!=0) |
-                       ((ds["quality_channel_bitmask"].astype("uint8") & 1)!=0))
-            for field in fields:
-                if field != "u_C_Earth":
-                    # workaround for https://github.com/FIDUCEO/FCDR_HIRS/issues/152
-                    try:
-                        ds[field].values[bad.transpose(*ds[field].dims).values] = numpy.nan 
-                    except ValueError:
-                        # I seem to be unabel to mask this field
-                        pass
-            for field in fields:
-                if "hertz" in ds[field].units:
-                    da = UADA(ds[field]).to(rad_u["ir"], "radiance")
-                else:
-                    da = ds[field]
-                if not da.notnull().any():
-                    # hopeless
-                    logger.warning(f"All bad data for {self.satname:s} "
-                        f"{sd.year:d}-{sd.month:d}-{sd.day:d}–{ed.year:d}-{ed.month:d}-{ed.day}, not "
-                        f"summarising {field:s}.")
-                    continue
-                # cannot apply limits here https://github.com/scipy/scipy/issues/7342
-                # and need to mask nans, see
-                # https://github.com/scipy/scipy/issues/2178
-#                pt = scipy.stats.scoreatpercentile(
-#                        da.values.reshape(channels.size, -1),
-#                        self.ptiles, axis=1)
-                # take transpose as workaround for
-                # https://github.com/FIDUCEO/FCDR_HIRS/issues/152
-                # make sure we always reshape the same way... this causes
-                # both #172 and #173
-                pt = scipy.stats.mstats.mquantiles(
-                    numpy.ma.masked_invalid(
-                        (da.transpose("channel", "x", "y")
-                         if fcdr_type == "easy"
-                         else da).values.reshape(channels.size, -1)),
-                        prob=self.ptiles/100, axis=1,
-                        alphap=0, betap=1).T
-                summary[field].loc[{"date":sd}] = pt
+            # cannot apply limits here https://github.com/scipy/scipy/issues/7342
+            # and need to mask nans, see
+            # https://github.com/scipy/scipy/issues/2178
+#            pt = scipy.stats.scoreatpercentile(
+#                    da.values.reshape(channels.size, -1),
+#                    self.ptiles, axis=1)
+            # take transpose as workaround for
+            # https://github.com/FIDUCEO/FCDR_HIRS/issues/152
+            # make sure we always reshape the same way... this causes
+            # both #172 and #173
+            values = numpy.ma.masked_invalid(
+                    (da.transpose("channel", "x", "y")
+                     if fcdr_type == "easy"
+                     else da).values.reshape(channels.size, -1))
+            pt = scipy.stats.mstats.mquantiles(
+                    values,
+                    prob=self.ptiles/100, axis=1,
+                    alphap=0, betap=1).T
+            sketch = [quantile_sketch.from_values(row) for row in values]
+
+            hist = numpy.stack([numpy.histogram(
+                        da.loc[{chandim:ch}],
+                        bins=bins[f"bins_{field:s}"].sel(channel=ch),
+                        range=(da.min(), da.max()))[0]
+                    for ch in channels], axis=1)
+            result[field] = (pt, hist,
+                numpy.stack([m for (m, _) in sketch], axis=1),
+                numpy.stack([w for (_, w) in sketch], axis=1))
+        return result
+
+    def source_stamp(self, sd, ed, fcdr_type):
+        """Describe the FCDR data that a daily summary is based on
+
+        Used to decide whether a stored daily summary is up to date.
+
+        Parameters
+        ----------
+
+        sd : datetime.datetime
+            Start of the day.
+        ed : datetime.datetime
+            End of the day.
+        fcdr_type : str
+            Either "debug" or "easy".
 
-                for ch in range(1, 20):
-                    summary[f"hist_{field:s}"].loc[
-                        {"date": sd, "channel": ch}] = numpy.histogram(
-                            da.loc[{chandim:ch}],
-                            bins=summary[f"bins_{field:s}"].sel(channel=ch),
-                            range=(da.min(), da.max()))[0]
+        Returns
+        -------
 
+        Dict[str, int]
+            With the NetCDF backend, the number of FCDR files covering
+            the day as ``source_files`` and their latest modification
+            time as ``source_mtime_ns``.  With the Zarr backend, the
+            number of scanlines in the store for that day as
+            ``source_scanlines`` and the time at which data for the day
+            were last written to the store as ``source_written``, see
+            `~FCDR_HIRS.zarr_store.FCDRZarrStore.last_written`.
+        """
+        if self.backend == "zarr":
+            ds = FCDRZarrStore.select_period(
+                self._open_zarr(self.fields[fcdr_type]), sd, ed)
+            written = FCDRZarrStore(self.satname,
+                self.data_version).last_written(sd, ed,
+                    self.fields[fcdr_type])
+            return {"source_scanlines": ds.sizes.get("scanline_earth", 0),
+                    "source_written": "" if written is None
+                                      else str(written)}
+        mtimes = [f.stat().st_mtime_ns
+            for f in self.hirs.find_granules_sorted(sd, ed,
+                include_last_before=True,
+                data_version=self.data_version,
+                format_version=self.format_version,
+                fcdr_type=fcdr_type)]
+        return {"source_files": len(mtimes),
+                "source_mtime_ns": max(mtimes, default=0)}
+
+    def get_summary_file(self, first, last, fcdr_type):
+        """Get path to summary file
+
+        Parameters
+        ----------
+
+        first : datetime.datetime
+            First day in summary.
+        last : datetime.datetime
+            Last day in summary.  Equal to ``first`` for a daily summary.
+        fcdr_type : str
+            Either "debug" or "easy".
+
+        Returns
+        -------
+
+        pathlib.Path
+            Path to summary file.
+        """
         of = pathlib.Path(self.basedir) / self.subdir / self.stored_name
-        of = pathlib.Path(str(of).format(
-            satname=self.satname, year=dates[0].year,
-            month=dates[0].month, day=dates[0].day,
-            year_end=dates[-2].year,
-            month_end=dates[-2].month,
-            day_end=dates[-2].day,
+        return pathlib.Path(str(of).format(
+            satname=self.satname, year=first.year,
+            month=first.month, day=first.day,
+            year_end=last.year,
+            month_end=last.month,
+            day_end=last.day,
             fcdr_version=self.data_version,
             format_version=self.format_version,
             fcdr_type=fcdr_type))
+
+    @staticmethod
+    def _is_current(path, fields, stamp, bins):
+        if not path.exists():
+            return False
+        try:
+            with xarray.open_dataset(str(path)) as ds:
+                return (all(k in ds.data_vars for f in fields
+                            for k in (f, f"sketch_mean_{f:s}",
+                                      f"bins_{f:s}")) and
+                        all(ds.attrs.get(k) == v for (k, v) in stamp.items())
+                        and all(numpy.array_equal(ds[f"bins_{f:s}"].values,
+                                                  bins[f"bins_{f:s}"].values)
+                                for f in fields))
+        except (OSError, ValueError) as e:
+            logger.warning(f"Cannot use {path!s}, recalculating: {e!s}")
+            return False
+
+    def _write_summary(self, summary, of, fields, attrs=None):
         of.parent.mkdir(parents=True, exist_ok=True)
 
         for field in fields:
@@ -432,6 +615,10 @@ class FCDRSummary(HomemadeDataset):
             summary["hist_"+field].encoding.update({
                 "zlib": True,
                 "complevel": 4})
+            for k in ("sketch_mean_", "sketch_weight_"):
+                summary[k+field].encoding.update({
+                    "zlib": True,
+                    "complevel": 4})
             summary["bins_"+field].encoding.update({
                 "zlib": True,
                 "complevel": 4,
@@ -439,15 +626,199 @@ class FCDRSummary(HomemadeDataset):
 #                "_FillValue": numpy.iinfo("int32").min,
 #                "scale_factor": 0.001})
                 })
+        summary = summary.assign_attrs(**(attrs or {}))
 
         logger.info(f"Writing {of!s}")
-        summary.to_netcdf(str(of))
+        # write atomically, such that an interrupted incremental run
+        # does not leave a file that looks complete
+        (fd, tmpfile) = tempfile.mkstemp(dir=str(of.parent),
+            prefix=f".{of.name:s}.")
+        os.close(fd)
+        try:
+            summary.to_netcdf(tmpfile)
+            os.replace(tmpfile, str(of))
+        finally:
+            if os.path.exists(tmpfile):
+                os.remove(tmpfile)
+
+    def _summarise_days(self, days, fields, fcdr_type, bins, workers):
+        """Yield (start, result) for each day, in a pool if workers > 1
+        """
+        if workers == 1 or len(days) <= 1:
+            for (sd, ed) in days:
+                yield (sd, self.summarise_day(sd, ed, fields, fcdr_type, bins))
+            return
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers,
+                initializer=_init_worker,
+                initargs=(self.satname, self.data_version,
+                          self.format_version, self.backend)) as executor:
+            futures = {executor.submit(_summarise_in_worker, sd, ed,
+                                       fields, fcdr_type, bins): sd
+                       for (sd, ed) in days}
+            for fut in concurrent.futures.as_completed(futures):
+                yield (futures[fut], fut.result())
+
+    def create_summary(self, start_date, end_date,
+            fields=None,
+            fcdr_type="debug",
+            field_ranges=None,
+            incremental=False,
+            workers=1):
+        """Summarise FCDR for period, per day
+
+        Parameters
+        ----------
+
+        start_date : datetime.datetime
+            First day to summarise.
+        end_date : datetime.datetime
+            Last day to summarise.
+        fields : List[str], optional
+            Fields to summarise in addition to the defaults for
+            ``fcdr_type``.
+        fcdr_type : str, optional
+            Either "debug" (default) or "easy".
+        field_ranges : Mapping[str, Tuple[float, float]], optional
+            Histogram range per field, overriding `hist_range`.
+        incremental : bool, optional
+            If False (default), summarise every day and write a single
+            file for the period.  If True, write one file per day, and
+            only summarise days for which there is no such file yet, for
+            which the FCDR has changed since, according to
+            `source_stamp`, or for which the histogram bins differ, such
+            as due to ``field_ranges``.  Days that cannot be read are not
+            written, such that they are tried again next time.  Plotting with `plot_period_ptiles` and
+            `plot_period_hists` reads the daily files as it would a
+            file for the period; do not mix daily and period files for
+            the same days.
+        workers : int, optional
+            Number of worker processes to summarise days in parallel.
+            Defaults to 1.
+        """
+        dates = pandas.date_range(start_date, end_date+datetime.timedelta(days=1),
+            freq="D")
+        fields = fields if fields is not None else []
+        fields.extend([f for f in self.fields[fcdr_type] if f not in fields])
+        logging.debug("Summarising fields: " + " ".join(fields))
+
+        summary = self._new_summary(dates, fields, field_ranges)
+        bins = summary[[f"bins_{field:s}" for field in fields]]
+
+        days = list(zip(dates[:-1], dates[1:]))
+        if incremental:
+            stamps = {}
+            todo = []
+            for (sd, ed) in days:
+                stamps[sd] = self.source_stamp(sd, ed, fcdr_type)
+                if not any(stamps[sd].values()):
+                    continue # no data for this day
+                if not self._is_current(
+                        self.get_summary_file(sd, sd, fcdr_type),
+                        fields, stamps[sd], bins):
+                    todo.append((sd, ed))
+            logger.info(f"Summarising {len(todo):d} out of {len(days):d} "
+                         "days, others have no data or are up to date")
+        else:
+            todo = days
+
+        for (sd, result) in self._summarise_days(todo, fields, fcdr_type,
+                                                 bins, workers):
+            for (field, (pt, hist, mean, weight)) in (result or {}).items():
+                summary[field].loc[{"date":sd}] = pt
+                summary[f"hist_{field:s}"].loc[{"date": sd}] = hist
+                summary[f"sketch_mean_{field:s}"].loc[{"date": sd}] = mean
+                summary[f"sketch_weight_{field:s}"].loc[{"date": sd}] = weight
+            if incremental and result is None:
+                logger.warning(f"Not storing summary for {sd:%Y-%m-%d}, "
+                               "it will be tried again next time")
+            elif incremental:
+                self._write_summary(summary.sel(date=[sd]),
+                    self.get_summary_file(sd, sd, fcdr_type), fields,
+                    stamps[sd])
+
+        if not incremental:
+            self._write_summary(summary,
+                self.get_summary_file(dates[0], dates[-2], fcdr_type),
+                fields)
+
+    def sketch_ptiles(self, summary, fields, freq=None):
+        """Estimate percentiles for longer periods from daily sketches
+
+        Merges the daily quantile sketches stored by `create_summary`
+        and estimates the percentiles in `ptiles` from the result.
+
+        Parameters
+        ----------
+
+        summary : xarray.Dataset
+            Daily summaries, such as read with `read_period`.
+        fields : List[str]
+            Fields for which to estimate percentiles.
+        freq : str, optional
+            Pandas period frequency, such as "M" or "Y", for which to
+            estimate percentiles.  If not given, estimate percentiles
+            for the entire period covered by ``summary``.
+
+        Returns
+        -------
+
+        xarray.Dataset
+            Percentiles with dimensions ``(date, ptile, channel)``,
+            where ``date`` is the start of each period.
+        """
+        dates = summary.indexes["date"]
+        if freq is None:
+            labels = pandas.DatetimeIndex([dates[0]]*dates.size)
+        else:
+            labels = dates.to_period(freq).start_time
+        periods = labels.unique()
+        out = {}
+        for field in fields:
+            means = summary[f"sketch_mean_{field:s}"].transpose(
+                "date", "channel", "centroid").values
+            weights = summary[f"sketch_weight_{field:s}"].transpose(
+                "date", "channel", "centroid").values
+            out[field] = (("date", "channel", "ptile"), numpy.stack(
+                [quantile_sketch.quantiles(*quantile_sketch.merge(
+                    means[labels==period], weights[labels==period],
+                    axis=0), self.ptiles/100)
+                 for period in periods]).astype("f4"))
+        return xarray.Dataset(out,
+            coords={"date": periods, "channel": summary["channel"].values,
+                    "ptile": self.ptiles}).transpose(
+                        "date", "ptile", "channel")
 
     def plot_period_ptiles(self, start, end, fields,
             ptiles=[5, 25, 50, 75, 95],
             pstyles=[":", "--", "-", "--", ":"],
             fcdr_type="debug",
-            sats=None):
+            sats=None,
+            resample=None):
+        """Plot time series of percentiles
+
+        Parameters
+        ----------
+
+        start : datetime.datetime
+            Start of period to plot.
+        end : datetime.datetime
+            End of period to plot.
+        fields : List[str]
+            Fields to plot, one panel each.
+        ptiles : List[int], optional
+            Percentiles to plot.
+        pstyles : List[str], optional
+            Line style for each percentile.
+        fcdr_type : str, optional
+            Either "debug" (default) or "easy".
+        sats : str, optional
+            Satellite, or "all".  Defaults to `satname`.
+        resample : str, optional
+            If given, plot percentiles per period of this pandas
+            frequency, such as "M", estimated from the daily quantile
+            sketches with `sketch_ptiles`, rather than daily
+            percentiles.
+        """
         if sats is None:
             sats = self.satname
 
@@ -493,6 +864,13 @@ class FCDRSummary(HomemadeDataset):
                 continue
             else:
                 si = next(sc)
+            if resample is not None:
+                if all(f"sketch_mean_{f:s}" in summary.data_vars
+                       for f in fields):
+                    summary = self.sketch_ptiles(summary, fields, resample)
+                else:
+                    logger.warning(f"Summaries for {sat:s} lack quantile "
+                        "sketches, plotting daily percentiles")
             
             np = len(ptiles)
             if len(sats) == 1:
@@ -694,6 +1072,16 @@ class FCDRSummary(HomemadeDataset):
             end=end, data_version=self.data_version,
             format_version=self.format_version))
 
+_worker_state = {}
+def _init_worker(satname, data_version, format_version, backend):
+    _worker_state["summary"] = FCDRSummary(satname=satname,
+        data_version=data_version, format_version=format_version,
+        backend=backend)
+
+def _summarise_in_worker(sd, ed, fields, fcdr_type, bins):
+    return _worker_state["summary"].summarise_day(sd, ed, fields,
+        fcdr_type, bins)
+
 def summarise():
     p = parse_cmdline()
     common.set_logger(
@@ -703,7 +1091,7 @@ def summarise():
 #    if p.mode != "summarise":
 #        raise NotImplementedError("Only summarising implemented yet")
     summary = FCDRSummary(satname=p.satname, data_version=p.version,
-        format_version=p.format_version)
+        format_version=p.format_version, backend=p.backend)
     start = datetime.datetime.strptime(p.from_date, p.datefmt)
     end = datetime.datetime.strptime(p.to_date, p.datefmt)
     fields = p.fields
@@ -711,7 +1099,8 @@ def summarise():
         fields = None
     if p.mode == "summarise":
         summary.create_summary(start, end, fcdr_type=p.type,
-            fields=fields, field_ranges=p.field_ranges)
+            fields=fields, field_ranges=p.field_ranges,
+            incremental=p.incremental, workers=p.workers)
     elif p.mode == "plot":
 #        sumdat = summary.plot_period(start, end, 5, fields=["u_C_Earth"],
 #            ptiles=[50], pstyles=["-"], fcdr_type=p.type)
@@ -727,4 +1116,5 @@ def summarise():
             fields=fields,
             fcdr_type=p.type,
             ptiles=p.ptiles,
-            pstyles=p.pstyles.split())
+            pstyles=p.pstyles.split(),
+            resample=p.resample)
@@ -58,6 +58,8 @@ from typhon.physics.units.common import ureg
 from .. import common
 from .. import fcdr
 from .. import graphics
+from .. import running_stats
+from . import iwt_store
 
 srcfile_temp_iwt = pathlib.Path(typhon.config.conf["main"]["myscratchdir"],
                        "hirs_{sat:s}_{year:d}_temp_iwt.npz")
@@ -71,8 +73,12 @@ def get_parser():
     parser.add_argument("--plot_iwt_anomaly", action="store_true",
         #type=bool,
         default=False, help="Plot IWT anomaly for full HIRS period. "
-        "This is based on an intermediate file created with "
-        "extract_field_from_hirs.py.")
+        "This is based on the daily IWT store, see --update_iwt_store.")
+
+    parser.add_argument("--update_iwt_store", action="store_true",
+        default=False, help="Append days not yet in the daily IWT store "
+        "for --sat, or for all satellites plotted by --plot_iwt_anomaly "
+        "if not given, up to --to_date or the end of the dataset.")
 
     parser.add_argument("--plot_noise", action="store_true", #type=bool,
         default=False, help="Plot various noise characteristics.")
@@ -192,6 +198,17 @@ def get_parser():
     parser.add_argument("--store_only", action="store_true",
         help="Only store to NetCDF, do not plot.  Name calculate automatically.", default=False)
 
+    parser.add_argument("--streaming", action="store_true",
+        default=False,
+        help="With --plot_noise_with_other, read the period one day at a "
+             "time and accumulate statistics of counts, noise, gain, and "
+             "correlations per --corr_timeres, rather than reading the "
+             "full period into memory.  Does not combine with IASI.")
+
+    parser.add_argument("--memory_budget", action="store", type=float,
+        help="Maximum amount of data to read at once, in GiB.  Defaults "
+             "to 200 GiB without --streaming.")
+
     parser.add_argument("--width_factor", action="store", type=float,
         default=1,
         help="Make plot a factor x wider (for noise_with_other only).")
@@ -223,8 +240,19 @@ def get_timeseries_temp_iwt_anomaly(sat, year_start=2005, year_end=2017):
     
     return (dts, anomalies)
 
+def get_timeseries_temp_iwt_anomaly_per_day(sat, start_date=None,
+                                            end_date=None):
+    """Read daily IWT PRT anomalies from the daily IWT store
+
+    See `FCDR_HIRS.analysis.iwt_store`.  Days without data are omitted.
+    """
+    st = iwt_store.IWTDailyStore(sat)
+    anom = st.anomalies(st.read(start_date, end_date))
+    anom = anom[anom.notnull().any("prt")]
+    return (anom["date"].values, anom.transpose("date", "prt").values)
+
 def plot_timeseries_temp_iwt_anomaly(sat, nrow=4):
-    (dts, anomalies) = get_timeseries_temp_iwt_anomaly(sat)
+    (dts, anomalies) = get_timeseries_temp_iwt_anomaly_per_day(sat)
     dts = dts.astype("M8[s]").astype(datetime.datetime)
     (f, ax_all) = matplotlib.pyplot.subplots(nrow, 1)
 
@@ -239,7 +267,7 @@ def plot_timeseries_temp_iwt_anomaly(sat, nrow=4):
         ax.set_ylim(1.2 * lo, 1.2 * hi)
         ax.grid(axis="both")
     ax_all[-1].set_xlabel("Date")
-    f.suptitle("IWT PRT orbit-averaged anomalies, {:s}".format(sat))
+    f.suptitle("IWT PRT daily-averaged anomalies, {:s}".format(sat))
     f.subplots_adjust(hspace=0.25)
     graphics.print_or_show(f, False,
         "timeseries_{:s}_temp_iwp.".format(sat))
@@ -247,33 +275,16 @@ def plot_timeseries_temp_iwt_anomaly(sat, nrow=4):
 def extract_timeseries_per_day_iwt_anomaly_period(sat, start_date, end_date):
     """For satellite, extract timeseries per day
 
-    Approximations:
-    - Takes whole orbits per day
-    - Does not remove duplicate scanlines
+    Read from the daily IWT store, see `FCDR_HIRS.analysis.iwt_store`,
+    which must have been updated for the period.  Days without data
+    have NaN anomalies.
     """
-    (dts, anomalies) = get_timeseries_temp_iwt_anomaly(sat,
-        start_date.year, end_date.year+1)
-    bins = list(itertools.takewhile(lambda x: x<=end_date,
-                (start_date + datetime.timedelta(days=i) for i in itertools.count())))
-    bins = numpy.array(bins, "M8[s]")
-
-    # Binning doesn't work with a time-axis.  Convert to float, but be
-    # sure that float relates to the same time-format first
-    binned = typhon.math.stats.bin(dts.astype("M8[s]").astype("f8"),
-                                anomalies,
-                                bins.astype("M8[s]").astype("f8"))
-
-    anom_per_day = numpy.array([b.mean(0) if b.size>0 else [numpy.nan]*5 for b in binned])
-
-    # Due to the way binning works, there is an off-by-one error.
-    # so anything on 2005-10-10 is binned in the bin that says
-    # 2005-10-11.  Sorry.
-    Y = list(zip(bins, anom_per_day[1:])) # convert to list as I need to
-                                          # loop through twice
-
-    X = numpy.zeros(shape=(anom_per_day.shape[0]-1,), dtype=[("date", "M8[s]"), ("anomalies", "f8", (5,))])
-    X["date"] = [y[0] for y in Y]
-    X["anomalies"] = [y[1] for y in Y]
+    st = iwt_store.IWTDailyStore(sat)
+    anom = st.anomalies(st.read(start_date, end_date)).transpose("date", "prt")
+
+    X = numpy.zeros(shape=(anom.shape[0],), dtype=[("date", "M8[s]"), ("anomalies", "f8", (anom.shape[1],))])
+    X["date"] = anom["date"].values
+    X["anomalies"] = anom.values
     return X
 
 def write_timeseries_per_day_iwt_anomaly_period(sat, start_date, end_date):
@@ -282,13 +293,16 @@ def write_timeseries_per_day_iwt_anomaly_period(sat, start_date, end_date):
         "hirs_iwt_anom_{:s}_{:%Y%m%d}-{:%Y%m%d}".format(sat, start_date, end_date))
     logger.info("Writing {!s}".format(dest))
     with dest.open("wt", encoding="ascii") as fp:
-        fp.writelines([("{:%Y-%m-%d}" + 5*" {:.5f}" + "\n").format(
+        fp.writelines([("{:%Y-%m-%d}" + X["anomalies"].shape[1]*" {:.5f}" + "\n").format(
                 x["date"].astype("M8[s]").astype(datetime.datetime), *x["anomalies"])
                     for x in X])
             
 
+#: Set[str] : Satellites for which to plot IWT anomalies
+iwt_anomaly_sats = {"noaa18", "noaa19", "metopa", "metopb"}
+
 def plot_timeseries_temp_iwt_anomaly_all_sats():
-    for sat in {"noaa18", "noaa19", "metopa", "metopb"}:
+    for sat in iwt_anomaly_sats:
         logger.info("Plotting {:s}".format(sat))
         plot_timeseries_temp_iwt_anomaly(sat)
         
@@ -301,9 +315,24 @@ class NoiseAnalyser:
 #@profile
 
     def __init__(self, start_date, end_date, satname, temp_fields={"iwt",
-                        "fwh", "fwm"}, writefig=False):
+                        "fwh", "fwm"}, writefig=False, streaming=False,
+                        memory_budget=None):
+        """Read data for noise analysis
+
+        Unless ``streaming`` is True, the entire period is read into
+        memory, and for metopa combined with IASI.  With ``streaming``,
+        nothing is read here; use `accumulate_statistics` to process the
+        period in chunks.  The plotting methods need the full period.
+
+        ``memory_budget`` is the maximum size in bytes of what is read at
+        once, defaulting to 200 GiB for the full period and to the
+        `typhon.datasets.dataset.Dataset.maxsize` default when streaming.
+        """
         self.hirs = fcdr.which_hirs_fcdr(satname)
         self.satname = satname
+        self.start_date = start_date
+        self.end_date = end_date
+        self.writefig = writefig
         # include InvalidIndexError and KeyError with acceptable
         # exceptions.  Those can result from invalid indexing in the
         # pseudo_fields processing, which in turn results from duplicates,
@@ -329,16 +358,18 @@ class NoiseAnalyser:
                 excs=(typhon.datasets.dataset.DataFileError,
                     typhon.datasets.filters.FilterError, InvalidIndexError,
                     KeyError))
+        self.hrsargs = hrsargs
+        if streaming:
+            if memory_budget is not None:
+                self.hirs.maxsize = memory_budget
+            self.Mhrsall = self.Mhrscmb = self.Lhiasi = None
+            return
         # those need to be read before combining with HIASI, because
         # afterward, I lose the calibration rounds.  But doing it after
         # read a full month (or more) of data takes too much RAM as I will
         # need to copy the entire period; therefore, add it on-the-fly
-        self.hirs.maxsize = 200*2**30 # tolerate 200 GB
-        Mhrsall = self.hirs.read_period(start_date, end_date,
-            pseudo_fields=
-                {"tsc": self.hirs.calc_time_since_last_calib,
-                 "lsc": self.hirs.count_lines_since_last_calib},
-            NO_CACHE=True, **hrsargs)
+        self.hirs.maxsize = memory_budget or 200*2**30 # tolerate 200 GB
+        Mhrsall = self.read_hirs(start_date, end_date)
         self.Mhrsall = Mhrsall
         self.hiasi = typhon.datasets.tovs.HIASI()
         # Split IASI reading in smaller parts to save memory
@@ -385,10 +416,42 @@ class NoiseAnalyser:
             self.Lhiasi = None
             self.tsc = None
 
-        self.start_date = start_date
-        self.end_date = end_date
+    def read_hirs(self, start_date, end_date):
+        """Read HIRS data for noise analysis for period
+        """
+        return self.hirs.read_period(start_date, end_date,
+            pseudo_fields=
+                {"tsc": self.hirs.calc_time_since_last_calib,
+                 "lsc": self.hirs.count_lines_since_last_calib},
+            NO_CACHE=True, **self.hrsargs)
 
-        self.writefig = writefig
+    def read_chunks(self, chunk=datetime.timedelta(days=1)):
+        """Read HIRS data for noise analysis in chunks
+
+        Chunks without any valid data are skipped.
+
+        Parameters
+        ----------
+
+        chunk : datetime.timedelta, optional
+            Length of each chunk.  Defaults to one day.
+
+        Yields
+        ------
+
+        ndarray
+            HIRS data for each chunk, as for the full period in
+            `Mhrsall`.
+        """
+        dt = self.start_date
+        while dt < self.end_date:
+            try:
+                yield self.read_hirs(dt, min(dt+chunk, self.end_date))
+            except typhon.datasets.dataset.DataFileError:
+                logger.info("No HIRS found in "
+                    "[{:%Y-%m-%d %H:%M}-{:%Y-%m-%d %H:%M}]".format(
+                        dt, dt+chunk))
+            dt += chunk
 
     def calc_hiasi(self, rad):
         """Calculate IASI-simulated HIRS
@@ -1163,7 +1226,7 @@ class NoiseAnalyser:
 
 #    def get_calibcount_range(self, satname="metopa", year=2015):
 
-    def get_accnt(self, typ):
+    def get_accnt(self, typ, M=None):
         """Get calibration count anomalies
 
         Returns an xarray.Dataset.  Due to limitations in pandas and xarray
@@ -1171,8 +1234,11 @@ class NoiseAnalyser:
         converted to floats and masking is done with nans rather than
         masked arrays.  As we only select 2.5% of the data the increase in
         memory is acceptable in this case.
+
+        Uses `Mhrsall` unless ``M`` is given.
         """
-        M = self.Mhrsall
+        if M is None:
+            M = self.Mhrsall
 
         # Create an xarray Dataset object for easier time series
         # processing
@@ -1241,6 +1307,234 @@ class NoiseAnalyser:
             correlations[:, :, i] = cch
         return correlations
 
+    @staticmethod
+    def _add_binned(reducers, name, factory, times, values, timeres):
+        """Add values to reducer ``name`` for each time bin
+        """
+        if len(times) == 0:
+            return
+        bins = pandas.DatetimeIndex(times).floor(timeres)
+        for b in bins.unique():
+            if b not in reducers:
+                reducers[b] = {}
+            if name not in reducers[b]:
+                reducers[b][name] = factory()
+            reducers[b][name].add(values[numpy.asarray(bins == b)])
+
+    def accumulate_statistics(self, channels, all_tp=("space", "iwt"),
+            timeres="1D", calibpos=20, chunk=datetime.timedelta(days=1)):
+        """Accumulate noise, gain, and correlation statistics in chunks
+
+        Reads the period in chunks of length ``chunk``, see
+        `read_chunks`, such that at most one chunk is in memory at any
+        time, and accumulates statistics per time bin of length
+        ``timeres`` with `~FCDR_HIRS.running_stats.RunningStats` and
+        `~FCDR_HIRS.running_stats.RunningCovariance`.  Statistics for
+        adjacent periods, such as calculated by different jobs, can be
+        combined with `merge_statistics`.
+
+        Parameters
+        ----------
+
+        channels : Sequence[int]
+            Channels for which to accumulate counts, noise, and gain.
+            Correlations are always between all 19 channels.
+        all_tp : Sequence[str], optional
+            Calibration views to consider, defaults to space and iwt.
+        timeres : str, optional
+            Length of time bins, as understood by
+            `pandas.DatetimeIndex.floor`.  Defaults to ``"1D"``.
+        calibpos : int, optional
+            Calibration position for which to calculate count anomaly
+            correlations, as in `get_correlations`.  Defaults to 20.
+        chunk : datetime.timedelta, optional
+            Length of period read at once.  Defaults to one day.
+
+        Returns
+        -------
+
+        xarray.Dataset
+            Statistics with dimension ``time`` along the time bins.  For
+            each view ``tp``, variables starting with ``counts_{tp}_``
+            describe the calibration counts averaged over calibration
+            positions, ``noise_{tp}_`` their Allan deviation, and
+            ``corr_{tp}_`` the correlation between channels of the count
+            anomalies.  Variables starting with ``gain_`` describe the
+            median gain per scanline.
+        """
+        channels = numpy.atleast_1d(channels)
+        nch = channels.size
+        factories = {"gain": lambda: running_stats.RunningStats((nch,))}
+        for tp in all_tp:
+            factories[f"counts_{tp:s}"] = factories["gain"]
+            factories[f"noise_{tp:s}"] = factories["gain"]
+            factories[f"corr_{tp:s}"] = (
+                lambda: running_stats.RunningCovariance(19))
+        reducers = {}
+        gain_units = None
+        for M in self.read_chunks(chunk):
+            logger.debug("Accumulating noise statistics for "
+                "{:%Y-%m-%d %H:%M} – {:%Y-%m-%d %H:%M}".format(
+                    *M["time"][[0, -1]].astype("M8[s]").astype(
+                        datetime.datetime)))
+            for tp in all_tp:
+                views = M[self.hirs.scantype_fieldname
+                            ] == getattr(self.hirs, "typ_"+tp)
+                t = M[views]["time"]
+                C = M[views]["counts"][:, 8:, channels-1]
+                self._add_binned(reducers, f"counts_{tp:s}",
+                    factories[f"counts_{tp:s}"], t, C.mean(1), timeres)
+                self._add_binned(reducers, f"noise_{tp:s}",
+                    factories[f"noise_{tp:s}"], t,
+                    typhon.math.stats.adev(C, 1), timeres)
+                accnt = self.get_accnt(tp, M)
+                self._add_binned(reducers, f"corr_{tp:s}",
+                    factories[f"corr_{tp:s}"], accnt["time"].values,
+                    accnt.sel(calibpos=calibpos).values, timeres)
+            for (j, ch) in enumerate(channels):
+                (t_slope, med_gain, _) = self.get_gain(M, ch)
+                gain_units = med_gain.u
+                # only column j is valid, such that the gain of each
+                # channel is counted separately
+                G = numpy.ma.masked_all((med_gain.m.shape[0], nch))
+                G[:, j] = med_gain.m
+                OK = ~numpy.ma.getmaskarray(t_slope)
+                self._add_binned(reducers, "gain", factories["gain"],
+                    t_slope.data[OK], G[OK], timeres)
+        if not reducers:
+            raise typhon.datasets.dataset.DataFileError(
+                "No HIRS data for {:s} between {:%Y-%m-%d} and "
+                "{:%Y-%m-%d}".format(self.satname, self.start_date,
+                                     self.end_date))
+        bins = sorted(reducers.keys())
+        ds = self._reducers_to_xarray(
+            [{name: reducers[b].get(name) or factories[name]()
+                for name in factories} for b in bins],
+            bins, channels)
+        if gain_units is not None:
+            for k in ("mean", "minimum", "maximum", "std"):
+                ds[f"gain_{k:s}"].attrs["units"] = "{:~}".format(gain_units)
+        ds.attrs.update(satname=self.satname, timeres=timeres,
+                        calibpos=calibpos)
+        return ds
+
+    @staticmethod
+    def _reducers_to_xarray(reducers, bins, channels):
+        """Convert reducers per time bin to dataset
+        """
+        per_bin = []
+        for rd in reducers:
+            parts = []
+            for name in sorted(rd):
+                if name.startswith("corr_"):
+                    ds = rd[name].to_xarray(("cha", "chb"),
+                        {"cha": range(1, 20), "chb": range(1, 20)})
+                else:
+                    ds = rd[name].to_xarray(("channel",),
+                        {"channel": channels})
+                parts.append(ds.rename(
+                    {k: f"{name:s}_{k:s}" for k in ds.data_vars}))
+            per_bin.append(xarray.merge(parts))
+        return xarray.concat(per_bin, dim="time").assign_coords(
+            time=numpy.array(bins, dtype="M8[ns]"))
+
+    @classmethod
+    def merge_statistics(cls, datasets):
+        """Merge statistics from `accumulate_statistics`
+
+        Parameters
+        ----------
+
+        datasets : Sequence[xarray.Dataset]
+            Statistics for the same channels, views, and time resolution,
+            such as for adjacent periods.  Time bins present in more than
+            one dataset are merged.
+
+        Returns
+        -------
+
+        xarray.Dataset
+            Merged statistics.
+        """
+        names = sorted({k.rsplit("_", 1)[0] for k in datasets[0].data_vars
+                        if k.endswith("_count")})
+        merged = {}
+        for ds in datasets:
+            for t in ds["time"].values:
+                sub = ds.sel(time=t)
+                for name in names:
+                    rc = (running_stats.RunningCovariance
+                          if name.startswith("corr_")
+                          else running_stats.RunningStats)
+                    rd = rc.from_xarray(xarray.Dataset(
+                        {k[len(name)+1:]: sub[k] for k in sub.data_vars
+                         if k.rsplit("_", 1)[0] == name}))
+                    if t not in merged:
+                        merged[t] = {}
+                    if name in merged[t]:
+                        merged[t][name].merge(rd)
+                    else:
+                        merged[t][name] = rd
+        bins = sorted(merged.keys())
+        out = cls._reducers_to_xarray([merged[b] for b in bins], bins,
+            datasets[0]["channel"].values)
+        for k in out.data_vars:
+            out[k].attrs.update(datasets[0][k].attrs)
+        out.attrs.update(datasets[0].attrs)
+        return out
+
+    def plot_noise_statistics(self, stats, ch):
+        """Plot statistics from `accumulate_statistics` for channel
+
+        Plots, for each time bin, the mean and standard deviation of the
+        calibration counts, their Allan deviation, and the gain, and the
+        correlation of the count anomalies with all other channels.
+
+        Parameters
+        ----------
+
+        stats : xarray.Dataset
+            Statistics as returned by `accumulate_statistics` or
+            `merge_statistics`.
+        ch : int
+            Channel to plot.
+        """
+        names = sorted({k.rsplit("_", 1)[0] for k in stats.data_vars
+                        if k.endswith("_count")})
+        moments = [n for n in names if not n.startswith("corr_")]
+        corrs = [n for n in names if n.startswith("corr_")]
+        (f, ax_all) = matplotlib.pyplot.subplots(
+            len(moments) + len(corrs), 1, sharex=True,
+            figsize=(12, 3*(len(moments)+len(corrs))), squeeze=False)
+        t = stats["time"].values.astype("M8[s]").astype(datetime.datetime)
+        for (a, name) in zip(ax_all[:, 0], moments):
+            m = stats[f"{name:s}_mean"].sel(channel=ch).values
+            s = stats[f"{name:s}_std"].sel(channel=ch).values
+            a.plot(t, m, color="black", marker=".", linestyle="-")
+            a.fill_between(t, m-s, m+s, color="0.7")
+            a.set_ylabel(name.replace("_", " ") +
+                ("\n[{:s}]".format(stats[f"{name:s}_mean"].attrs["units"])
+                 if "units" in stats[f"{name:s}_mean"].attrs else ""))
+        for (a, name) in zip(ax_all[len(moments):, 0], corrs):
+            cc = stats[f"{name:s}_correlation"].sel(cha=ch)
+            for other in cc["chb"].values:
+                if other == ch:
+                    continue
+                a.plot(t, cc.sel(chb=other).values, marker=".",
+                       linestyle="-", label=f"ch. {other:d}")
+            a.set_ylabel(name.replace("_", " ") + "\n[1]")
+            a.set_ylim(-1, 1)
+        ax_all[0, 0].set_title("HIRS {:s} channel {:d}, statistics per "
+                               "{:s}".format(self.satname, ch,
+                                             stats.attrs.get("timeres", "?")))
+        ax_all[-1, 0].set_xlabel("Date / time")
+        if corrs:
+            ax_all[-1, 0].legend(ncol=6, fontsize="small", loc="lower left")
+        graphics.print_or_show(f, False,
+            "hirs_noise_statistics_{:s}_ch{:d}_{:%Y%m%d}-{:%Y%m%d}.".format(
+                self.satname, ch, t[0], t[-1])
+                + ("" if self.writefig else "png"))
+
     
     def plot_noise_correlation_timeseries(self,
             timeres='3H',
@@ -1371,6 +1665,12 @@ def main():
         filename=p.log,
         loggers={"FCDR_HIRS", "typhon"})
         
+    if p.update_iwt_store:
+        for sat in ([p.sat] if p.sat else sorted(iwt_anomaly_sats)):
+            iwt_store.IWTDailyStore(sat).update(
+                end=(datetime.datetime.strptime(p.to_date, p.datefmt)
+                     if p.to_date else None))
+
     if p.plot_iwt_anomaly:
         write_timeseries_per_day_iwt_anomaly_period(
             "noaa19", datetime.date(2013, 3, 1),
@@ -1383,9 +1683,35 @@ def main():
             datetime.datetime.strptime(p.to_date, p.datefmt),
             p.sat,
             temp_fields=p.temp_fields,
-            writefig=p.write_figs)
+            writefig=p.write_figs,
+            streaming=p.streaming,
+            memory_budget=(int(p.memory_budget*2**30)
+                           if p.memory_budget else None))
 #            ch=p.channel)
 
+    if p.streaming:
+        if p.plot_noise or p.plot_noise_correlation_timeseries:
+            raise ValueError("--streaming only supported with "
+                             "--plot_noise_with_other")
+        if p.plot_noise_with_other:
+            logger.info("Accumulating noise statistics")
+            stats = na.accumulate_statistics(p.channel,
+                all_tp=p.count_fields,
+                timeres=("1D" if p.corr_timeres == "per_cycle"
+                         else p.corr_timeres),
+                calibpos=p.corr_calibpos)
+            if p.store_only:
+                outfile = pathlib.Path(
+                    typhon.config.conf["main"]["myscratchdir"],
+                    "hirs_noise_statistics_{:s}_{:%Y%m%d}-{:%Y%m%d}.nc".format(
+                        p.sat, na.start_date, na.end_date))
+                logger.info("Writing {!s}".format(outfile))
+                stats.to_netcdf(str(outfile))
+            else:
+                for ch in p.channel:
+                    na.plot_noise_statistics(stats, ch)
+        p.plot_noise_with_other = False
+
     if p.plot_noise:
         logger.info("Plotting noise")
         na.plot_noise()
@@ -1,29 +1,54 @@
-"""For utilities with disk-memoisation
+"""For utilities with disk caching
 
-This module contains a number of helper functions that employ disk
-memoisation using `joblib`.  Essentially, those functions are identical to
-counterparts elsewhere in the :py:mod:`FCDR_HIRS` package, but including disk
-memoisation.
+This module contains a number of helper functions that read data through
+a disk cache.  Essentially, those functions are identical to
+counterparts elsewhere in the :py:mod:`FCDR_HIRS` package, but reading
+through the cache.
+
+Granules are cached one at a time, with one memory-mappable file per
+field, by `~FCDR_HIRS.granule_cache.GranuleCache`.  Any period and any
+subset of fields is assembled from the granules and fields already
+cached, such that reading a different period or a different set of
+fields only decodes granules not read before, and a cache hit only loads
+the fields requested.  The size of the cache can be limited with
+``granule_cache_max_gib`` in the ``[main]`` section of the
+configuration, in which case the least recently used granules are
+evicted.
 """
 
-import numpy
-import tempfile
-import joblib
-from typhon.datasets import tovs
 from typhon.datasets import filters
-from typhon import config
 
-#: `joblib.Memory` object used for disk cache for functions in this module
-memory = joblib.Memory(
-    cachedir=config.conf["main"]["cachedir"],
-    verbose=1,
-    )
+from . import fcdr
+from .granule_cache import GranuleCache
+
+def get_cached_hirs(satname):
+    """Get HIRS object reading L1B granules through the granule cache
+
+    Parameters
+    ----------
+
+    satname : str
+        Name of the satellite.
+
+    Returns
+    -------
+
+    `~FCDR_HIRS.fcdr.HIRSFCDR`
+        HIRS FCDR object in L1B read mode, without pseudo fields, with
+        `~FCDR_HIRS.fcdr.HIRSFCDR.granule_cache` set.
+    """
+    h = fcdr.which_hirs_fcdr(satname, read="L1B")
+    h.my_pseudo_fields.clear()
+    if h.granule_cache is None:
+        h.granule_cache = GranuleCache(h)
+    return h
 
-@memory.cache
 def read_tovs_hirs_period(satname, start_date, to_date, fields):
     """Read L1B for HIRS satellite using standard orbit filters
 
     Read HIRS L1B using a set of recommended defined orbit filters.
+    Granules are read through the granule cache, see
+    `get_cached_hirs`.
 
     Parameters
     ----------
@@ -36,7 +61,10 @@ def read_tovs_hirs_period(satname, start_date, to_date, fields):
         Ending date.
     fields : List[str] or str
         List of strings, fields of which to read.  The special case "all"
-        will result in all fields being read from the dataset.
+        will result in all fields being read from the dataset.  The
+        special case "fcdr" will read only those fields needed for FCDR
+        generation, see `FCDR_HIRS.fcdr.l1b_fields_for_fcdr`, in which
+        case fields that this HIRS does not have are skipped.
 
     Returns
     -------
@@ -50,9 +78,17 @@ def read_tovs_hirs_period(satname, start_date, to_date, fields):
 
     typhon.datasets.dataset.Dataset.read_period
 
+    Raises
+    ------
+
+    KeyError
+        If any field in an explicit list of fields is not found.
     """
-    h = tovs.which_hirs(satname)
-    return h.read_period(
+    h = get_cached_hirs(satname)
+    required = fields if fields not in ("all", "fcdr") else ()
+    if fields == "fcdr":
+        fields = fcdr.l1b_fields_for_fcdr(h)
+    M = h.read_period(
         start_date,
         to_date,
         fields=fields,
@@ -63,6 +99,8 @@ def read_tovs_hirs_period(satname, start_date, to_date, fields):
             filters.HIRSFlagger(h),
             filters.HIRSCalibCountFilter(h, h.filter_calibcounts),
             filters.HIRSPRTTempFilter(h, h.filter_prttemps)])
-
-# FIXME: put something like fieldmat._SatPlotFFT._extract_counts
-# as this method takes a lot of time when plotting
+    missing = [f for f in required if f not in M.dtype.names]
+    if missing:
+        raise KeyError(f"Fields not found for {satname:s}: "
+                       f"{', '.join(missing):s}")
+    return M
@@ -8,6 +8,12 @@ future.
 """
 
 import sys
+import os
+import hashlib
+import importlib.metadata
+import pathlib
+import tempfile
+import urllib.parse
 import logging
 import datetime
 import warnings
@@ -15,9 +21,11 @@ import traceback
 import io
 import pprint
 import inspect
+import json
 import numpy
 import xarray
 import progressbar
+from typhon import config
 
 #: progressbar widget used to display progress for various reading tasks
 my_pb_widget = [progressbar.Bar("=", "[", "]"), " ",
@@ -36,8 +44,9 @@ def add_to_argparse(parser,
 
     Helper function to add flags to :class:`argparse.ArgumentParser`
     objects, where the exact same flags are occurring in multiple scripts.
-    The flags ``--verbose`` (taking a `bool`) and ``--log`` are always added as optional
-    flags.  Other flags are only added if the corresponding parameter to
+    The flags ``--verbose`` (taking a `bool`), ``--log``, and
+    ``--profile-startup`` (see `FCDR_HIRS.startup_profile`) are always
+    added as optional flags.  Other flags are only added if the corresponding parameter to
     this function is `True`.  You should call this function at most once
     for any one parser.
 
@@ -163,6 +172,12 @@ def add_to_argparse(parser,
     parser.add_argument("--log", action="store", type=str,
         help="Logfile to write to.  Leave out for stdout.")
 
+    # acted upon when the package is imported, see startup_profile
+    parser.add_argument("--profile-startup", action="store_true",
+        help=("Report time spent importing each module and in "
+              "initialisation to stderr at exit."),
+        default=False)
+
     if include_debug:
         parser.add_argument("--debug", action="store_true",
             help="Add extra debugging information", default=False)
@@ -467,3 +482,211 @@ def list_all_satellites() -> set:
             'noaa_14', 'noaa_15', 'noaa_16', 'noaa_17', 'noaa_18',
             'noaa_19', 'noaa_5', 'noaa_6', 'noaa_7', 'noaa_8', 'noaa_9',
             'tirosn', 'tn'}
+
+#: Set[str] : Encoding keys understood by the NetCDF4 backend of xarray
+netcdf_encoding_keys = {"dtype", "scale_factor", "add_offset",
+    "_FillValue", "zlib", "complevel", "shuffle", "chunksizes",
+    "contiguous", "fletcher32"}
+
+def load_encoding_table(path):
+    """Load table of encodings for FCDR variables
+
+    Such a table is written by
+    :mod:`~FCDR_HIRS.analysis.optimise_encoding`.
+
+    Parameters
+    ----------
+
+    path : str or pathlib.Path
+        JSON file containing the table.
+
+    Returns
+    -------
+
+    Dict[str, Dict[str, dict]]
+        For each FCDR type ("debug" or "easy"), a mapping from variable
+        name to its encoding.
+    """
+    with open(path, "r", encoding="utf-8") as fp:
+        return json.load(fp)
+
+def apply_encoding_table(ds, table):
+    """Apply encodings from table to dataset, in-place
+
+    Existing encodings are updated with those in the table.  Variables
+    not in the table and table entries not in the dataset are left
+    alone.  If the table sets the ``dtype``, any packing attributes not
+    in the table are removed from the encoding, and likewise for the
+    compression settings if the table sets ``zlib``.  If any of ``_FillValue``, ``scale_factor``, or
+    ``add_offset`` is set in the table and also in the attributes of the
+    variable, it is removed from the attributes, as xarray refuses to
+    write it otherwise.
+
+    Parameters
+    ----------
+
+    ds : xarray.Dataset
+        Dataset to which to apply encodings.
+    table : Mapping[str, dict]
+        Mapping from variable name to encoding, such as one of the
+        values returned by `load_encoding_table`.
+    """
+    for (k, enc) in table.items():
+        if k not in ds.variables:
+            continue
+        enc = {kk: vv for (kk, vv) in enc.items()
+               if kk in netcdf_encoding_keys}
+        if "chunksizes" in enc:
+            if len(enc["chunksizes"]) != ds[k].ndim:
+                del enc["chunksizes"]
+            else:
+                enc["chunksizes"] = tuple(min(c, n) for (c, n) in
+                    zip(enc["chunksizes"], ds[k].shape))
+        if "dtype" in enc:
+            # a new dtype comes with its own packing, if any
+            for att in {"_FillValue", "scale_factor", "add_offset"} - enc.keys():
+                ds[k].encoding.pop(att, None)
+        if "zlib" in enc:
+            for att in {"complevel", "shuffle"} - enc.keys():
+                ds[k].encoding.pop(att, None)
+        for att in {"_FillValue", "scale_factor", "add_offset"} & enc.keys():
+            ds[k].attrs.pop(att, None)
+        ds[k].encoding.update(enc)
+
+def _git_head(path):
+    """Find commit checked out in git working copy, without running git
+
+    Returns the commit and the files it was read from, or (None, []) if
+    ``path`` is not in a git working copy.
+    """
+    path = pathlib.Path(path).resolve()
+    for d in (path, *path.parents):
+        gitdir = d / ".git"
+        if gitdir.is_file():
+            # worktree or submodule
+            gitdir = d / gitdir.read_text().split(":", 1)[1].strip()
+        if gitdir.is_dir():
+            break
+    else:
+        return (None, [])
+    head = gitdir / "HEAD"
+    try:
+        ref = head.read_text().strip()
+    except OSError:
+        return (None, [])
+    if not ref.startswith("ref:"):
+        return (ref, [head])
+    ref = ref[4:].strip()
+    reffile = gitdir / ref
+    if reffile.exists():
+        return (reffile.read_text().strip(), [head, reffile])
+    packed = gitdir / "packed-refs"
+    try:
+        for line in packed.read_text().splitlines():
+            if line.endswith(" " + ref):
+                return (line.split()[0], [head, packed])
+    except OSError:
+        pass
+    return (None, [head])
+
+def _describe_distribution(d):
+    """Describe distribution like a line of ``pip freeze``
+
+    Returns the description and files that it depends on other than the
+    distribution metadata, such as git references for an editable install.
+    """
+    name = d.metadata["Name"]
+    try:
+        direct_url = json.loads(d.read_text("direct_url.json") or "null")
+    except ValueError:
+        direct_url = None
+    if not direct_url:
+        return (f"{name:s}=={d.version:s}", [])
+    url = direct_url.get("url", "")
+    editable = direct_url.get("dir_info", {}).get("editable", False)
+    watch = []
+    if "vcs_info" in direct_url:
+        vcs = direct_url["vcs_info"]
+        ref = f"{vcs['vcs']:s}+{url:s}@{vcs.get('commit_id', ''):s}"
+    elif editable and url.startswith("file://"):
+        (commit, watch) = _git_head(
+            urllib.parse.unquote(urllib.parse.urlparse(url).path))
+        if commit is None:
+            return ("# Editable install with no version control "
+                    f"({name:s}=={d.version:s})\n-e {url:s}", watch)
+        ref = f"git+{url:s}@{commit:s}"
+    else:
+        ref = url
+    if editable:
+        return (f"-e {ref:s}#egg={name:s}", watch)
+    return (f"{name:s} @ {ref:s}", watch)
+
+def get_environment_info(cache=True):
+    """Describe installed Python packages, like ``pip freeze``
+
+    Running ``pip freeze`` in a subprocess takes about a second, which
+    adds up when many short jobs are run.  Instead, list installed
+    distributions through `importlib.metadata`, and cache the result in
+    the ``environment`` subdirectory of the ``cachedir`` in the
+    ``[main]`` section of the configuration.  The cache is keyed on the
+    Python interpreter and on the modification times of the directories
+    on `sys.path`, which change whenever packages are installed or
+    removed.
+
+    As with ``pip freeze``, packages installed from version control or
+    in editable mode are listed with their URL, and, for a git working
+    copy, the commit checked out.  The commit is read from the
+    repository files, and the cache is invalidated when those change.
+
+    Parameters
+    ----------
+
+    cache : bool, optional
+        Read from and write to the cache.  Defaults to True.
+
+    Returns
+    -------
+
+    str
+        One line per installed distribution, sorted by name, in the
+        format of ``pip freeze``.
+    """
+    key = [sys.executable, sys.version]
+    for p in sys.path:
+        try:
+            key.append((p, os.stat(p or ".").st_mtime_ns))
+        except OSError:
+            pass
+    try:
+        cachefile = (pathlib.Path(config.conf["main"]["cachedir"]) /
+            "environment" /
+            (hashlib.sha1(repr(key).encode("utf-8")).hexdigest() + ".json"))
+    except KeyError:
+        cache = False
+    if cache and cachefile.exists():
+        try:
+            with cachefile.open("r", encoding="utf-8") as fp:
+                cached = json.load(fp)
+            if all(os.stat(f).st_mtime_ns == t
+                   for (f, t) in cached["watch"]):
+                return cached["info"]
+        except (OSError, ValueError, KeyError):
+            pass
+    lines = {}
+    watch = set()
+    for d in importlib.metadata.distributions():
+        if not d.metadata["Name"]:
+            continue
+        (line, files) = _describe_distribution(d)
+        lines[d.metadata["Name"].lower()] = line
+        watch.update(str(f) for f in files)
+    info = "".join(lines[k] + "\n" for k in sorted(lines))
+    if cache:
+        cachefile.parent.mkdir(parents=True, exist_ok=True)
+        (fd, tmp) = tempfile.mkstemp(dir=cachefile.parent, suffix=".json")
+        with os.fdopen(fd, "w", encoding="utf-8") as fp:
+            json.dump({"info": info,
+                       "watch": [(f, os.stat(f).st_mtime_ns)
+                                 for f in sorted(watch)]}, fp)
+        os.replace(tmp, cachefile)
+    return info
@@ -0,0 +1,244 @@
+"""Compact storage of uncertainty components in the debug FCDR
+
+The debug FCDR contains, for every effect in the measurement equation, a
+variable ``u_from_{effect}`` with the brightness temperature uncertainty
+due to that effect for every pixel and channel.  Each is the product of
+the uncertainty magnitude of the effect, which usually varies per
+calibration cycle, and the sensitivity of the brightness temperature to
+it, which varies per pixel.  Many effects enter the measurement equation
+through the same quantity, such that their sensitivities are identical
+up to a constant and they differ only in magnitude.
+
+This module stores such components in factored form.  For each
+component, the magnitude is the maximum over the scan positions, with
+dimensions ``(scanline_earth, calibrated_channel)``.  Each component
+divided by its magnitude is a relative profile between 0 and 1 per
+pixel.  Components sharing a profile, within their packing precision, refer
+to a single variable ``u_from_sensitivity_{i}`` stored as 16-bit
+integers.  Components that share their profile with no other component
+are stored unchanged.
+
+Use `factorise` before writing and `expand` or `open_debug_fcdr` to
+reconstruct the full components.  When opened with dask, the
+reconstruction is lazy.
+"""
+
+import logging
+
+import numpy
+import xarray
+
+logger = logging.getLogger(__name__)
+
+#: str : Dimension over which sensitivity profiles vary
+profile_dim = "scanpos"
+
+#: float : Relative tolerance with respect to the magnitude
+rtol = 2**-15
+
+#: dict : Encoding for the sensitivity profiles
+profile_encoding = {
+    "dtype": "u2",
+    "scale_factor": 1/65534,
+    "add_offset": 0.0,
+    "_FillValue": 65535,
+    "zlib": True,
+    "complevel": 4}
+
+def _quantise_profile(r):
+    return numpy.round(r / profile_encoding["scale_factor"]) * (
+        profile_encoding["scale_factor"])
+
+def _tolerance(da):
+    return da.encoding.get("scale_factor", 0)/2
+
+def _matches(u, mag, profile, atol):
+    recon = mag[..., numpy.newaxis] * profile
+    nan = numpy.isnan(u)
+    if not numpy.array_equal(nan, numpy.isnan(recon)):
+        return False
+    return bool(numpy.all(
+        numpy.abs(recon[~nan] - u[~nan]) <=
+            atol + rtol*numpy.broadcast_to(
+                mag[..., numpy.newaxis], u.shape)[~nan]))
+
+def factorise(ds, prefix="u_from_"):
+    """Store uncertainty components as magnitude and shared sensitivity
+
+    Parameters
+    ----------
+
+    ds : xarray.Dataset
+        Debug FCDR, such as returned by
+        `~FCDR_HIRS.processing.generate_fcdr.FCDRGenerator.get_piece`.
+    prefix : str, optional
+        Prefix of variables to consider.  Defaults to ``"u_from_"``.
+
+    Returns
+    -------
+
+    xarray.Dataset
+        Copy of ``ds`` in which each factored component ``u_from_X``
+        is replaced by ``u_from_X_magnitude`` with an attribute
+        ``sensitivity`` naming the corresponding
+        ``u_from_sensitivity_{i}`` variable.
+    """
+    names = [k for k in ds.data_vars
+             if k.startswith(prefix) and profile_dim in ds[k].dims]
+    # profiles as (dims, values, members), values with profile_dim last
+    profiles = []
+    magnitudes = {}
+    for k in names:
+        da = ds[k]
+        other = [d for d in da.dims if d != profile_dim]
+        u = da.transpose(*other, profile_dim).values.astype("f8")
+        with numpy.errstate(invalid="ignore", divide="ignore"):
+            mag = numpy.nanmax(numpy.abs(u), axis=-1) \
+                if u.size else numpy.zeros(u.shape[:-1])
+            mag = numpy.where(numpy.isfinite(mag), mag, 0)
+            r = numpy.where(mag[..., numpy.newaxis] > 0,
+                            u / mag[..., numpy.newaxis], 0)
+        if "scale_factor" in da.encoding:
+            # compare with the magnitude as it will be stored
+            sf = da.encoding["scale_factor"]
+            off = da.encoding.get("add_offset", 0)
+            mag = numpy.round((mag-off)/sf)*sf + off
+        atol = _tolerance(da)
+        for (dims, profile, members) in profiles:
+            if dims == da.dims and _matches(u, mag, profile, atol):
+                members.append(k)
+                break
+        else:
+            profile = numpy.clip(_quantise_profile(r), 0, 1)
+            if not _matches(u, mag, profile, atol):
+                logger.debug(f"Cannot factor {k:s} within precision, "
+                             "storing in full")
+                continue
+            profiles.append((da.dims, profile, [k]))
+        magnitudes[k] = xarray.DataArray(mag, dims=other,
+            coords={d: ds.coords[d] for d in other if d in ds.coords},
+            attrs=da.attrs)
+        magnitudes[k].encoding = {kk: vv for (kk, vv) in da.encoding.items()
+            if kk not in {"chunksizes", "original_shape", "source"}}
+    # a profile used by a single component saves nothing
+    profiles = [p for p in profiles if len(p[2]) > 1]
+    if not profiles:
+        return ds
+    ds = ds.copy()
+    for (i, (dims, profile, members)) in enumerate(profiles):
+        name = f"{prefix:s}sensitivity_{i:d}"
+        other = [d for d in dims if d != profile_dim]
+        ds[name] = xarray.DataArray(profile, dims=(*other, profile_dim),
+            coords={d: ds.coords[d] for d in dims if d in ds.coords},
+            attrs={"long_name": "Relative sensitivity profile shared by "
+                                "factored uncertainty components",
+                   "units": "1"}).transpose(*dims)
+        ds[name].encoding = dict(profile_encoding)
+        for k in members:
+            ds = ds.drop_vars(k)
+            ds[f"{k:s}_magnitude"] = magnitudes[k]
+            ds[f"{k:s}_magnitude"].attrs["sensitivity"] = name
+    logger.info(f"Factored {sum(len(p[2]) for p in profiles):d} out of "
+                f"{len(names):d} uncertainty components into "
+                f"{len(profiles):d} sensitivity profiles")
+    return ds
+
+def expand(ds, prefix="u_from_"):
+    """Reconstruct uncertainty components stored with `factorise`
+
+    If ``ds`` is backed by dask arrays, the reconstruction is lazy.
+
+    Parameters
+    ----------
+
+    ds : xarray.Dataset
+        Dataset with factored components.  Datasets without factored
+        components are returned unchanged.
+    prefix : str, optional
+        Prefix of factored variables.  Defaults to ``"u_from_"``.
+
+    Returns
+    -------
+
+    xarray.Dataset
+        Dataset with full ``u_from_X`` components and without the
+        magnitude and sensitivity variables.
+    """
+    mags = [k for k in ds.data_vars
+            if k.startswith(prefix) and k.endswith("_magnitude")
+            and "sensitivity" in ds[k].attrs]
+    if not mags:
+        return ds
+    ds = ds.copy()
+    profs = set()
+    for k in mags:
+        prof = ds[k].attrs["sensitivity"]
+        profs.add(prof)
+        full = ds[k] * ds[prof]
+        full = full.transpose(*ds[prof].dims)
+        full.attrs = {kk: vv for (kk, vv) in ds[k].attrs.items()
+                      if kk != "sensitivity"}
+        full.encoding = dict(ds[k].encoding)
+        ds[k[:-len("_magnitude")]] = full
+    return ds.drop_vars(mags + sorted(profs))
+
+def fields_to_read(path, fields, prefix="u_from_"):
+    """Get fields to read from file for requested components
+
+    Only the metadata of the file are read.
+
+    Parameters
+    ----------
+
+    path : str or pathlib.Path
+        Debug FCDR file.
+    fields : List[str]
+        Fields requested.
+    prefix : str, optional
+        Prefix of factored variables.  Defaults to ``"u_from_"``.
+
+    Returns
+    -------
+
+    List[str]
+        Fields to read from the file such that `expand` can reconstruct
+        the requested components.  Requested components stored in
+        factored form are replaced by their magnitude and sensitivity
+        variables.  If the file has no factored components, this is
+        ``fields`` unchanged.
+    """
+    with xarray.open_dataset(str(path)) as ds:
+        out = []
+        for f in fields:
+            mag = f"{f:s}_magnitude"
+            if (f.startswith(prefix) and f not in ds.variables
+                    and mag in ds.variables
+                    and "sensitivity" in ds[mag].attrs):
+                new = [mag, ds[mag].attrs["sensitivity"]]
+            else:
+                new = [f]
+            out.extend(k for k in new if k not in out)
+    return out
+
+def open_debug_fcdr(path, chunks=None, **kwargs):
+    """Open debug FCDR file and reconstruct factored components
+
+    Parameters
+    ----------
+
+    path : str or pathlib.Path
+        Debug FCDR file.
+    chunks : int, dict, or None, optional
+        Passed on to `xarray.open_dataset`.  Pass ``{}`` to open with
+        dask, such that components are only reconstructed when their
+        values are accessed.
+    **kwargs
+        Other arguments passed on to `xarray.open_dataset`.
+
+    Returns
+    -------
+
+    xarray.Dataset
+        Debug FCDR with full ``u_from_X`` components.
+    """
+    return expand(xarray.open_dataset(str(path), chunks=chunks, **kwargs))
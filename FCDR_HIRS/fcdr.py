@@ -54,6 +54,7 @@ import numbers
 import math
 
 import numpy
+import numpy.lib.recfunctions
 import scipy.interpolate
 import progressbar
 import pandas
@@ -69,6 +70,7 @@ from typhon.physics.units.tools import UnitsAwareDataArray, UnitsAwareDataArray
 from typhon.utils import get_time_dimensions
     
 import typhon.datasets.dataset
+import typhon.datasets._tovs_defs
 import typhon.physics.units
 from typhon.physics.units.common import ureg, radiance_units as rad_u
 from typhon.datasets.tovs import (Radiometer, HIRS, HIRSPOD, HIRS2,
@@ -81,6 +83,8 @@ from . import filters
 from . import _fcdr_defs
 from . import _harm_defs
 from . import common
+from . import factored_uncertainty
+from . import math as fcm
 from .common import list_all_satellites
 from .exceptions import (FCDRError, FCDRWarning) # used to be here
 
@@ -223,12 +227,33 @@ class HIRSFCDR(typhon.datasets.dataset.HomemadeDataset):
     #: Not used.
     realisations = 100
 
-    srfs = None
-    """List of :class:`~typhon.physics.units.SRF` objects.
+    _srfs = None
 
-    Set by `__init__`, after instantiation this attribute will contain a
-    list of SRFs, specifically of :class:`typhon.physics.units.SRF` objects.
-    """
+    @property
+    def srfs(self):
+        """List of :class:`~typhon.physics.units.SRF` objects.
+
+        Read on first access rather than in `__init__`, such that scripts
+        that never need the SRFs do not pay for reading them.
+        """
+        if self._srfs is None:
+            for nm in self._srf_satnames:
+                try:
+                    self._srfs = [typhon.physics.units.em.SRF.fromRTTOV(
+                                  typhon.datasets.tovs.norm_tovs_name(nm, "RTTOV"),
+                                  self.section, i) for i in range(1, 20)]
+                except FileNotFoundError:
+                    pass # try the next one
+                else:
+                    break
+            else:
+                raise ValueError("Could not find SRF for any of: {:s}".format(
+                    ','.join(self._srf_satnames)))
+        return self._srfs
+
+    @srfs.setter
+    def srfs(self, value):
+        self._srfs = value
 
     #: name of satellite to which this edition of the HIRS FCDR belongs
     satname = None
@@ -286,24 +311,45 @@ class HIRSFCDR(typhon.datasets.dataset.HomemadeDataset):
 
     no_harm = False #: suppress harmonisation
 
+    angle_tiepoints = (8, 4)
+    """Tie point spacing (scanlines, scan positions) for `calc_angles`
+
+    Satellite and solar angles are calculated exactly on a grid of tie
+    points with this spacing, then interpolated bilinearly to full
+    resolution.  The two scan positions either side of nadir are always
+    tie points, because the satellite zenith angle has a kink and the
+    satellite azimuth angle a discontinuity there.  The maximum
+    interpolation error, estimated at a sample
+    of points halfway between the tie points, is stored in the
+    ``tiepoint_max_error`` attribute of each angle.  Set to `None` to
+    calculate all angles exactly at full resolution.
+    """
+
+    #: Maximum number of scanlines on which to check the tie point error
+    angle_tiepoints_nr_check = 16
+
+    granule_cache = None
+    """`~FCDR_HIRS.granule_cache.GranuleCache` : Cache for L1B granules
+
+    If set, L1B granules are read through this cache, which stores them
+    after decoding and per-granule filtering.  Defaults to None, which
+    means every granule is decoded every time it is read.
+    """
+
+    granule_index = None
+    """`~FCDR_HIRS.granule_index.GranuleIndex` : Index of L1B granule times
+
+    If set, `find_most_recent_granule_before` looks up granules in this
+    index rather than scanning the archive.  Defaults to None.
+    """
+
     def __new__(cls, name=None, **kwargs):
         if name is None and "satname" in kwargs:
             name = "fcdr_hirs_" + kwargs["satname"]
         return super().__new__(cls, name, **kwargs)
 
     def __init__(self, read="L1B", *args, satname, **kwargs):
-        for nm in {satname}|self.satellites[satname]:
-            try:
-                self.srfs = [typhon.physics.units.em.SRF.fromRTTOV(
-                              typhon.datasets.tovs.norm_tovs_name(nm, "RTTOV"),
-                              self.section, i) for i in range(1, 20)]
-            except FileNotFoundError:
-                pass # try the next one
-            else:
-                break
-        else:
-            raise ValueError("Could not find SRF for any of: {:s}".format(
-                ','.join({satname}|self.satellites[satname])))
+        self._srf_satnames = {satname}|self.satellites[satname]
         self.read_mode = read
         if read == "L1C":
             self.re = self.stored_re # before super()
@@ -347,11 +393,46 @@ class HIRSFCDR(typhon.datasets.dataset.HomemadeDataset):
         #self.hirs = hirs
         #self.srfs = srfs
 
+    def find_most_recent_granule_before(self, instant, **locator_args):
+        # docstring in parent class
+        if self.granule_index is not None and not (
+                locator_args.keys() - {"return_time"}):
+            return self.granule_index.find_most_recent_granule_before(
+                instant, **locator_args)
+        return super().find_most_recent_granule_before(
+            instant, **locator_args)
+
     def _read(self, *args, **kwargs):
         if self.read_mode == "L1C":
-            return super()._read(*args, **kwargs)
+            # components may be stored factored, see factored_uncertainty;
+            # then read their magnitudes and profiles instead
+            fields = kwargs.get("fields", "all")
+            if fields != "all" and args and any(f.startswith("u_from_")
+                                                for f in fields):
+                kwargs["fields"] = factored_uncertainty.fields_to_read(
+                    args[0], fields)
+            res = super()._read(*args, **kwargs)
+            (ds, extra) = res if isinstance(res, tuple) else (res, None)
+            if isinstance(ds, xarray.Dataset):
+                ds = factored_uncertainty.expand(ds)
+                if fields != "all":
+                    ds = ds[[f for f in fields if f in ds.variables]]
+            return ds if extra is None else (ds, extra)
         elif self.read_mode == "L1B":
-            return self.l1b_base._read(self, *args, **kwargs)
+            # Read all fields and select those available afterward, as
+            # not every HIRS has every field in l1b_fields_for_fcdr.  The
+            # reading routine decodes all fields anyway.
+            fields = kwargs.pop("fields", "all")
+            if self.granule_cache is not None:
+                (M, extra) = self.granule_cache.read(
+                    functools.partial(self.l1b_base._read, self),
+                    *args, fields=fields, **kwargs)
+            else:
+                (M, extra) = self.l1b_base._read(self, *args, **kwargs)
+                if fields != "all":
+                    M = numpy.lib.recfunctions.repack_fields(
+                        M[[f for f in fields if f in M.dtype.names]])
+            return (M, extra)
 #            return super(typhon.datasets.dataset.HomemadeDataset, self)._read(
 #                *args, **kwargs)
         else:
@@ -424,9 +505,12 @@ class HIRSFCDR(typhon.datasets.dataset.HomemadeDataset):
         you are using a self-emission model, you probably want to use
         ``kind="zero"``, as to not double-count self-emission.
 
-        Although designed between calibration parameters, it is really
-        just a wrapper around `scipy.interpolate.interp1d` so it can be
-        used in other contexts as well.
+        Although designed between calibration parameters, it can be used
+        in other contexts as well.  Results are identical to those of
+        `scipy.interpolate.interp1d`, but the interpolation weights are
+        calculated by `math.CalibrationInterpolator` only once for any
+        combination of times and ``kind``, and all arrays in ``args`` are
+        interpolated together in a single operation.
 
         Parameters
         ----------
@@ -449,9 +533,10 @@ class HIRSFCDR(typhon.datasets.dataset.HomemadeDataset):
 
         kind : str, optional
 
-            Type of interpolation to use.  Options are as for
-            `scipy.interpolate.interp1d`, which is where the actual
-            interpolation is being done.  Defaults to ``"nearest"``.
+            Type of interpolation to use.  Options are ``"nearest"``,
+            ``"zero"``, ``"linear"``, and ``"cubic"``, with the same
+            meaning as for `scipy.interpolate.interp1d`.  Defaults to
+            ``"nearest"``.
         
         Returns
         -------
@@ -468,7 +553,9 @@ class HIRSFCDR(typhon.datasets.dataset.HomemadeDataset):
 
         x = numpy.asarray(calib_time.astype("M8[ms]").astype("u8"))
         xx = numpy.asarray(target_time.astype("M8[ms]").astype("u8"))
-        out = []
+        interp = fcm.get_calib_interpolator(x, xx, kind)
+        units = []
+        ys = []
         for y in args:
             try:
                 u = y.u
@@ -477,39 +564,41 @@ class HIRSFCDR(typhon.datasets.dataset.HomemadeDataset):
                     u = y.attrs["units"]
                 except (AttributeError, KeyError):
                     u = None
-            try:
-                xh = y["time"]
-            except (ValueError, IndexError):
-                xh = x
             if not isinstance(y, (numpy.ndarray, xarray.DataArray)):
                 y = numpy.ma.asarray(y)
-            # explicitly set masked data to nan, for scipy.interpolate
+            # explicitly set masked data to nan, for the interpolation
             # doesn't understand this
             try:
                 if not numpy.isscalar(y.mask):
                     y.data[y.mask] = numpy.nan
             except AttributeError:
                 pass # not a masked array
-            fnc = scipy.interpolate.interp1d(
-                x, y,
-                kind=kind,
-                #fill_value="extrapolate",
-                fill_value="extrapolate" if kind=="nearest" else numpy.nan,
-                bounds_error=False,
-                axis=0)
-
-            yy = numpy.ma.masked_invalid(fnc(xx))
+            units.append(u)
+            ys.append(y)
+
+        # stack everything along trailing dimensions and interpolate at once
+        flat = [numpy.asarray(
+                    y.values if isinstance(y, xarray.DataArray)
+                    else numpy.ma.getdata(y), dtype="f8").reshape(x.size, -1)
+                for y in ys]
+        yy_all = interp(numpy.concatenate(flat, 1)) if flat else None
+        splits = numpy.cumsum([f.shape[1] for f in flat])[:-1]
+
+        out = []
+        for (y, u, yy) in zip(ys, units, numpy.split(yy_all, splits, 1)
+                                         if flat else []):
+            yy = yy.reshape((xx.size,) + numpy.shape(y)[1:])
             if isinstance(y, xarray.DataArray):
                 out.append(
                     UADA(
-                        fnc(xx),
+                        yy,
                         dims=("time",),
                         coords={"time": target_time},
                         attrs={"units": y.attrs["units"]} if u else {}))
             elif u is None:
-                out.append(yy)
+                out.append(numpy.ma.masked_invalid(yy))
             else:
-                out.append(ureg.Quantity(yy, u))
+                out.append(ureg.Quantity(numpy.ma.masked_invalid(yy), u))
 
         return out
 
@@ -581,8 +670,9 @@ class HIRSFCDR(typhon.datasets.dataset.HomemadeDataset):
 
         ds : `xarray.Dataset`
             L1B HIRS data from which to extract the calibration counts.
-        ch : int
-            Channel for which to extract the calibration counts.
+        ch : int or List[int]
+            Channel for which to extract the calibration counts.  If a
+            list, the ``calibrated_channel`` dimension is retained.
         fail_if_none : bool, optional
             If there are none at all, raise an exception.  Defaults to
             False, which simply returns an empty array.
@@ -654,6 +744,54 @@ class HIRSFCDR(typhon.datasets.dataset.HomemadeDataset):
 
         return (counts_space, counts_iwct)
 
+    _calibfilter_cache = None
+    def filter_calibcounts_all(self, ds):
+        """Apply `calibfilter` to all channels and both calibration views
+
+        Extract space and IWCT counts for all channels at once and apply
+        `calibfilter` to all calibration lines in a single vectorised
+        pass, rather than once per channel and view.  The result is
+        cached for the most recent ``ds``, because
+        `calculate_offset_and_slope` is called many times for the same
+        context within `calculate_radiance_all`.
+
+        Parameters
+        ----------
+
+        ds : `xarray.Dataset`
+            L1B HIRS data from which to extract the calibration counts.
+
+        Returns
+        -------
+
+        bad_space : `xarray.DataArray`
+            True for space calibration lines to be rejected, with
+            dimensions ``time`` (of the space views) and
+            ``calibrated_channel``.
+        bad_iwct : `xarray.DataArray`
+            Same for IWCT calibration lines, with the same coordinates.
+        """
+        if (self._calibfilter_cache is not None and
+                self._calibfilter_cache[0] is ds):
+            return self._calibfilter_cache[1]
+        channels = list(range(1, 20))
+        (counts_space, counts_iwct) = self.extract_calibcounts(ds, channels)
+        coords = {k: v for (k, v) in counts_space.coords.items()
+                  if k != "scanpos"}
+        dims = ("time", "calibrated_channel")
+        bad = numpy.empty((2, counts_space["time"].size, len(channels)),
+                          dtype=numpy.bool_)
+        if bad.size > 0:
+            self.calibfilter.iqr_exceeds_adev(
+                numpy.stack(
+                    [c.transpose("time", "calibrated_channel", "scanpos").values
+                        for c in (counts_space, counts_iwct)]),
+                axis=-1, out=bad)
+        result = tuple(xarray.DataArray(b, dims=dims, coords=coords)
+                       for b in bad)
+        self._calibfilter_cache = (ds, result)
+        return result
+
     def extract_calibcounts_and_temp(self, ds, ch, srf=None,
             return_u=False, return_ix=False, tuck=False,
             include_emissivity_correction=True):
@@ -1273,8 +1411,11 @@ class HIRSFCDR(typhon.datasets.dataset.HomemadeDataset):
             # (25, 75) … > 2: false positive 0.2%
             # (10, 90) … > 3.3: false positive 0.5%
             # …based on a simple simulated # experiment.
-            bad_iwct = self.calibfilter.filter_calibcounts(counts_iwct)
-            bad_space = self.calibfilter.filter_calibcounts(counts_space)
+            # copy, because the selection is a view on the cached result
+            # of filter_calibcounts_all, which is updated in-place below
+            (bad_space, bad_iwct) = (
+                da.sel(calibrated_channel=ch).copy()
+                for da in self.filter_calibcounts_all(ds))
 
             # filter IWCT and space outliers
             bad_iwct |= self.filter_calibcounts.filter_outliers(
@@ -1646,12 +1787,12 @@ class HIRSFCDR(typhon.datasets.dataset.HomemadeDataset):
             interp_slope_modes = {}
             interp_bad_modes = {}
             if offset.shape[0] > 1 or ((naive or has_context) and time.shape[0]>0):
+                moff = offset.median(dim="scanpos", keep_attrs=True)
+                mslp = slope.median(dim="scanpos", keep_attrs=True)
+                bad = (
+                    self.filter_calibcounts.filter_outliers(moff.values) |
+                    self.filter_calibcounts.filter_outliers(mslp.values))
                 for mode in ("zero",) if naive else ("zero", "linear", "cubic"):
-                    moff = offset.median(dim="scanpos", keep_attrs=True)
-                    mslp = slope.median(dim="scanpos", keep_attrs=True)
-                    bad = (
-                        self.filter_calibcounts.filter_outliers(moff.values) |
-                        self.filter_calibcounts.filter_outliers(mslp.values))
                     (interp_offset, interp_slope, interp_bad) = self.interpolate_between_calibs(
                         ds["time"], time,
                         moff, mslp, bad,
@@ -2124,6 +2265,7 @@ class HIRSFCDR(typhon.datasets.dataset.HomemadeDataset):
         # uncertainties after.
         self._quantities.clear() # don't accidentally use old quantities…
         self._other_quantities.clear()
+        self._calibfilter_cache = None
         self._reset_flags(ds)
 #        self._flags["scanline"].clear()
 #        self._flags["channel"].clear()
@@ -3404,18 +3546,30 @@ class HIRSFCDR(typhon.datasets.dataset.HomemadeDataset):
             yield from self.propagate_uncertainty_components(u,
                 sens[k][1], comp[k][1], sens_to_here)
 
-    def calc_angles(self, ds):
+    def calc_angles(self, ds, tiepoints=None):
         """Calculate satellite and solar angles
 
         Calculate satellite zenith angle, satellite azimuth angle, solar
         zenith angle, solar azimuth angle.
 
+        Unless ``tiepoints`` is `False` (or `angle_tiepoints` is `None`),
+        angles are calculated exactly on a sparse grid of tie points and
+        interpolated to full resolution.  The maximum absolute difference
+        with the exact calculation, evaluated halfway between tie points
+        on a sample of scanlines, is stored in the attribute
+        ``tiepoint_max_error`` of each returned angle.
+
         Parameters
         ----------
 
         ds : xarray.Dataset
 
             Segment of L1B data
+        tiepoints : Tuple[int, int] or bool, optional
+
+            Spacing of tie points in scanlines and scan positions.  Pass
+            `False` to calculate exact angles at full resolution.  Defaults
+            to `angle_tiepoints`.
 
         Returns
         -------
@@ -3431,6 +3585,9 @@ class HIRSFCDR(typhon.datasets.dataset.HomemadeDataset):
             Solar azimuth angle in degrees.
         """
 
+        if tiepoints is None:
+            tiepoints = self.angle_tiepoints
+
         # satellite angles
         satlatlon = ds[["lat","lon"]].sel(
             scanpos=[28, 29]).reset_coords(["lat", "lon"])
@@ -3439,35 +3596,90 @@ class HIRSFCDR(typhon.datasets.dataset.HomemadeDataset):
         crossing = Δlon>180
         satlatlon["lon"][{"scanline_earth":crossing.values,"scanpos":0}] += 360
         satlatlon = satlatlon.mean("scanpos")
-        satelev = ds["platform_altitude"]
+
+        sat_lon = satlatlon["lon"].values
+        sat_lat = satlatlon["lat"].values
+        sat_alt = ds["platform_altitude"].values
+        # FIXME: Who cares?
+        t = ds["time"].values
+        lon = ds["lon"].values
+        lat = ds["lat"].values
+        (n_l, n_p) = lon.shape
+
+        if not tiepoints or n_l < 2:
+            angles = self._calc_angles_exact(
+                sat_lon, sat_lat, sat_alt, t, lon, lat)
+            max_err = None
+        else:
+            tp_l = fcm.tiepoint_indices(n_l, tiepoints[0])
+            tp_p = fcm.tiepoint_indices(n_p, tiepoints[1],
+                include=(n_p//2-1, n_p//2))
+            angles_tp = self._calc_angles_exact(
+                sat_lon[tp_l], sat_lat[tp_l], sat_alt[tp_l], t[tp_l],
+                lon[numpy.ix_(tp_l, tp_p)], lat[numpy.ix_(tp_l, tp_p)])
+            angles = [fcm.tiepoint_interpolate(a, tp_l, tp_p, n_l, n_p,
+                        periodic=per)
+                      for (a, per) in zip(angles_tp, (None, 360, None, 360))]
+            # check on lines halfway between tie point lines, all positions
+            chk = numpy.unique((tp_l[:-1] + tp_l[1:])//2)
+            chk = chk[numpy.linspace(0, chk.size-1,
+                        min(chk.size, self.angle_tiepoints_nr_check)).astype("i8")]
+            angles_chk = self._calc_angles_exact(
+                sat_lon[chk], sat_lat[chk], sat_alt[chk], t[chk],
+                lon[chk, :], lat[chk, :])
+            max_err = []
+            for (a, a_chk, per) in zip(angles, angles_chk,
+                                       (None, 360, None, 360)):
+                Δ = numpy.abs(a[chk, :] - a_chk)
+                if per is not None:
+                    Δ = numpy.minimum(Δ, per-Δ)
+                max_err.append(float(numpy.nanmax(Δ)) if Δ.size else 0.0)
+            logger.debug("Angles interpolated from tie points every "
+                f"{tiepoints[0]:d} lines, {tiepoints[1]:d} positions, "
+                "maximum error (sat_za, sat_aa, sun_za, sun_aa) "
+                "{:.4f}°, {:.4f}°, {:.4f}°, {:.4f}°".format(*max_err))
+
+        names = ("platform_zenith_angle", "platform_azimuth_angle",
+                 "solar_zenith_angle", "solar_azimuth_angle")
+        out = []
+        for (i, (a, name)) in enumerate(zip(angles, names)):
+            da = self._quantity_to_xarray(a, name)
+            if max_err is not None:
+                da.attrs["tiepoint_max_error"] = max_err[i]
+            out.append(da)
+
+        (sat_za, sat_aa, sun_za, sun_aa) = out
+        return (sat_za, sat_aa, sun_za, sun_aa)
+
+    @staticmethod
+    def _calc_angles_exact(sat_lon, sat_lat, sat_alt, t, lon, lat):
+        """Calculate angles exactly for each ground pixel
+
+        Helper for `calc_angles`.  Satellite position and time are given
+        per scanline, ground positions per pixel.
+
+        Returns
+        -------
+
+        Tuple[ndarray, ndarray, ndarray, ndarray]
+            Satellite zenith, satellite azimuth, solar zenith, and solar
+            azimuth angles, in degrees.
+        """
         (sat_aa, sat_ea) = pyorbital.orbital.get_observer_look(
-            satlatlon["lon"],
-            satlatlon["lat"],
-            satelev,
-            ds["time"], # FIXME: Who cares?
-            ds["lon"],
-            ds["lat"],
-            numpy.zeros(ds["lat"].shape)) # elevations
-            
+            sat_lon[:, numpy.newaxis],
+            sat_lat[:, numpy.newaxis],
+            sat_alt[:, numpy.newaxis],
+            t[:, numpy.newaxis],
+            lon,
+            lat,
+            numpy.zeros(lat.shape)) # elevations
         (sun_el_rad, sun_az_rad) = pyorbital.astronomy.get_alt_az(
-            ds["time"],
-            ds["lon"],
-            ds["lat"])
-
-        sun_za = self._quantity_to_xarray(
-            90 - numpy.rad2deg(sun_el_rad),
-            "solar_zenith_angle")
-        sun_aa = self._quantity_to_xarray(
-            numpy.rad2deg(sun_az_rad),
-            "solar_azimuth_angle")
-        sat_za = self._quantity_to_xarray(
-            90 - sat_ea,
-            "platform_zenith_angle")
-        sat_aa = self._quantity_to_xarray(
-            sat_aa,
-            "platform_azimuth_angle")
+            t[:, numpy.newaxis], lon, lat)
 
-        return (sat_za, sat_aa, sun_za, sun_aa)
+        return (numpy.asarray(90 - sat_ea),
+                numpy.asarray(sat_aa),
+                numpy.asarray(90 - numpy.rad2deg(sun_el_rad)),
+                numpy.asarray(numpy.rad2deg(sun_az_rad)))
 
 
     #####################################################################
@@ -3815,6 +4027,61 @@ def which_hirs_fcdr(satname, *args, **kwargs):
     else:
         raise ValueError("Unknown HIRS satellite: {:s}".format(satname))
 
+l1b_fields_used = {
+    # calculate_radiance_all: calibration, self-emission, Earth counts
+    "time", "counts", "scantype",
+    # get_flags, HIRSBestLineFilter, HIRSTimeSequenceDuplicateFilter
+    "scanline_number", "quality_flags_bitfield",
+    "line_quality_flags_bitfield", "channel_quality_flags_bitfield",
+    "minorframe_quality_flags_bitfield",
+    # calc_angles and geolocation
+    "latitude", "longitude", "platform_altitude",
+    # copied to debug FCDR by FCDRGenerator.get_piece, for comparison
+    "platform_zenith_angle", "local_azimuth_angle", "solar_zenith_angle",
+    "toa_brightness_temperature",
+    "toa_outgoing_radiance_per_unit_frequency"}
+"""Set[str] : L1B fields consumed in FCDR generation
+
+Names are as in the `xarray.Dataset` returned by ``as_xarray_dataset``.
+Temperatures are not listed here, see `l1b_fields_for_fcdr`.
+"""
+
+def l1b_fields_for_fcdr(hirs, temperatures="all"):
+    """Get names of L1B fields to read for FCDR generation
+
+    Translate `l1b_fields_used` and the requested temperatures to the
+    field names used by the L1B reading routine, such that only those are
+    kept when reading L1B data for FCDR generation.
+
+    Parameters
+    ----------
+
+    hirs : `typhon.datasets.tovs.HIRS`
+        HIRS object for which to get the field names.  Can also be a
+        `HIRSFCDR` object.
+    temperatures : Collection[str] or str, optional
+        Temperatures to read, such as ``"baseplate"`` or
+        ``"internal_warm_calibration_target"``.  Defaults to "all", which
+        includes all temperatures that any HIRS of this version may
+        have.  Not every instrument has all of those, so "all" is only
+        suitable for reading with `HIRSFCDR`, which skips unavailable
+        fields.  The debug FCDR contains all temperatures.
+
+    Returns
+    -------
+
+    List[str]
+        L1B field names.
+    """
+    props = typhon.datasets._tovs_defs.HIRS_data_vars_props[hirs.version]
+    return sorted(
+        {"time", "lat", "lon"} |
+        {k for (k, v) in props.items()
+            if v[0] in l1b_fields_used or (
+                v[0].startswith("temperature_") and
+                (temperatures == "all" or
+                 v[0][len("temperature_"):] in temperatures))})
+
 def list_all_satellites_chronologically():
     """Return a list of all satellite names, sorted
 
@@ -10,10 +10,8 @@ Filtering on the reading routine is implemented in
 import abc
 
 import numpy
-import scipy.stats
 
 from typhon.datasets.filters import OutlierFilter, MEDMAD
-from typhon.math.stats import adev
 
 class CalibrationMirrorFilter(metaclass=abc.ABCMeta):
     """Filter for cases where first N space views do not really view space
@@ -64,11 +62,52 @@ class IQRCalibFilter(CalibrationMirrorFilter):
         self.cutoff = cutoff
 
     def filter_calibcounts(self, counts, dim="scanpos"):
-        # NB: need to encapsulate this or it will fail with ValueError,
-        # see https://github.com/scipy/scipy/issues/7178
-        return counts.reduce(
-            scipy.stats.iqr, dim=dim,
-            rng=self.rng) > self.cutoff * adev(counts, dim=dim)
+        return counts.reduce(self.iqr_exceeds_adev, dim=dim)
+
+    def iqr_exceeds_adev(self, counts, axis=-1, out=None):
+        """Compare IQR to Allan deviation for many calibration lines at once
+
+        Vectorised kernel behind `filter_calibcounts`, operating on plain
+        ndarrays.  All leading dimensions are handled in a single pass, so
+        that calibration lines for all channels and both calibration views
+        can be filtered with one call.  Quantiles are obtained with
+        `numpy.partition` rather than by sorting, using the same linear
+        interpolation as `scipy.stats.iqr`.
+
+        Parameters
+        ----------
+
+        counts : array_like
+            Calibration counts.  Lines containing nan are never rejected,
+            consistent with comparisons to nan in `scipy.stats.iqr`.
+        axis : int, optional
+            Axis corresponding to the scan position.  Defaults to -1.
+        out : ndarray, optional
+            Preallocated boolean array in which to store the result.  Must
+            have the shape of ``counts`` without ``axis``.
+
+        Returns
+        -------
+
+        ndarray
+            True for calibration lines where the inter quartile range
+            exceeds ``cutoff`` times the Allan deviation.
+        """
+        x = numpy.moveaxis(numpy.asarray(counts, dtype="f8"), axis, -1)
+        N = x.shape[-1]
+        q = numpy.asarray(self.rng, dtype="f8")/100 * (N-1)
+        lo = numpy.floor(q).astype("i8")
+        hi = numpy.ceil(q).astype("i8")
+        part = numpy.partition(x, numpy.unique(numpy.r_[lo, hi]), axis=-1)
+        qv = part[..., lo] + (q-lo) * (part[..., hi] - part[..., lo])
+        iqr = qv[..., 1] - qv[..., 0]
+        adev = numpy.sqrt(
+            (numpy.diff(x, axis=-1)**2).sum(-1) / (2*(N-1)))
+        if out is None:
+            out = numpy.empty(x.shape[:-1], dtype=numpy.bool_)
+        numpy.greater(iqr, self.cutoff*adev, out=out)
+        out[numpy.isnan(x).any(-1)] = False
+        return out
 
 
 class ImSoColdFilter:
@@ -0,0 +1,396 @@
+"""Persistent index of flag counts per granule
+
+Plotting how often flags are set, as done by
+`~FCDR_HIRS.analysis.plot_flags`, means reading the L1B data for the
+whole period and expanding every bit of every flag field, which for
+multi-year statistics takes hours.  This module implements an index
+holding, for each granule, how many scanlines have each bit of each flag
+field set, per channel, minor frame, or whatever other dimensions a flag
+field has besides time.  The index is built once by a separate pass over
+the L1B data, see `FlagIndex.build`, and updated incrementally for
+granules that were added or changed since.  Flag statistics for any
+period at daily or coarser resolution can then be calculated from the
+index alone, see `FlagIndex.percentages`.
+
+The index is stored as one NetCDF file per satellite and month, with one
+record per granule along the dimension ``granule``.  The count for flag
+field ``X`` is stored in variable ``X`` with dimensions ``("granule",
+"X_bit", ...)``, where the coordinate ``X_bit`` contains the flag masks
+and the attribute ``flag_meanings`` their meanings.  Granules are
+assigned to the month in which they start.  Scanlines already covered by
+the preceding granule are counted only once.
+"""
+
+import itertools
+import logging
+import os
+import pathlib
+import tempfile
+
+import numpy
+import xarray
+
+import typhon.datasets.dataset
+import typhon.datasets.filters
+from typhon import config
+
+logger = logging.getLogger(__name__)
+
+#: Tuple[str] : Flag fields that are indexed, as named in the dataset
+#: returned by `typhon.datasets.tovs.HIRS.as_xarray_dataset`
+flag_fields = ("quality_flags_bitfield", "line_quality_flags_bitfield",
+               "channel_quality_flags_bitfield",
+               "minorframe_quality_flags_bitfield")
+
+def count_flags(ds, time_dim="time", after=None):
+    """Count how often each flag bit is set
+
+    Parameters
+    ----------
+
+    ds : xarray.Dataset
+        L1B data as returned by
+        `typhon.datasets.tovs.HIRS.as_xarray_dataset`.  Flag fields
+        converted to floating point by the latter have missing values
+        as NaN, which count as no flag set.
+    time_dim : str, optional
+        Dimension along the scanlines.  Defaults to ``"time"``.
+    after : numpy.datetime64, optional
+        If given, only count scanlines later than this.
+
+    Returns
+    -------
+
+    xarray.Dataset
+        For each field in `flag_fields` present in ``ds``, the number of
+        scanlines with each bit set, with dimensions ``("X_bit", ...)``.
+        Variable ``n_scanlines`` contains the number of scanlines
+        counted, and ``start_time`` and ``end_time`` the times of the
+        first and last of those.
+    """
+    if after is not None:
+        ds = ds.isel({time_dim: ds[time_dim].values > after})
+    counts = {}
+    for fld in flag_fields:
+        if fld not in ds:
+            continue
+        da = ds[fld]
+        masks = numpy.atleast_1d(da.attrs["flag_masks"]).astype("i8")
+        bitdim = f"{fld:s}_bit"
+        values = (da.fillna(0) if da.dtype.kind == "f" else da).astype("i8")
+        isset = (values & xarray.DataArray(masks, dims=(bitdim,))) != 0
+        counts[fld] = isset.sum(dim=time_dim).astype("u4").assign_coords(
+            {bitdim: masks})
+        counts[fld].attrs["flag_meanings"] = da.attrs["flag_meanings"]
+    times = ds[time_dim].values
+    counts["n_scanlines"] = xarray.DataArray(numpy.uint32(times.size))
+    counts["start_time"] = xarray.DataArray(
+        times.min() if times.size else numpy.datetime64("NaT", "ms"))
+    counts["end_time"] = xarray.DataArray(
+        times.max() if times.size else numpy.datetime64("NaT", "ms"))
+    # drop coordinates other than the bit masks, they are per granule
+    return xarray.Dataset(counts).reset_coords(drop=True)
+
+class FlagIndex:
+    """Index of L1B flag counts per granule for one satellite
+
+    Parameters
+    ----------
+
+    hirs : `typhon.datasets.tovs.HIRS`
+        HIRS dataset object for which to index flags.
+    basedir : str or pathlib.Path, optional
+        Directory in which to store the index.  Defaults to
+        ``HIRS_flag_index/{satname}`` in the ``fiddatadir`` in the
+        ``[main]`` section of the configuration.
+
+    Examples
+    --------
+
+    >>> fi = FlagIndex(typhon.datasets.tovs.which_hirs("noaa18"))
+    >>> fi.build(datetime.datetime(2005, 6, 1), datetime.datetime(2017, 1, 1))
+    >>> (perc, labels) = fi.percentages(
+    ...     fi.read(datetime.datetime(2005, 6, 1),
+    ...             datetime.datetime(2017, 1, 1)), "7D")
+    """
+
+    def __init__(self, hirs, basedir=None):
+        self.hirs = hirs
+        if basedir is None:
+            basedir = pathlib.Path(config.conf["main"]["fiddatadir"],
+                "HIRS_flag_index", hirs.satname)
+        self.basedir = pathlib.Path(basedir)
+
+    def get_orbit_filters(self):
+        """Orbit filters applied to L1B data before counting flags
+
+        The same as used by `~FCDR_HIRS.analysis.plot_flags.plot` when
+        reading L1B data directly.
+        """
+        return [typhon.datasets.filters.HIRSBestLineFilter(self.hirs),
+                typhon.datasets.filters.TimeMaskFilter(self.hirs),
+                typhon.datasets.filters.HIRSTimeSequenceDuplicateFilter()]
+
+    def get_month_file(self, year, month):
+        """Path to the index file for a month
+        """
+        return self.basedir / (f"flag_index_{self.hirs.satname:s}_"
+                               f"{year:04d}{month:02d}.nc")
+
+    def read_month(self, year, month):
+        """Read index for one month
+
+        Returns
+        -------
+
+        xarray.Dataset or None
+            Index for the month, or None if it does not exist.
+        """
+        p = self.get_month_file(year, month)
+        if not p.exists():
+            return None
+        with xarray.open_dataset(str(p)) as ds:
+            return ds.load()
+
+    def read(self, start, end):
+        """Read index for granules starting in a period
+
+        Parameters
+        ----------
+
+        start : datetime.datetime
+            Start of period.
+        end : datetime.datetime
+            End of period.
+
+        Returns
+        -------
+
+        xarray.Dataset
+            Index records for all indexed granules starting between
+            ``start`` and ``end``, sorted by start time.
+        """
+        months = []
+        (y, m) = (start.year, start.month)
+        while (y, m) <= (end.year, end.month):
+            ds = self.read_month(y, m)
+            if ds is not None:
+                months.append(ds)
+            (y, m) = (y + m//12, m%12 + 1)
+        if not months:
+            raise typhon.datasets.dataset.DataFileError(
+                f"No flag index for {self.hirs.satname:s} between "
+                f"{start:%Y-%m-%d} and {end:%Y-%m-%d} in {self.basedir!s}. "
+                "Build it first.")
+        ds = xarray.concat(months, dim="granule")
+        st = ds["start_time"].values
+        ds = ds.isel(granule=(st >= numpy.datetime64(start))
+                            & (st < numpy.datetime64(end)))
+        return ds.sortby("start_time")
+
+    def store_month(self, year, month, ds):
+        """Store index for one month
+
+        The index is written to a temporary file first, which is then
+        moved into place, such that concurrent readers never see a
+        partially written index.
+        """
+        p = self.get_month_file(year, month)
+        p.parent.mkdir(parents=True, exist_ok=True)
+        (fd, tmp) = tempfile.mkstemp(dir=p.parent,
+            prefix=f".{p.stem:s}.", suffix=".nc")
+        os.close(fd)
+        try:
+            ds.to_netcdf(tmp,
+                encoding={k: {"zlib": True, "complevel": 4}
+                          for k in flag_fields if k in ds})
+            os.replace(tmp, p)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def index_granule(self, gran, orbit_filters, after=None):
+        """Count flags for a single granule
+
+        Parameters
+        ----------
+
+        gran : pathlib.Path
+            L1B granule.
+        orbit_filters : Sequence[`typhon.datasets.filters.OrbitFilter`]
+            Filters to apply after reading.
+        after : numpy.datetime64, optional
+            Only count scanlines later than this, such as the end of
+            the preceding granule.
+
+        Returns
+        -------
+
+        xarray.Dataset
+            Index record with dimension ``granule`` of length 1.
+        """
+        (lines, extra) = self.hirs.read(gran,
+            fields=list(self.hirs.flag_fields) + ["time"],
+            apply_calibration=True) # False fails
+        for of in orbit_filters:
+            lines = of.filter(lines, **extra)
+        rec = count_flags(self.hirs.as_xarray_dataset(lines), after=after)
+        rec["source_mtime_ns"] = xarray.DataArray(
+            numpy.int64(gran.stat().st_mtime_ns))
+        return rec.expand_dims("granule").assign_coords(
+            granule=[gran.name])
+
+    def get_end_time(self, year, month, name):
+        """Get end time of indexed granule
+
+        Parameters
+        ----------
+
+        year : int
+            Year in which the granule starts.
+        month : int
+            Month in which the granule starts.
+        name : str
+            File name of the granule.
+
+        Returns
+        -------
+
+        numpy.datetime64 or None
+            End of the last scanline counted for the granule, or None if
+            the granule is not indexed or has no scanlines.
+        """
+        ds = self.read_month(year, month)
+        if ds is None or name not in ds["granule"].values:
+            return None
+        end_time = ds["end_time"].sel(granule=name).values
+        return None if numpy.isnat(end_time) else end_time
+
+    def build(self, start, end, overwrite=False):
+        """Index granules in period
+
+        Granules that are already indexed and that have not been
+        modified since are skipped, unless ``overwrite`` is True.
+        Scanlines already counted for the granule preceding ``start`` are
+        not counted again.  When a new or changed granule is indexed,
+        an already indexed granule following it is
+        indexed again if they overlap, such that the overlap is counted
+        only once.  The index is stored to disk one month at a time.
+
+        Parameters
+        ----------
+
+        start : datetime.datetime
+            Start of period.
+        end : datetime.datetime
+            End of period.
+        overwrite : bool, optional
+            Index all granules, even if already indexed.  Defaults to
+            False.
+        """
+        logger.info(f"Building flag index for {self.hirs.satname:s}, "
+                    f"{start:%Y-%m-%d} – {end:%Y-%m-%d}")
+        orbit_filters = self.get_orbit_filters()
+        last_end = None
+        changed = False
+        found = list(self.hirs.find_granules_sorted(start, end,
+            include_last_before=True, return_time=True))
+        if found and found[0][0] < start:
+            # only to know where the preceding granule ends
+            (t, gran) = found.pop(0)
+            last_end = self.get_end_time(t.year, t.month, gran.name)
+            if last_end is None:
+                logger.warning(f"Preceding granule {gran!s} is not "
+                    "indexed, overlap with it is counted twice")
+        for ((y, m), grans) in itertools.groupby(found,
+                key=lambda x: (x[0].year, x[0].month)):
+            old = self.read_month(y, m)
+            known = ({} if old is None or overwrite else
+                {g: (mt, st, et) for (g, mt, st, et) in zip(
+                    old["granule"].values,
+                    old["source_mtime_ns"].values,
+                    old["start_time"].values,
+                    old["end_time"].values)})
+            new = []
+            for (_, gran) in grans:
+                (mtime, start_time, end_time) = known.get(gran.name,
+                    (None, None, None))
+                if mtime == gran.stat().st_mtime_ns and not (
+                        changed and last_end is not None
+                        and not numpy.isnat(start_time)
+                        and start_time <= last_end):
+                    if not numpy.isnat(end_time):
+                        last_end = end_time
+                    changed = False
+                    continue
+                try:
+                    rec = self.index_granule(gran, orbit_filters,
+                                             after=last_end)
+                except (typhon.datasets.dataset.DataFileError,
+                        typhon.datasets.filters.FilterError) as e:
+                    logger.error(f"Cannot index {gran!s}: {e.args[0]!s}")
+                    continue
+                new.append(rec)
+                # the following granule, if already indexed, was counted
+                # after the end of whatever preceded it before, and must
+                # be counted again if it overlaps with this
+                changed = True
+                if rec["n_scanlines"].item() > 0:
+                    last_end = rec["end_time"].values[0]
+            if not new:
+                continue
+            logger.debug(f"Indexed {len(new):d} new or changed granules "
+                         f"for {y:04d}-{m:02d}")
+            if old is not None and not overwrite:
+                names = {str(r["granule"].item()) for r in new}
+                old = old.isel(granule=[str(g) not in names
+                                        for g in old["granule"].values])
+                new.insert(0, old)
+            self.store_month(y, m,
+                xarray.concat(new, dim="granule").sortby("start_time"))
+
+    @staticmethod
+    def percentages(index, period="1D"):
+        """Percentage of flags set per period
+
+        Parameters
+        ----------
+
+        index : xarray.Dataset
+            Index records, such as returned by `read`.
+        period : str, optional
+            Period over which to aggregate, as understood by
+            `xarray.Dataset.resample`.  Granules are attributed to the
+            period in which they start, so periods should be longer than
+            a granule.  Defaults to ``"1D"``.
+
+        Returns
+        -------
+
+        perc : xarray.DataArray
+            Percentage of elements with each flag set, with dimensions
+            ``("time", "flag")``.  Elements are scanlines times all
+            other dimensions of the flag field.
+        labels : List[str]
+            Meaning of each flag.
+        """
+        times = index["start_time"].values
+        perc_all = []
+        labels = []
+        for fld in flag_fields:
+            if fld not in index:
+                continue
+            da = index[fld]
+            bitdim = f"{fld:s}_bit"
+            other = [d for d in da.dims if d not in {"granule", bitdim}]
+            n_set = da.astype("f8").sum(dim=other)
+            n_all = index["n_scanlines"].astype("f8") * numpy.prod(
+                [da.sizes[d] for d in other])
+            n_set = n_set.assign_coords(granule=times).rename(granule="time")
+            n_all = n_all.assign_coords(granule=times).rename(granule="time")
+            perc = (100 * n_set.resample(time=period).sum()
+                        / n_all.resample(time=period).sum())
+            perc_all.append(perc.drop_vars(bitdim).rename({bitdim: "flag"}))
+            labels.extend(da.attrs["flag_meanings"].split())
+        return (xarray.concat(perc_all, dim="flag").transpose("time", "flag"),
+                labels)
@@ -0,0 +1,332 @@
+"""Cache for decoded and pre-filtered L1B granules
+
+Reading a HIRS L1B granule means decompressing it, decoding the
+binary records, applying scale factors and calibration, and then
+applying per-granule filters, such as those removing lines with
+invalid time or duplicate scanlines.  When generating the FCDR, the
+same granules are read again each time the context window moves, when
+processing is restarted, and by any parallel workers processing
+overlapping periods.  This module implements a local disk cache that
+stores each granule after decoding and filtering as one ``.npy`` file
+per field.  On read, only the files for the requested fields are
+memory-mapped and loaded, such that reading a few fields does not touch
+the others.
+
+Entries are keyed on the path, size, and modification time of the
+granule file, the arguments to the reading routine, and the filters that
+have been applied, such that looking up a granule does not need to read
+it.  A granule file that is replaced gets a new entry.  Entries are
+written to a temporary directory first and then renamed into place, such
+that parallel workers can safely share a cache.
+
+The size of the cache can be limited, see `GranuleCache.max_bytes`.
+When a new entry takes the cache beyond this limit, the least recently
+used entries are removed.  An entry is used when it is stored or read.
+
+To use it, set the `~FCDR_HIRS.fcdr.HIRSFCDR.granule_cache` attribute on
+a HIRS FCDR object to a `GranuleCache` object.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import shutil
+import tempfile
+
+import numpy
+import numpy.lib.recfunctions
+
+import typhon
+import typhon.datasets.filters
+from typhon import config
+
+logger = logging.getLogger(__name__)
+
+#: int : Version of the on-disk format, part of the cache key
+cache_format_version = 3
+
+class GranuleCache:
+    """Disk cache for decoded and pre-filtered L1B granules
+
+    Parameters
+    ----------
+
+    hirs : `typhon.datasets.tovs.HIRS`
+        HIRS dataset object that granules are read for.  Used to
+        construct the default filters.
+    cachedir : str or pathlib.Path, optional
+        Directory in which to store the cache.  Defaults to the
+        ``l1b_granules`` subdirectory of the ``cachedir`` in the
+        ``[main]`` section of the configuration.
+    filters : Sequence[typhon.datasets.filters.OrbitFilter], optional
+        Filters to apply to each granule before storing it.  These must
+        act on a single granule only and must be idempotent, because
+        `~typhon.datasets.dataset.Dataset.read_period` will apply its
+        orbit filters to the cached granule again.  Defaults to
+        `~typhon.datasets.filters.TimeMaskFilter` and
+        `~typhon.datasets.filters.HIRSTimeSequenceDuplicateFilter`.
+    max_bytes : int, optional
+        Disk budget for the cache, see attribute `max_bytes`.  Defaults
+        to ``granule_cache_max_gib`` GiB in the ``[main]`` section of
+        the configuration, or no limit if that is not set.
+
+    Attributes
+    ----------
+
+    max_bytes : int or None
+        Maximum total size of the cache in bytes.  When storing an entry
+        makes the cache larger, least recently used entries are evicted
+        until it fits.  None means no limit.
+    """
+
+    def __init__(self, hirs, cachedir=None, filters=None, max_bytes=None):
+        if cachedir is None:
+            cachedir = pathlib.Path(config.conf["main"]["cachedir"],
+                "l1b_granules")
+        self.cachedir = pathlib.Path(cachedir)
+        if filters is None:
+            filters = [typhon.datasets.filters.TimeMaskFilter(hirs),
+                typhon.datasets.filters.HIRSTimeSequenceDuplicateFilter()]
+        self.filters = filters
+        if max_bytes is None:
+            gib = config.conf["main"].getfloat("granule_cache_max_gib",
+                fallback=None)
+            max_bytes = None if gib is None else int(gib * 2**30)
+        self.max_bytes = max_bytes
+        # total size as far as known to this process, None if not known
+        self._nbytes = None
+
+    def key(self, path, **reader_args):
+        """Get cache key for granule
+
+        Parameters
+        ----------
+
+        path : str or pathlib.Path
+            Granule file.
+        **reader_args
+            Arguments passed to the reading routine.
+
+        Returns
+        -------
+
+        str
+            Key identifying the decoded and filtered granule.
+        """
+        path = pathlib.Path(path).resolve()
+        st = path.stat()
+        desc = json.dumps({
+            "format": cache_format_version,
+            "typhon": typhon.__version__,
+            "file": [str(path), st.st_size, st.st_mtime_ns],
+            "reader_args": sorted((k, repr(v)) for (k, v) in reader_args.items()),
+            "filters": [f.__class__.__name__ for f in self.filters]})
+        return hashlib.sha256(desc.encode("ascii")).hexdigest()
+
+    def _entry(self, key):
+        return self.cachedir / key[:2] / key
+
+    def get(self, key, fields="all"):
+        """Get granule from cache
+
+        Parameters
+        ----------
+
+        key : str
+            Key as returned by `key`.
+        fields : List[str] or str, optional
+            Fields to load.  Only those are read from disk.  Fields not
+            present in the granule are skipped.
+
+        Returns
+        -------
+
+        (numpy.ma.MaskedArray, Mapping) or None
+            Scanlines and extra information such as returned by the
+            reading routine, or None if the granule is not in the cache.
+        """
+        entry = self._entry(key)
+        try:
+            # mark as recently used
+            os.utime(entry)
+            with (entry / "fields.json").open("r") as fp:
+                layout = json.load(fp)
+            names = layout["fields"]
+            if fields != "all":
+                names = [f for f in names if f in fields]
+            data = {f: numpy.load(entry / f"{f:s}.npy", mmap_mode="r")
+                    for f in names}
+            mask = {f: numpy.load(entry / f"{f:s}.mask.npy", mmap_mode="r")
+                    for f in names if (entry / f"{f:s}.mask.npy").exists()}
+            header = numpy.load(entry / "header.npy")
+        except FileNotFoundError:
+            # not cached, or evicted while reading
+            return None
+        n = layout["n_lines"]
+        dtype = numpy.dtype(
+            [(f, v.dtype, v.shape[1:]) for (f, v) in data.items()])
+        values = numpy.empty(n, dtype=dtype)
+        masks = numpy.zeros(n, dtype=numpy.ma.make_mask_descr(dtype))
+        for (f, v) in data.items():
+            values[f] = v
+            if f in mask:
+                masks[f] = mask[f]
+        scanlines = numpy.ma.MaskedArray(values, mask=masks, copy=False)
+        return (scanlines, {"header": header})
+
+    def put(self, key, scanlines, extra):
+        """Store granule in cache
+
+        The scanlines are stored in one ``.npy`` file per field, with the
+        mask of a field in a separate file if any of its values is
+        masked.  The entry is written to a temporary directory that is
+        then renamed into place.  If another process has stored the same
+        entry in the meantime, the new one is discarded.
+
+        Parameters
+        ----------
+
+        key : str
+            Key as returned by `key`.
+        scanlines : numpy.ma.MaskedArray
+            Scanlines with all fields, after filtering.
+        extra : Mapping
+            Extra information returned by the reading routine.  Must
+            contain the header.
+        """
+        entry = self._entry(key)
+        entry.parent.mkdir(parents=True, exist_ok=True)
+        tmpdir = pathlib.Path(tempfile.mkdtemp(dir=entry.parent,
+            prefix=f".{key:s}."))
+        try:
+            mask = numpy.ma.getmaskarray(scanlines)
+            for f in scanlines.dtype.names:
+                numpy.save(tmpdir / f"{f:s}.npy",
+                    numpy.ma.getdata(scanlines[f]))
+                if mask[f].any():
+                    numpy.save(tmpdir / f"{f:s}.mask.npy", mask[f])
+            with (tmpdir / "fields.json").open("w") as fp:
+                json.dump({"fields": list(scanlines.dtype.names),
+                           "n_lines": scanlines.shape[0]}, fp)
+            numpy.save(tmpdir / "header.npy", extra["header"])
+            os.rename(tmpdir, entry)
+        except OSError:
+            if not entry.exists():
+                raise
+            logger.debug(f"Granule {key:s} was stored concurrently")
+            return
+        finally:
+            if tmpdir.exists():
+                shutil.rmtree(tmpdir)
+        if self.max_bytes is not None:
+            if self._nbytes is None:
+                self._nbytes = sum(size for (_, _, size) in self.entries())
+            else:
+                self._nbytes += self._entry_size(entry)
+            if self._nbytes > self.max_bytes:
+                self.evict()
+
+    @staticmethod
+    def _entry_size(entry):
+        return sum(f.stat().st_size for f in entry.iterdir())
+
+    def entries(self):
+        """List entries in cache, least recently used first
+
+        Returns
+        -------
+
+        List[Tuple[pathlib.Path, float, int]]
+            For each entry, its directory, the time it was last used in
+            seconds since the epoch, and its size in bytes.
+        """
+        entries = []
+        if not self.cachedir.exists():
+            return entries
+        for sub in self.cachedir.iterdir():
+            if not sub.is_dir() or sub.name.startswith("."):
+                continue
+            for entry in sub.iterdir():
+                if entry.name.startswith("."):
+                    # being written or evicted
+                    continue
+                try:
+                    entries.append((entry, entry.stat().st_mtime,
+                                    self._entry_size(entry)))
+                except FileNotFoundError:
+                    # evicted concurrently
+                    continue
+        return sorted(entries, key=lambda e: e[1])
+
+    def evict(self, max_bytes=None):
+        """Remove least recently used entries until the cache fits
+
+        Entries are renamed before they are removed, such that other
+        processes never see a partially removed entry.  Processes that
+        have an evicted entry memory-mapped can continue to use it.
+
+        Parameters
+        ----------
+
+        max_bytes : int, optional
+            Size to reduce the cache to.  Defaults to `max_bytes`.
+        """
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        entries = self.entries()
+        total = sum(size for (_, _, size) in entries)
+        n = 0
+        for (entry, _, size) in entries:
+            if total <= max_bytes:
+                break
+            tmp = entry.with_name(f".{entry.name:s}.evicted.{os.getpid():d}")
+            try:
+                os.rename(entry, tmp)
+            except FileNotFoundError:
+                pass
+            else:
+                shutil.rmtree(tmp, ignore_errors=True)
+                n += 1
+            total -= size
+        self._nbytes = total
+        logger.debug(f"Evicted {n:d} granules from cache, "
+                     f"{total/2**30:.2f} GiB left")
+
+    def read(self, reader, path, fields="all", **reader_args):
+        """Read granule through cache
+
+        Parameters
+        ----------
+
+        reader : callable
+            Reading routine, to be called as ``reader(path, fields="all",
+            **reader_args)`` when the granule is not in the cache.  Must
+            return a tuple of scanlines and a mapping with the header.
+        path : str or pathlib.Path
+            Granule file.
+        fields : List[str] or str, optional
+            Fields to return.  Fields not present in the granule are
+            skipped.
+        **reader_args
+            Further arguments to the reading routine.
+
+        Returns
+        -------
+
+        (numpy.ma.MaskedArray, Mapping)
+            Scanlines and extra information, after filtering.
+        """
+        key = self.key(path, **reader_args)
+        cached = self.get(key, fields)
+        if cached is not None:
+            logger.debug(f"Read {path!s} from granule cache")
+            return cached
+        (scanlines, extra) = reader(path, fields="all", **reader_args)
+        for of in self.filters:
+            scanlines = of.filter(scanlines, **extra)
+        self.put(key, scanlines, extra)
+        if fields != "all":
+            scanlines = numpy.lib.recfunctions.repack_fields(
+                scanlines[[f for f in scanlines.dtype.names if f in fields]])
+        return (scanlines, extra)
@@ -0,0 +1,215 @@
+"""Persistent index of L1B granule times
+
+Locating the granule containing a particular time, as done by
+`~typhon.datasets.dataset.MultiFileDataset.find_most_recent_granule_before`,
+means listing the archive directories around that time and parsing the
+names of all granules therein.  When generating the FCDR this happens for
+every piece, which on network-mounted archives can take several seconds
+each time.  This module implements an index of the start and end times of
+all granules for a satellite, which is built once, stored on disk, and
+extended incrementally when a time beyond its coverage is requested.
+The first build may be limited to a period, see the ``since`` and
+``until`` arguments to `GranuleIndex`.  Lookups are then a binary
+search.
+
+To use it, set the `~FCDR_HIRS.fcdr.HIRSFCDR.granule_index` attribute on
+a HIRS FCDR object to a `GranuleIndex` object.
+"""
+
+import bisect
+import datetime
+import logging
+import os
+import pathlib
+import tempfile
+
+import numpy
+
+import typhon.datasets.dataset
+from typhon import config
+
+logger = logging.getLogger(__name__)
+
+class GranuleIndex:
+    """Index of start and end times of L1B granules for one satellite
+
+    Parameters
+    ----------
+
+    hirs : `typhon.datasets.tovs.HIRS`
+        HIRS dataset object for which to index granules.  Granules are
+        found with its
+        `~typhon.datasets.dataset.MultiFileDataset.find_granules_sorted`
+        method.
+    path : str or pathlib.Path, optional
+        File in which to store the index.  Defaults to
+        ``granule_index/{satname}.npz`` in the ``cachedir`` in the
+        ``[main]`` section of the configuration.
+    refresh_overlap : datetime.timedelta, optional
+        When refreshing, rescan from this long before the last indexed
+        granule, such that granules that were still being added to the
+        archive when the index was last built are picked up.  Also the
+        margin by which the index is extended when a time outside the
+        scanned period is requested.  Defaults to two days.
+    since : datetime.datetime, optional
+        When the index is built, scan the archive from this time rather
+        than from the start of the dataset.  Lookups before the scanned
+        period extend the index backwards.
+    until : datetime.datetime, optional
+        When the index is built or refreshed, scan the archive until
+        this time rather than until the end of the dataset.  Lookups
+        after the scanned period extend the index forwards.
+
+    Attributes
+    ----------
+
+    covered : (datetime.datetime, datetime.datetime) or None
+        Period for which the archive has been scanned, or None if the
+        index is empty.
+    """
+
+    def __init__(self, hirs, path=None,
+                 refresh_overlap=datetime.timedelta(days=2),
+                 since=None, until=None):
+        self.hirs = hirs
+        if path is None:
+            path = pathlib.Path(config.conf["main"]["cachedir"],
+                "granule_index", f"{hirs.satname:s}.npz")
+        self.path = pathlib.Path(path)
+        self.refresh_overlap = refresh_overlap
+        self.since = since or hirs.start_date
+        self.until = until or hirs.end_date
+        self.start = []
+        self.end = []
+        self.granules = []
+        self.covered = None
+        if self.path.exists():
+            self.load()
+
+    def __len__(self):
+        return len(self.granules)
+
+    def load(self):
+        """Load index from disk
+        """
+        with numpy.load(self.path) as D:
+            self.start = D["start"].astype("M8[ms]").astype(
+                datetime.datetime).tolist()
+            self.end = D["end"].astype("M8[ms]").astype(
+                datetime.datetime).tolist()
+            self.granules = [pathlib.Path(p) for p in D["granules"]]
+            # indices written before the scanned period was recorded
+            # were always built from the start of the dataset
+            self.covered = (tuple(D["covered"].astype("M8[ms]").astype(
+                datetime.datetime).tolist()) if "covered" in D else
+                (self.hirs.start_date, self.end[-1]) if self.end else None)
+        logger.debug(f"Loaded index of {len(self):d} granules from "
+                     f"{self.path!s}")
+
+    def store(self):
+        """Store index to disk
+
+        The index is written to a temporary file first, which is then
+        moved into place, such that concurrent readers never see a
+        partially written index.
+        """
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        (fd, tmp) = tempfile.mkstemp(dir=self.path.parent,
+            prefix=f".{self.path.stem:s}.", suffix=".npz")
+        try:
+            with os.fdopen(fd, "wb") as fp:
+                numpy.savez(fp,
+                    start=numpy.array(self.start, dtype="M8[ms]"),
+                    end=numpy.array(self.end, dtype="M8[ms]"),
+                    granules=numpy.array([str(g) for g in self.granules]),
+                    covered=numpy.array(self.covered, dtype="M8[ms]"))
+            os.replace(tmp, self.path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def refresh(self, since=None, until=None):
+        """Add granules not yet in the index
+
+        Scan the archive for granules in a period and add any granules
+        not yet indexed.  The result is stored to disk.
+
+        Parameters
+        ----------
+
+        since : datetime.datetime, optional
+            Scan from this time.  Defaults to `refresh_overlap` before
+            the last indexed granule, or to `since` if the index is
+            empty.
+        until : datetime.datetime, optional
+            Scan until this time.  Defaults to `until`.
+        """
+        since = since or (self.start[-1] - self.refresh_overlap
+                          if self.start else self.since)
+        until = until or self.until
+        logger.info(f"Updating granule index for {self.hirs.satname:s}, "
+                    f"{since:%Y-%m-%d} – {until:%Y-%m-%d}")
+        known = set(self.granules)
+        new = [(st, gran) for (st, gran) in self.hirs.find_granules_sorted(
+                    since, until, return_time=True)
+               if gran not in known]
+        self.covered = ((since, until) if self.covered is None else
+            (min(self.covered[0], since), max(self.covered[1], until)))
+        if new:
+            entries = sorted(
+                list(zip(self.start, self.end, self.granules)) +
+                [(st, self.hirs.get_times_for_granule(gran)[1], gran)
+                    for (st, gran) in new])
+            (self.start, self.end, self.granules) = (
+                list(x) for x in zip(*entries))
+        self.store()
+
+    def _cover(self, instant):
+        """Extend the index such that it covers instant
+        """
+        if self.covered is None:
+            self.refresh(min(self.since, instant - self.refresh_overlap),
+                         max(self.until, instant))
+        elif (instant - self.refresh_overlap < self.covered[0]
+                and self.covered[0] > self.hirs.start_date):
+            # scan up to the start of the scanned period, the granule
+            # running into it may start before
+            self.refresh(instant - self.refresh_overlap,
+                         self.covered[0] + self.refresh_overlap)
+        elif not self.end or instant > self.end[-1]:
+            self.refresh(until=max(self.covered[1], self.until,
+                                   instant + self.refresh_overlap))
+
+    def find_most_recent_granule_before(self, instant, return_time=False):
+        """Find granule starting most recently before instant
+
+        Equivalent to
+        `~typhon.datasets.dataset.MultiFileDataset.find_most_recent_granule_before`,
+        but using the index.  If `instant` is before the period scanned
+        or after the end of the last indexed granule, the index is
+        extended first.
+
+        Parameters
+        ----------
+
+        instant : datetime.datetime
+            Time for which to find the granule.
+        return_time : bool, optional
+            If true, return a tuple with the granule start time and the
+            path, rather than only the path.
+
+        Returns
+        -------
+
+        pathlib.Path or (datetime.datetime, pathlib.Path)
+            Granule starting most recently before `instant`.
+        """
+        self._cover(instant)
+        i = bisect.bisect_right(self.start, instant) - 1
+        if i < 0 or (i == len(self)-1 and instant > self.end[i]):
+            raise typhon.datasets.dataset.GranuleLocatorError(
+                "Can not find any granule "
+                "before {:%Y-%m-%d %H:%M:%S}".format(instant))
+        if return_time:
+            return (self.start[i], self.granules[i])
+        return self.granules[i]
@@ -44,9 +44,9 @@ import xarray
 import typhon.datasets.tovs
 import typhon.datasets.filters
 
-import sklearn.linear_model
 
 from . import fcdr
+from . import pixel_extract
 
 from typhon.physics.units.common import ureg, radiance_units as rad_u
 from typhon.physics.units.tools import UnitsAwareDataArray as UADA
@@ -563,7 +563,8 @@ class HIRSMatchupCombiner:
             hirs_format_version=None,
             extra_data_versions=None,
             extra_format_versions=None,
-            extra_fields=None):
+            extra_fields=None,
+            read_pixels_only=True):
         """Create HIRSMatchupCombiner object
 
         Parameters
@@ -577,6 +578,11 @@ class HIRSMatchupCombiner:
             Name of primary
         sec_name : str
             Name of secondary
+        read_pixels_only : bool, optional
+            Read only the collocated pixels from the debug FCDR, using a
+            `~FCDR_HIRS.pixel_extract.DebugFCDRExtractor`, rather than
+            reading entire files through
+            `~typhon.datasets.tovs.HIRSHIRS.combine`.  Defaults to True.
         """
         if extra_data_versions is not None:
             raise NotImplementedError("no extra data versions implemented")
@@ -630,17 +636,28 @@ class HIRSMatchupCombiner:
         # dictionaries, in particular for the fields 'locator_args' and
         # perhaps 'fields'.  Most arguments will be the same, therefore
         # functools.partial first
-        comb = functools.partial(hh.combine, 
-            ds, timetol=numpy.timedelta64(4, 's'),
-            col_dim_name="scanpos")
-        prim_comb = functools.partial(comb,
-            self.prim_hirs, trans={"time_{:s}".format(prim_name): "time"},
-            col_field="hirs-{:s}_x".format(prim_name),
-            time_name="time_"+prim_name)
-        sec_comb = functools.partial(comb,
-            self.sec_hirs, trans={"time_{:s}".format(sec_name): "time"},
-            col_field="hirs-{:s}_x".format(sec_name),
-            time_name="time_"+sec_name)
+        if read_pixels_only:
+            comb = functools.partial(self.extract_pixels,
+                ds, timetol=numpy.timedelta64(4, 's'),
+                colloc_dim=hh.colloc_dim)
+            prim_comb = functools.partial(comb, self.prim_hirs,
+                col_field="hirs-{:s}_x".format(prim_name),
+                time_name="time_"+prim_name)
+            sec_comb = functools.partial(comb, self.sec_hirs,
+                col_field="hirs-{:s}_x".format(sec_name),
+                time_name="time_"+sec_name)
+        else:
+            comb = functools.partial(hh.combine, 
+                ds, timetol=numpy.timedelta64(4, 's'),
+                col_dim_name="scanpos")
+            prim_comb = functools.partial(comb,
+                self.prim_hirs, trans={"time_{:s}".format(prim_name): "time"},
+                col_field="hirs-{:s}_x".format(prim_name),
+                time_name="time_"+prim_name)
+            sec_comb = functools.partial(comb,
+                self.sec_hirs, trans={"time_{:s}".format(sec_name): "time"},
+                col_field="hirs-{:s}_x".format(sec_name),
+                time_name="time_"+sec_name)
         fcdr_info = {
             "data_version": hirs_data_version or self.hirs_data_version,
             "format_version": hirs_format_version or self.hirs_format_version,
@@ -651,12 +668,21 @@ class HIRSMatchupCombiner:
             # There is no Mcp, for the primary (reference) is IASI
             Mcp = None
             try:
-                Mcs = hi.combine(ds,
-                    self.sec_hirs,
-                    trans={"mon_time": "time"},
-                    timetol=numpy.timedelta64(4, 's'),
-                    other_args=other_args_part).drop(
-                        ("lat_earth", "lon_earth"))
+                if read_pixels_only:
+                    Mcs = self.extract_pixels(ds,
+                        self.sec_hirs,
+                        col_field="mon_column",
+                        time_name="mon_time",
+                        colloc_dim=hi.colloc_dim,
+                        timetol=numpy.timedelta64(4, 's'),
+                        other_args=other_args_part)
+                else:
+                    Mcs = hi.combine(ds,
+                        self.sec_hirs,
+                        trans={"mon_time": "time"},
+                        timetol=numpy.timedelta64(4, 's'),
+                        other_args=other_args_part)
+                Mcs = Mcs.drop(("lat_earth", "lon_earth"))
             except ValueError as e:
                 if "Primary covers" in e.args[0]:
                     raise NoDataError("Secondary fails to cover primary, "
@@ -711,6 +737,46 @@ class HIRSMatchupCombiner:
         self.sec_name = sec_name
         self.extras = {} # not implemented
 
+    def extract_pixels(self, M, hirs, other_args, col_field, time_name,
+                       colloc_dim, timetol):
+        """Add debug FCDR data for collocated pixels only
+
+        Counterpart to `~typhon.datasets.tovs.HIRSHIRS.combine` taking
+        the same ``other_args``, but reading only the collocated pixels
+        with a `~FCDR_HIRS.pixel_extract.DebugFCDRExtractor`.
+
+        Parameters
+        ----------
+
+        M : xarray.Dataset
+            Matchups.
+        hirs : `~FCDR_HIRS.fcdr.HIRSFCDR`
+            FCDR object for the satellite to read.
+        other_args : dict
+            As for `~typhon.datasets.dataset.Dataset.combine`.  Only
+            ``locator_args``, ``fields``, and ``orbit_filters`` are used.
+        col_field : str
+            Field in ``M`` with the scan position.
+        time_name : str
+            Field in ``M`` with the time.
+        colloc_dim : str
+            Dimension along the matchups.
+        timetol : numpy.timedelta64
+            Maximum time difference between matchup and scanline.
+
+        Returns
+        -------
+
+        xarray.Dataset
+            FCDR data for each matchup.
+        """
+        with pixel_extract.DebugFCDRExtractor(hirs,
+                other_args["locator_args"]) as ext:
+            return ext.combine(M, other_args["fields"],
+                time_name=time_name, col_field=col_field,
+                colloc_dim=colloc_dim, timetol=timetol,
+                orbit_filters=other_args.get("orbit_filters", ()))
+
 
 class KModel(metaclass=abc.ABCMeta):
     """Model to estimate K and Ks (Kr is seperate)
@@ -1455,6 +1521,7 @@ class KModelSRFIASIDB(KModel):
                     y_target -= self.Ldb_hirs_simul[from_sat].sel(chan=chan)
                 # for training with sklearn, dimensions should be n_p × n_c
                 if self.regression == "LR":
+                    import sklearn.linear_model
                     clf = sklearn.linear_model.LinearRegression(fit_intercept=True)
                     clf.fit(y_ref.T, y_target)
                 elif self.regression == "ODR":
@@ -6,16 +6,17 @@ routines that are used by the FCDR code.
 
 import logging
 import numbers
+import functools
 import numpy
+import scipy.interpolate
 import xarray
-import sklearn.linear_model
 from typhon.physics.units.common import ureg
 
 logger = logging.getLogger(__name__)
 
 def calc_y_for_srf_shift(Δλ, y_master, srf0, L_spectral_db, f_spectra, y_ref,
                            unit=ureg.um,
-                           regression_type=sklearn.linear_model.LinearRegression,
+                           regression_type=None,
                            regression_args={"fit_intercept": True},
                            predict_quantity="bt",
                            u_y_ref=None,
@@ -130,6 +131,12 @@ def calc_y_for_srf_shift(Δλ, y_master, srf0, L_spectral_db, f_spectra, y_ref,
     if y_ref.ndim == 1:
         y_ref = y_ref[:, numpy.newaxis]
 
+    # imported here, as importing sklearn takes a noticeable part of
+    # the startup time of scripts that do not need it
+    import sklearn.base
+    import sklearn.linear_model
+    if regression_type is None:
+        regression_type = sklearn.linear_model.LinearRegression
     #clf = sklearn.linear_model.LinearRegression(fit_intercept=True)
     if issubclass(regression_type, sklearn.base.RegressorMixin):
         clf = regression_type(**regression_args)
@@ -177,7 +184,7 @@ def calc_y_for_srf_shift(Δλ, y_master, srf0, L_spectral_db, f_spectra, y_ref,
 def calc_cost_for_srf_shift(Δλ, y_master, y_target, srf0,
                             L_spectral_db, f_spectra, y_ref,
                             unit=ureg.um,
-                            regression_type=sklearn.linear_model.LinearRegression,
+                            regression_type=None,
                             regression_args={"fit_intercept": True},
                             cost_mode="total",
                             predict_quantity="bt",
@@ -539,3 +546,236 @@ def gap_fill(ds, dim="time", coor="time", Δt=None):
     ds_new.attrs = ds.attrs
 
     return ds_new
+
+def tiepoint_indices(n, step, include=()):
+    """Indices of tie points along one dimension
+
+    Select every ``step``-th index between 0 and ``n-1``, always
+    including the final index such that interpolation from the tie points
+    never needs to extrapolate.
+
+    Parameters
+    ----------
+
+    n : int
+        Length of the dimension at full resolution.
+    step : int
+        Spacing between subsequent tie points.
+    include : Collection[int], optional
+        Additional indices that must be tie points, for example where the
+        field to be interpolated has a kink or discontinuity.
+
+    Returns
+    -------
+
+    ndarray
+        Sorted unique integer indices of the tie points.
+    """
+    return numpy.unique(numpy.r_[
+        numpy.arange(0, n, max(step, 1)),
+        numpy.asarray(include, dtype="i8"),
+        n-1])
+
+def _tiepoint_weights(tp, n):
+    """Bracketing indices and weights to interpolate from tie points
+
+    Helper for `tiepoint_interpolate`.  For full-resolution indices
+    ``0…n-1``, return the position of the lower bracketing tie point
+    within ``tp`` and the linear weight of the upper one.
+    """
+    x = numpy.arange(n)
+    lo = numpy.clip(numpy.searchsorted(tp, x, side="right")-1,
+                    0, max(tp.size-2, 0))
+    hi = numpy.minimum(lo+1, tp.size-1)
+    span = (tp[hi] - tp[lo]).astype("f8")
+    w = numpy.divide(x - tp[lo], span,
+        out=numpy.zeros(n, dtype="f8"), where=span!=0)
+    return (lo, hi, w)
+
+def tiepoint_interpolate(z, tp_i, tp_j, n_i, n_j, periodic=None):
+    """Bilinearly interpolate a field from tie points to full resolution
+
+    The field ``z`` is known on the grid spanned by the tie point indices
+    ``tp_i`` (first dimension) and ``tp_j`` (second dimension), such as
+    obtained from `tiepoint_indices`.  Interpolation weights are
+    calculated once per dimension, after which the full-resolution field
+    is obtained with a single gather-and-multiply.
+
+    Parameters
+    ----------
+
+    z : (len(tp_i), len(tp_j)) ndarray
+        Values at the tie points.
+    tp_i : ndarray
+        Full-resolution indices of the tie points along the first
+        dimension.  Must start at 0 and end at ``n_i-1``.
+    tp_j : ndarray
+        As ``tp_i``, for the second dimension.
+    n_i : int
+        Full-resolution length of the first dimension.
+    n_j : int
+        Full-resolution length of the second dimension.
+    periodic : Number, optional
+        If given, ``z`` is an angle with this period (such as 360 for
+        azimuth angles in degrees).  Interpolation is then performed on
+        the unit circle so that values on either side of the
+        discontinuity are handled correctly.
+
+    Returns
+    -------
+
+    (n_i, n_j) ndarray
+        Field interpolated to full resolution.
+    """
+
+    if periodic is not None:
+        φ = numpy.asarray(z, dtype="f8") * (2*numpy.pi/periodic)
+        s = tiepoint_interpolate(numpy.sin(φ), tp_i, tp_j, n_i, n_j)
+        c = tiepoint_interpolate(numpy.cos(φ), tp_i, tp_j, n_i, n_j)
+        return numpy.mod(numpy.arctan2(s, c) * (periodic/(2*numpy.pi)),
+                         periodic)
+    (lo_i, hi_i, w_i) = _tiepoint_weights(tp_i, n_i)
+    (lo_j, hi_j, w_j) = _tiepoint_weights(tp_j, n_j)
+    z = numpy.asarray(z, dtype="f8")
+    w_i = w_i[:, numpy.newaxis]
+    w_j = w_j[numpy.newaxis, :]
+    return ((1-w_i) * ((1-w_j) * z[lo_i][:, lo_j] + w_j * z[lo_i][:, hi_j])
+            + w_i * ((1-w_j) * z[hi_i][:, lo_j] + w_j * z[hi_i][:, hi_j]))
+
+class CalibrationInterpolator:
+    """Interpolate from calibration cycles to scanlines with shared weights
+
+    Calibration parameters such as offset and slope are known once per
+    calibration cycle and need to be interpolated to every scanline, for
+    every channel, for several interpolation modes.  This class
+    precomputes, for a given pair of calibration times and target times,
+    the bracketing indices and weights (or, for cubic interpolation, the
+    matrix mapping values at calibration times to the spline evaluated at
+    the target times).  Applying it to an array of values is then a
+    single gather-and-multiply or matrix product, no matter how many
+    channels or quantities are stacked along the trailing dimensions.
+
+    Results are identical to those of `scipy.interpolate.interp1d` with
+    ``bounds_error=False``, with ``fill_value="extrapolate"`` for
+    ``kind="nearest"`` and with nan outside the calibration period for
+    all other kinds.  Rather than constructing objects directly, use
+    `get_calib_interpolator`, which caches them.
+
+    Parameters
+    ----------
+
+    x : (N,) ndarray
+        Times (as numbers) at which values are known, such as
+        calibration cycles.
+    xx : (M,) ndarray
+        Times (as numbers) to interpolate to, such as all scanlines.
+    kind : str, optional
+        One of ``"nearest"``, ``"zero"``, ``"linear"``, or ``"cubic"``.
+        Defaults to ``"nearest"``.
+    """
+
+    def __init__(self, x, xx, kind="nearest"):
+        x = numpy.asarray(x, dtype="f8")
+        xx = numpy.asarray(xx, dtype="f8")
+        self.order = numpy.argsort(x, kind="stable")
+        x = x[self.order]
+        self.kind = kind
+        self.shape = (xx.size, x.size)
+        self.B = None
+        n = x.size
+        if kind == "nearest":
+            if n < 1:
+                raise ValueError("Need at least 1 calibration cycle")
+            self.lo = numpy.searchsorted((x[1:]+x[:-1])/2, xx, side="left")
+            self.valid = numpy.ones(xx.size, dtype=numpy.bool_)
+        elif kind == "zero":
+            if n < 1:
+                raise ValueError("Need at least 1 calibration cycle")
+            self.lo = numpy.clip(
+                numpy.searchsorted(x, xx, side="right")-1, 0, n-1)
+            self.valid = (xx >= x[0]) & (xx <= x[-1])
+        elif kind == "linear":
+            if n < 2:
+                raise ValueError("Need at least 2 calibration cycles")
+            self.hi = numpy.clip(numpy.searchsorted(x, xx, side="left"),
+                                 1, n-1)
+            self.lo = self.hi - 1
+            self.w = ((xx - x[self.lo]) / (x[self.hi] - x[self.lo])
+                        )[:, numpy.newaxis]
+            self.valid = (xx >= x[0]) & (xx <= x[-1])
+        elif kind == "cubic":
+            self.valid = (xx >= x[0]) & (xx <= x[-1])
+            # spline interpolation is linear in the values, so
+            # interpolating the identity matrix gives the basis shared by
+            # all channels and quantities
+            self.B = numpy.zeros(self.shape, dtype="f8")
+            self.B[self.valid, :] = scipy.interpolate.make_interp_spline(
+                x, numpy.eye(n), k=3)(xx[self.valid])
+        else:
+            raise ValueError(f"Unsupported kind of interpolation: {kind!s}")
+
+    def __call__(self, y):
+        """Interpolate values
+
+        Parameters
+        ----------
+
+        y : (N, ...) array_like
+            Values at the calibration times.  Any number of trailing
+            dimensions (such as channels or quantities) are interpolated
+            at once.
+
+        Returns
+        -------
+
+        (M, ...) ndarray
+            Values at the target times.
+        """
+        y = numpy.asarray(y, dtype="f8")
+        trailing = y.shape[1:]
+        y = y.reshape(y.shape[0], -1)[self.order, :]
+        if self.B is not None:
+            out = self.B @ y
+        elif self.kind == "linear":
+            out = y[self.lo, :] + self.w * (y[self.hi, :] - y[self.lo, :])
+        else:
+            out = y[self.lo, :]
+        out[~self.valid, :] = numpy.nan
+        return out.reshape((self.shape[0],) + trailing)
+
+@functools.lru_cache(maxsize=8)
+def _get_calib_interpolator(x, xx, kind):
+    return CalibrationInterpolator(numpy.frombuffer(x, dtype="u8"),
+                                   numpy.frombuffer(xx, dtype="u8"),
+                                   kind)
+
+def get_calib_interpolator(x, xx, kind="nearest"):
+    """Get a (cached) `CalibrationInterpolator`
+
+    The same calibration and target times recur for every channel and for
+    every variant of the calibration, so interpolators are cached on the
+    times and kind.  Only the few most recently used are kept, enough for
+    all kinds within one segment, because cubic interpolators hold a
+    dense matrix of size number of target times by number of
+    calibration times.
+
+    Parameters
+    ----------
+
+    x : ndarray
+        Calibration times, as unsigned integers such as milliseconds
+        since the epoch.
+    xx : ndarray
+        Target times, in the same units as ``x``.
+    kind : str, optional
+        Kind of interpolation, see `CalibrationInterpolator`.
+
+    Returns
+    -------
+
+    CalibrationInterpolator
+    """
+    return _get_calib_interpolator(
+        numpy.ascontiguousarray(x, dtype="u8").tobytes(),
+        numpy.ascontiguousarray(xx, dtype="u8").tobytes(),
+        kind)
@@ -67,12 +67,14 @@ contains two models:
 import datetime
 import copy
 import logging
+import os
+import pathlib
+import tempfile
 import functools
 import operator
 
 import scipy.stats
-import sklearn.cross_decomposition
-import sklearn.linear_model
+import importlib
 import numpy
 import xarray
 import abc
@@ -81,12 +83,15 @@ from typhon.physics.units.common import ureg
 from typhon.physics.units.tools import UnitsAwareDataArray as UADA
 from typhon.datasets import _tovs_defs
 
+from .exceptions import FCDRError
+
 logger = logging.getLogger(__name__)
 
-#: Mapping : mapping of supported regression types
+#: Mapping : mapping of supported regression types to the module and
+#: class implementing them, imported only when used
 regression_types = {
-    "PLSR": sklearn.cross_decomposition.PLSRegression,
-    "LR": sklearn.linear_model.LinearRegression}
+    "PLSR": ("sklearn.cross_decomposition", "PLSRegression"),
+    "LR": ("sklearn.linear_model", "LinearRegression")}
 
 class RSelf:
 
@@ -229,7 +234,9 @@ class RSelfTemperature(RSelf):
             on construction.
         """
         self.hirs = hirs
-        self.core_model = regression_types[regr[0]](**regr[1])#sklearn.cross_decomposition.PLSRegression(
+        (modname, clsname) = regression_types[regr[0]]
+        self.core_model = getattr(importlib.import_module(modname),
+            clsname)(**regr[1])#sklearn.cross_decomposition.PLSRegression(
         self.models = {}
             #n_components=2)
         if temperatures is not None:
@@ -719,7 +726,521 @@ class RSelfTemperature(RSelf):
             f"Self-emission model for {self.hirs!s}.\n"
             f"Model type: {self.core_model.__class__!s}.\n"
             f"Temperatures used: {self.temperatures!s}.\n"
-            ) 
+            )
+
+
+class RSelfTemperatureIncremental(RSelfTemperature):
+    """Temperature-based self emission model, fitted incrementally
+
+    This model is identical to `RSelfTemperature` with ordinary linear
+    regression, but rather than refitting an sklearn model for every
+    channel and every step, it keeps the sufficient statistics for the
+    regression (:math:`X^TX` and :math:`X^Ty`, with an intercept column)
+    for all channels.  When `fit` is called with a new context, such as
+    the window of a `typhon.datasets.dataset.DatasetDeque` that has just
+    moved, the statistics are updated by subtracting the contributions of
+    calibration lines that have left the training set and adding those
+    of lines that have entered it.  The coefficients for all channels are
+    then obtained in closed form in a single batched solve, and
+    subsequent calls to `fit` or `test` for other channels with the same
+    context reuse the result.
+
+    Predictands (median space offsets) for calibration lines that were
+    already in the previous window are reused as well, so that only new
+    calibration lines need to be calibrated.
+
+    The selection of training lines (outlier filters, flags, normality
+    test) is the same as for `RSelfTemperature`, and so are the
+    normalisation and the resulting coefficients, up to floating point
+    precision.  The statistics are accumulated in a fixed reference
+    normalisation, which is converted to the normalisation of the current
+    window after solving.  To bound the accumulation of rounding errors,
+    the statistics are recomputed from scratch every `refresh_every`
+    updates.
+    """
+
+    refresh_every = 24
+    """int : Number of incremental updates before a full recomputation
+    """
+
+    _window = None
+    _line_times = _line_Y = _line_Z = _line_mask = None
+    _norm_ref = _Y_attrs = None
+    _n_updates = 0
+
+    def __init__(self, hirs, temperatures=None,
+            regr=("LR", {"fit_intercept": True}),
+            channels=range(1, 20)):
+        """Initialise `RSelfTemperatureIncremental` object
+
+        Parameters
+        ----------
+
+        hirs : `fcdr.HIRSFCDR`
+            'fcdr.HIRSFCDR` object that the self-emission model relates
+            to.
+        temperatures : List[str], optional
+            List of temperatures to use.  Overrides the `temperatures`
+            attribute.
+        regr : Tuple[str, Mapping], optional
+            Regression type to use.  Only "LR" is supported, as the
+            closed-form solution is that of ordinary least squares.
+        channels : Sequence[int], optional
+            Channels to fit simultaneously.  Defaults to 1–19.
+        """
+        if regr[0] != "LR":
+            raise ValueError("Incremental self-emission model only "
+                f"supports linear regression (LR), got {regr[0]:s}")
+        super().__init__(hirs, temperatures=temperatures, regr=regr)
+        self.channels = list(channels)
+        self._results = {}
+
+    def _get_predictand_lines(self, ds, t_cal):
+        """Get predictands for all channels, reusing those already known
+
+        Parameters
+        ----------
+
+        ds : xarray.Dataset
+            Context from which to calculate the predictands.
+        t_cal : ndarray
+            Times of calibration lines in ``ds``.
+
+        Returns
+        -------
+
+        Y : ndarray
+            Array (time, channel) with median offsets for all
+            calibration lines in ``t_cal``, NaN for lines in channels
+            for which the predictand could not be calculated.  Lines
+            that are NaN from an earlier context are calculated again.
+        errors : Dict[int, Exception]
+            For channels for which the predictand could not be
+            calculated, the exception raised.
+        """
+        Y = numpy.full((t_cal.size, len(self.channels)), numpy.nan)
+        if self._line_times is None:
+            known = numpy.zeros(Y.shape, dtype="?")
+        else:
+            in_old = numpy.isin(t_cal, self._line_times)
+            pos = numpy.searchsorted(self._line_times, t_cal[in_old])
+            Y[in_old, :] = self._line_Y[pos, :]
+            # lines for which the predictand failed before are NaN and
+            # are tried again, the failure may have been due to
+            # the part of the context known at the time
+            known = numpy.isfinite(Y)
+        errors = {}
+        for (c, ch) in enumerate(self.channels):
+            new = numpy.flatnonzero(~known[:, c])
+            if new.size == 0:
+                continue
+            # offsets for a calibration line depend only on that line, so
+            # it is enough to calibrate the part of the context that is new
+            t0 = t_cal[new].min()
+            sub = ds.isel(time=ds["time"].values >= t0)
+            try:
+                y = self.get_predictand(sub, ch)
+            # as when fitting channels one by one, a failure only
+            # affects its channel, it is raised when fitting that
+            except Exception as e:
+                errors[ch] = e
+                continue
+            self._Y_attrs = y.attrs
+            t_sub = y["time"].values
+            if not numpy.isin(t_cal[new], t_sub).all():
+                raise FCDRError("Calibration lines differ between "
+                    "context and its most recent part.  This should "
+                    "not happen.")
+            Y[new, c] = y.values[numpy.searchsorted(t_sub, t_cal[new])]
+        return (Y, errors)
+
+    def _update(self, ds):
+        """Update sufficient statistics and solve for new context
+
+        Select training lines for all channels in the same way as
+        `RSelfTemperature.fit`, update the sufficient statistics, solve,
+        and store the per-channel outcome to be picked up by `fit` and
+        `test`.
+
+        Parameters
+        ----------
+
+        ds : xarray.Dataset
+            Context (training data), see `RSelfTemperature.fit`.
+        """
+        self._window = None
+        t_cal = self.hirs.extract_calibcounts(
+            ds, self.channels[0])[0]["time"].values
+        ix = xarray.DataArray(
+            numpy.arange(ds["time"].size),
+            dims=["time"],
+            coords={"time": ds["time"]}).sel(time=t_cal)
+        ds_cal = ds.isel(time=ix)
+        X = self.get_predictor(ds_cal, self.channels[0],
+            recalculate_norm=True)
+        (Y, errors) = self._get_predictand_lines(ds, t_cal)
+
+        fields = list(X.data_vars.keys())
+        Xn = numpy.stack([X[k].values for k in fields], 1)
+        norm = (numpy.array([self.norm_offset[k].values for k in fields]),
+                numpy.array([self.norm_factor[k].values for k in fields]))
+        Xx = Xn.astype("f4") # as used by RSelfTemperature._ds2ndarray
+        finite_X = numpy.isfinite(Xn).all(1)
+
+        # line selection per channel, as in RSelfTemperature.fit and
+        # RSelfTemperature.test
+        n_ch = len(self.channels)
+        mask = numpy.zeros((t_cal.size, n_ch), dtype="?")
+        self._results.clear()
+        for (c, ch) in enumerate(self.channels):
+            ds_ch = ds_cal.sel(channel=ch)
+            y = Y[:, c]
+            res = self._results[ch] = {"error": errors.get(ch),
+                                       "normaltest": None}
+            if res["error"] is not None:
+                continue
+            OK_test = (~self.hirs.filter_calibcounts.filter_outliers(y) &
+                       self._OK_eval(ds_ch))
+            res["OK_test"] = OK_test
+            res["Y"] = UADA(y, dims=("time",), coords={"time": t_cal},
+                attrs=self._Y_attrs).assign_coords(calibrated_channel=ch)
+            if numpy.isinf(y).any():
+                res["error"] = ValueError("Some offsets are infinite.  That "
+                    "probably means calibration counts (space and IWCT) are "
+                    "all equal. There is no hope of doing anything "
+                    "meaningful here. Sorry.")
+                continue
+            OK = OK_test.copy()
+            notnull = finite_X & numpy.isfinite(y)
+            OK &= notnull
+            OK[notnull] &= ~self.hirs.filter_prttemps.filter_outliers(
+                Xx[notnull, :]).any(1)
+            try:
+                self._ensure_enough_OK(ds_ch, OK)
+            except ValueError as e:
+                res["error"] = e
+                continue
+            res["normaltest"] = scipy.stats.normaltest(y[OK].astype("f4"))
+            mask[:, c] = OK
+
+        self._accumulate(t_cal, Xn, norm, Y, mask)
+        (coef, intercept) = self._solve(norm)
+        for (c, ch) in enumerate(self.channels):
+            if self._results[ch]["error"] is not None:
+                continue
+            model = copy.copy(self.core_model)
+            model.coef_ = coef[c, :]
+            model.intercept_ = intercept[c]
+            model.n_features_in_ = coef.shape[1]
+            self._results[ch]["model"] = model
+
+        self._X = X
+        self._ix = ix
+        self._window = ds
+
+    def _accumulate(self, t_cal, Xn, norm, Y, mask):
+        """Update sufficient statistics with lines entering and leaving
+
+        Parameters
+        ----------
+
+        t_cal : ndarray
+            Times of calibration lines in new context.
+        Xn : ndarray
+            Normalised predictor (time, temperature).
+        norm : Tuple[ndarray, ndarray]
+            Offset and factor with which ``Xn`` is normalised.
+        Y : ndarray
+            Predictand (time, channel).
+        mask : ndarray
+            Lines (time, channel) to be used for training.
+        """
+        refresh = (self._line_times is None or
+                   self._n_updates >= self.refresh_every or
+                   not self.core_model.fit_intercept)
+        if refresh:
+            # without intercept, a change in normalisation is not merely
+            # a change in intercept, so always work in current one
+            self._norm_ref = norm
+        # predictor in reference normalisation, augmented by intercept
+        X4 = Xn*norm[1] + norm[0]
+        Z = numpy.c_[numpy.ones(t_cal.size),
+                     (X4-self._norm_ref[0])/self._norm_ref[1]]
+        Z[~mask.any(1), :] = 0
+        self._line_Y = Y
+        Y = numpy.where(mask, Y, 0)
+        if refresh:
+            entering = mask.astype("f8")
+            self._S = numpy.einsum("ic,ij,ik->cjk", entering, Z, Z)
+            self._T = numpy.einsum("ic,ij,ic->cj", entering, Z, Y)
+            self._n_updates = 0
+        else:
+            old_in_new = numpy.isin(self._line_times, t_cal)
+            pos = numpy.searchsorted(t_cal, self._line_times[old_in_new])
+            old_mask = numpy.zeros_like(mask)
+            old_mask[pos, :] = self._line_mask[old_in_new, :]
+            leaving = self._line_mask.copy()
+            leaving[old_in_new, :] &= ~mask[pos, :]
+            entering = mask & ~old_mask
+            (leaving, entering) = (leaving.astype("f8"), entering.astype("f8"))
+            self._S += (numpy.einsum("ic,ij,ik->cjk", entering, Z, Z) -
+                numpy.einsum("ic,ij,ik->cjk", leaving,
+                    self._line_Z, self._line_Z))
+            self._T += (numpy.einsum("ic,ij,ic->cj", entering, Z, Y) -
+                numpy.einsum("ic,ij,ic->cj", leaving,
+                    self._line_Z, self._line_Y_train))
+            self._n_updates += 1
+        self._line_times = t_cal
+        self._line_Z = Z
+        self._line_Y_train = Y
+        self._line_mask = mask
+
+    def _solve(self, norm):
+        """Solve for coefficients of all channels at once
+
+        Parameters
+        ----------
+
+        norm : Tuple[ndarray, ndarray]
+            Offset and factor of the normalisation in which the
+            coefficients are to be expressed.
+
+        Returns
+        -------
+
+        coef : ndarray
+            Coefficients (channel, temperature).
+        intercept : ndarray
+            Intercepts (channel,).
+        """
+        S = self._S
+        T = self._T
+        with numpy.errstate(invalid="ignore", divide="ignore"):
+            if self.core_model.fit_intercept:
+                # centre, like sklearn does, such that predictors without
+                # any variance get a coefficient of zero
+                n = S[:, 0, 0]
+                zbar = S[:, 0, 1:] / n[:, numpy.newaxis]
+                ybar = T[:, 0] / n
+                Sxx = (S[:, 1:, 1:] - n[:, numpy.newaxis, numpy.newaxis] *
+                       zbar[:, :, numpy.newaxis] * zbar[:, numpy.newaxis, :])
+                Sxy = T[:, 1:] - n[:, numpy.newaxis] * zbar * ybar[:, numpy.newaxis]
+            else:
+                Sxx = S[:, 1:, 1:]
+                Sxy = T[:, 1:]
+            ok = numpy.isfinite(Sxx).all((1, 2)) & numpy.isfinite(Sxy).all(1)
+            beta = numpy.full(Sxy.shape, numpy.nan)
+            beta[ok, :] = numpy.einsum("cjk,ck->cj",
+                numpy.linalg.pinv(Sxx[ok, :, :], rcond=1e-10), Sxy[ok, :])
+            if self.core_model.fit_intercept:
+                intercept = ybar - (zbar * beta).sum(1)
+            else:
+                intercept = numpy.zeros(beta.shape[0])
+        # from reference normalisation to current normalisation
+        intercept = intercept + (beta * (norm[0]-self._norm_ref[0]) /
+                                 self._norm_ref[1]).sum(1)
+        coef = beta * norm[1] / self._norm_ref[1]
+        return (coef, intercept)
+
+    def fit(self, ds, ch, force=False):
+        """Fit model for channel
+
+        See `RSelfTemperature.fit`.  The first call for a new context
+        fits all channels; further calls for the same context only pick
+        up the result for the channel.
+
+        Parameters
+        ----------
+
+        ds : xarray.Dataset
+            Dataset containing segment of L1B data based on which the
+            training will occur.
+        ch: int
+            Channel to train.
+        force: bool, optional
+            If True, proceed with fitting even if the training data fails
+            the normality test.  Defaults to False.
+        """
+        if ds is not self._window:
+            self._update(ds)
+        res = self._results[ch]
+        if isinstance(res["error"], ValueError):
+            raise ValueError(*res["error"].args)
+        elif res["error"] is not None:
+            raise res["error"]
+        tr = res["normaltest"]
+        if tr.statistic > 10 and tr.pvalue < 0.05 and not force:
+            raise ValueError("Space views fail normality test: "
+                f"test statistic {tr.statistic:.3f}, p-value "
+                f"{tr.pvalue:9.3e}. Is the gain changing?")
+        self.models[ch] = res["model"]
+        self.X_ref = self._X
+        self.Y_ref = res["Y"]
+        self.fit_time = ds["time"].values[[0,-1]].astype("M8[ms]")
+
+    def test(self, ds, ch):
+        """Test model for reference data.
+
+        See `RSelfTemperature.test`.  If ``ds`` is the context most
+        recently passed to `fit`, the predictands calculated there are
+        reused.
+        """
+        res = self._results.get(ch, {})
+        if ds is not self._window or "OK_test" not in res:
+            # not fitted on ds, or no predictand for this channel
+            return super().test(ds, ch)
+        OK = res["OK_test"]
+        self._ensure_enough_OK(ds.isel(time=self._ix).sel(channel=ch), OK)
+        (X, Y_pred) = self.evaluate(ds.isel(time=self._ix).isel(time=OK), ch)
+        return (X, res["Y"].isel(time=OK).squeeze(), Y_pred.squeeze())
+
+    def save(self, path, **attrs):
+        """Save state of model to a snapshot file
+
+        Store the sufficient statistics, the calibration lines in the
+        most recent window with their predictands and training masks, the
+        normalisation, the coefficients, and per-channel fit diagnostics
+        to a NetCDF file.  A model restored from this with `load` can be
+        used with `evaluate` directly, and a subsequent `fit` will only
+        need to calibrate calibration lines that were not yet in the
+        snapshot.
+
+        The snapshot is written to a temporary file first, which is then
+        moved into place, such that an interrupted write never leaves a
+        partial snapshot to be loaded later.
+
+        Parameters
+        ----------
+
+        path : str or pathlib.Path
+            File to write to.
+        **attrs
+            Additional global attributes to store, such as the satellite.
+        """
+        if self._line_times is None:
+            raise ValueError("Nothing to save, model was never fitted")
+        if self.fit_time is None or self._Y_attrs is None:
+            raise ValueError("Nothing to save, no channel was ever fitted")
+        fields = list(self.norm_offset.data_vars.keys())
+        chans = self.channels
+        stat = {k: numpy.full(len(chans), numpy.nan)
+                for k in ("normaltest_statistic", "normaltest_pvalue")}
+        coef = numpy.full((len(chans), len(fields)), numpy.nan)
+        intercept = numpy.full(len(chans), numpy.nan)
+        errors = [""] * len(chans)
+        for (c, ch) in enumerate(chans):
+            res = self._results.get(ch, {})
+            if res.get("error") is not None:
+                errors[c] = str(res["error"])
+            if res.get("normaltest") is not None:
+                stat["normaltest_statistic"][c] = res["normaltest"].statistic
+                stat["normaltest_pvalue"][c] = res["normaltest"].pvalue
+            if "model" in res:
+                coef[c, :] = res["model"].coef_
+                intercept[c] = res["model"].intercept_
+        aug = ["intercept"] + fields
+        ds = xarray.Dataset(
+            {"line_Y": (("line", "channel"), self._line_Y),
+             "line_Y_train": (("line", "channel"), self._line_Y_train),
+             "line_Z": (("line", "term"), self._line_Z),
+             "line_mask": (("line", "channel"), self._line_mask.astype("u1")),
+             "S": (("channel", "term", "term2"), self._S),
+             "T": (("channel", "term"), self._T),
+             "norm_ref_offset": (("temperature",), self._norm_ref[0]),
+             "norm_ref_factor": (("temperature",), self._norm_ref[1]),
+             "norm_offset": (("temperature",),
+                numpy.array([self.norm_offset[k].values for k in fields])),
+             "norm_factor": (("temperature",),
+                numpy.array([self.norm_factor[k].values for k in fields])),
+             "coef": (("channel", "temperature"), coef),
+             "intercept": (("channel",), intercept),
+             "n_train": (("channel",), self._line_mask.sum(0)),
+             "error": (("channel",), numpy.array(errors, dtype=str)),
+             **{k: (("channel",), v) for (k, v) in stat.items()}},
+            coords={"line": self._line_times,
+                    "channel": chans,
+                    "term": aug,
+                    "term2": aug,
+                    "temperature": fields},
+            attrs={"temperatures": " ".join(self.temperatures),
+                   "fit_time_start": str(self.fit_time[0]),
+                   "fit_time_end": str(self.fit_time[1]),
+                   "n_updates": self._n_updates,
+                   **{f"Y_{k:s}": v for (k, v) in self._Y_attrs.items()},
+                   **attrs})
+        path = pathlib.Path(path)
+        (fd, tmp) = tempfile.mkstemp(dir=path.parent,
+            prefix=f".{path.stem:s}.", suffix=".nc")
+        os.close(fd)
+        try:
+            ds.to_netcdf(tmp)
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def load(self, path):
+        """Restore state of model from a snapshot file
+
+        Counterpart of `save`.  The restored model can be evaluated
+        right away.  The next call to `fit` will continue to update the
+        restored statistics incrementally.
+
+        Parameters
+        ----------
+
+        path : str or pathlib.Path
+            File written by `save`.
+
+        Returns
+        -------
+
+        Mapping
+            Global attributes of the snapshot.
+        """
+        with xarray.open_dataset(str(path)) as ds:
+            ds.load()
+        if ds.attrs["temperatures"].split() != list(self.temperatures):
+            raise ValueError(f"Snapshot {path!s} was made with "
+                f"temperatures {ds.attrs['temperatures']:s}, expected "
+                f"{' '.join(self.temperatures):s}")
+        if ds["channel"].values.tolist() != self.channels:
+            raise ValueError(f"Snapshot {path!s} does not contain the "
+                "expected channels")
+        fields = ds["temperature"].values.tolist()
+        self._window = None
+        self._line_times = ds["line"].values
+        self._line_Y = ds["line_Y"].values
+        self._line_Y_train = ds["line_Y_train"].values
+        self._line_Z = ds["line_Z"].values
+        self._line_mask = ds["line_mask"].values.astype("?")
+        self._S = ds["S"].values
+        self._T = ds["T"].values
+        self._norm_ref = (ds["norm_ref_offset"].values,
+                          ds["norm_ref_factor"].values)
+        self._n_updates = int(ds.attrs["n_updates"])
+        self._Y_attrs = {k[2:]: v for (k, v) in ds.attrs.items()
+                         if k.startswith("Y_")}
+        self.norm_offset = xarray.Dataset(
+            {k: ((), v) for (k, v) in zip(fields, ds["norm_offset"].values)})
+        self.norm_factor = xarray.Dataset(
+            {k: ((), v) for (k, v) in zip(fields, ds["norm_factor"].values)})
+        self._results.clear()
+        self.models.clear()
+        for ch in self.channels:
+            if ds["error"].sel(channel=ch).item() != "":
+                continue
+            model = copy.copy(self.core_model)
+            model.coef_ = ds["coef"].sel(channel=ch).values
+            model.intercept_ = ds["intercept"].sel(channel=ch).item()
+            model.n_features_in_ = len(fields)
+            self.models[ch] = model
+        self.Y_ref = UADA(numpy.array([]), dims=("time",),
+            attrs=self._Y_attrs)
+        self.fit_time = numpy.array(
+            [ds.attrs["fit_time_start"], ds.attrs["fit_time_end"]],
+            dtype="M8[ms]")
+        return ds.attrs
 
 
 class RRefl:
@@ -0,0 +1,345 @@
+"""Extract collocated pixels from debug FCDR files
+
+Adding FCDR data to matchups, as done by
+`~FCDR_HIRS.matchups.HIRSMatchupCombiner`, used to go through
+`~typhon.datasets.dataset.Dataset.combine`, which reads every debug FCDR
+file covering the matchup period in full and then selects a few hundred
+pixels from each.  This module implements an alternative that reads only
+what is needed.
+
+Requested pixels, given by time and scan position, are grouped per file.
+For each file and each variable, only the rows along its time dimension
+that contain a requested pixel are read, in contiguous runs that are
+merged if they are close, and the requested scan positions are picked
+from those rows.  Open files are kept in a cache of limited size, such
+that each file is opened once for all variables and for repeated
+extractions, while the number of open files stays bounded.
+
+The result has the same layout as that of
+`typhon.datasets.tovs.TOVSCollocatedDataset.combine`: one value per
+matchup for each variable, with all time dimensions replaced by the
+collocation dimension, the time coordinates retained as coordinates
+along that dimension, and the scan position dimension removed.
+Components stored in factored form, see `FCDR_HIRS.factored_uncertainty`,
+are reconstructed for the requested pixels only.
+"""
+
+import collections
+import datetime
+import logging
+
+import numpy
+import xarray
+
+from . import factored_uncertainty
+
+logger = logging.getLogger(__name__)
+
+class DebugFCDRExtractor:
+    """Read individual pixels from debug FCDR files
+
+    Parameters
+    ----------
+
+    hirs : `~FCDR_HIRS.fcdr.HIRSFCDR`
+        HIRS FCDR object in L1C read mode, such as returned by
+        ``fcdr.which_hirs_fcdr(satname, read="L1C")``, used to find the
+        debug FCDR files.
+    locator_args : dict
+        Arguments to locate the debug FCDR files, such as
+        ``data_version``, ``format_version``, and ``fcdr_type``.
+    max_open : int, optional
+        Maximum number of files to keep open.  Defaults to 32.
+    max_gap : int, optional
+        Read rows that are at most this far apart in a single read.
+        Defaults to 64.
+
+    Examples
+    --------
+
+    >>> ext = DebugFCDRExtractor(fcdr.which_hirs_fcdr("noaa18", read="L1C"),
+    ...     {"data_version": "0.8pre2_no_harm", "format_version": "2.0.0",
+    ...      "fcdr_type": "debug"})
+    >>> Mcs = ext.combine(ds, ["T_b", "u_T_b_random"],
+    ...     time_name="time_noaa18", col_field="hirs-noaa18_x",
+    ...     colloc_dim="matchup_count")
+    """
+
+    #: str : Dimension along a scanline
+    col_dim_name = "scanpos"
+
+    #: str : Time coordinate to compare matchup times with
+    time_coord = "time"
+
+    def __init__(self, hirs, locator_args, max_open=32, max_gap=64):
+        self.hirs = hirs
+        self.locator_args = locator_args
+        self.max_open = max_open
+        self.max_gap = max_gap
+        self._handles = collections.OrderedDict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """Close all cached files
+        """
+        while self._handles:
+            (_, (ds, _)) = self._handles.popitem(last=False)
+            ds.close()
+
+    def _open(self, path):
+        """Get dataset and its time coordinates from handle cache
+        """
+        try:
+            self._handles.move_to_end(path)
+        except KeyError:
+            if len(self._handles) >= self.max_open:
+                (_, (old, _)) = self._handles.popitem(last=False)
+                old.close()
+            ds = xarray.open_dataset(str(path))
+            times = {d: ds[d].values for d in ds.dims
+                     if d in ds.coords and ds[d].dtype.kind == "M"}
+            self._handles[path] = (ds, times)
+        return self._handles[path]
+
+    def find_files(self, times):
+        """Assign each time to the debug FCDR file containing it
+
+        Parameters
+        ----------
+
+        times : ndarray, datetime64
+            Times of pixels.
+
+        Returns
+        -------
+
+        files : List[pathlib.Path]
+            Files covering the period.
+        which : ndarray, int
+            For each time, the index into ``files``, or -1 if no file
+            starts before it.
+        """
+        first = times.min().astype("M8[ms]").astype(datetime.datetime)
+        last = times.max().astype("M8[ms]").astype(datetime.datetime)
+        found = list(self.hirs.find_granules_sorted(first, last,
+            include_last_before=True, return_time=True,
+            **self.locator_args))
+        if not found:
+            return ([], numpy.full(times.shape, -1))
+        starts = numpy.array([st for (st, _) in found], dtype="M8[ms]")
+        which = numpy.searchsorted(starts, times.astype("M8[ms]"),
+            side="right") - 1
+        return ([f for (_, f) in found], which)
+
+    def _read_rows(self, var, tdim, rows):
+        """Read rows along tdim, merging runs less than max_gap apart
+
+        Returns the data with tdim first and the position of each
+        requested row therein.
+        """
+        uniq = numpy.unique(rows)
+        breaks = numpy.nonzero(numpy.diff(uniq) > self.max_gap)[0] + 1
+        blocks = []
+        read = []
+        for run in numpy.split(uniq, breaks):
+            blocks.append(var.isel({tdim: slice(run[0], run[-1]+1)})
+                .transpose(tdim, ...).values)
+            read.append(numpy.arange(run[0], run[-1]+1))
+        read = numpy.concatenate(read)
+        return (numpy.concatenate(blocks, axis=0),
+                numpy.searchsorted(read, rows))
+
+    def _extract_from_file(self, path, fields, times, cols):
+        (ds, ftimes) = self._open(path)
+        idx = {}
+        for (d, x) in ftimes.items():
+            idx[d] = numpy.interp(
+                times.astype("M8[ms]").astype("f8"),
+                x.astype("M8[ms]").astype("f8"),
+                numpy.arange(x.size)).round().astype(numpy.int64)
+        names = set()
+        for f in fields:
+            if f in ds.variables:
+                names.add(f)
+            elif f"{f:s}_magnitude" in ds.data_vars:
+                mag = f"{f:s}_magnitude"
+                names |= {mag, ds[mag].attrs["sensitivity"]}
+            else:
+                logger.debug(f"{f:s} not in {path!s}")
+        # coordinates such as lat_earth are carried along, as by combine
+        coords = {c for c in ds.coords
+                  if c not in ds.dims and set(ds[c].dims) & idx.keys()}
+        names |= coords
+        out = {}
+        for k in sorted(names):
+            var = ds[k]
+            tdims = [d for d in var.dims if d in idx]
+            if len(tdims) > 1:
+                raise ValueError(f"{k:s} in {path!s} has several time "
+                                 f"dimensions: {tdims!s}")
+            rest = [d for d in var.dims
+                    if d not in tdims and d != self.col_dim_name]
+            if tdims:
+                (data, pos) = self._read_rows(var, tdims[0], idx[tdims[0]])
+                lead = [pos]
+            elif self.col_dim_name in var.dims:
+                data = var.transpose(self.col_dim_name, ...).values
+                lead = []
+            else:
+                # no time dimension, keep as is
+                out[k] = var.load()
+                continue
+            if self.col_dim_name in var.dims:
+                if tdims:
+                    data = numpy.moveaxis(data,
+                        1 + [d for d in var.dims if d != tdims[0]].index(
+                            self.col_dim_name), 1)
+                lead.append(cols)
+            values = data[tuple(lead)]
+            out[k] = (values, rest,
+                      {d: ds[d].values for d in rest if d in ds.coords},
+                      var.attrs, var.encoding)
+        matched = {d: x[idx[d]] for (d, x) in ftimes.items()}
+        return (out, matched, coords)
+
+    def extract(self, times, cols, fields, colloc_dim="matchup_count",
+                timetol=numpy.timedelta64(4, 's')):
+        """Extract pixels from debug FCDR files
+
+        Parameters
+        ----------
+
+        times : ndarray, datetime64
+            Time of each pixel.
+        cols : ndarray, int
+            Scan position of each pixel.
+        fields : Collection[str]
+            Fields to extract.
+        colloc_dim : str, optional
+            Name for the dimension along the pixels.
+        timetol : timedelta64, optional
+            Maximum difference between requested and found time.  Pixels
+            for which no scanline is found within this tolerance are set
+            to NaN.
+
+        Returns
+        -------
+
+        xarray.Dataset
+            Dataset with the requested fields along ``colloc_dim``.
+        """
+        times = numpy.asarray(times)
+        cols = numpy.asarray(cols).astype(numpy.int64)
+        (files, which) = self.find_files(times)
+        parts = {}
+        matched = {}
+        coordnames = set()
+        for (i, path) in enumerate(files):
+            sel = numpy.nonzero(which == i)[0]
+            if sel.size == 0:
+                continue
+            logger.debug(f"Extracting {sel.size:d} pixels from {path!s}")
+            (out, mt, cn) = self._extract_from_file(path, fields,
+                times[sel], cols[sel])
+            coordnames |= cn
+            for (k, v) in out.items():
+                parts.setdefault(k, []).append((sel, v))
+            for (d, x) in mt.items():
+                matched.setdefault(d, []).append((sel, x))
+        if not matched.get(self.time_coord):
+            raise ValueError(f"Primary covers {times.min()!s}–"
+                f"{times.max()!s}, but no debug FCDR files found covering "
+                "this period.")
+        coords = {d: self._assemble(times.size, v) for (d, v) in matched.items()}
+        near = (abs(coords[self.time_coord] - times) < timetol)
+        if not near.any():
+            raise ValueError("Primary covers "
+                f"{times.min()!s}–{times.max()!s}, but no scanlines "
+                "found within tolerance.")
+        if not near.all():
+            logger.warning(f"Only {near.sum():d}/{near.size:d} "
+                           f"({near.sum()/near.size:%}) of pixels found")
+        M = xarray.Dataset(
+            coords={**{d: (colloc_dim, v) for (d, v) in coords.items()},
+                    colloc_dim: numpy.arange(times.size)})
+        for (k, v) in parts.items():
+            if isinstance(v[0][1], xarray.DataArray):
+                # no time dimension, take from first file as
+                # read_period would
+                M[k] = v[0][1]
+                continue
+            (_, rest, rcoords, attrs, encoding) = v[0][1]
+            values = self._assemble(times.size,
+                [(sel, vv[0]) for (sel, vv) in v], ~near)
+            M[k] = xarray.DataArray(values, dims=(colloc_dim, *rest),
+                coords=rcoords, attrs=attrs)
+            M[k].encoding.update(encoding)
+        M = M.set_coords(sorted(coordnames & M.data_vars.keys()))
+        return factored_uncertainty.expand(M)
+
+    @staticmethod
+    def _assemble(n, pieces, invalid=None):
+        """Put per-file pieces together, filling missing values
+        """
+        (_, first) = pieces[0]
+        have = numpy.zeros(n, dtype="?")
+        for (sel, _) in pieces:
+            have[sel] = True
+        if invalid is not None:
+            have &= ~invalid
+        dtype = first.dtype
+        if not have.all() and dtype.kind in "biu":
+            dtype = numpy.dtype("f8")
+        fill = (numpy.datetime64("NaT") if dtype.kind == "M"
+                else numpy.nan if dtype.kind in "fc" else 0)
+        arr = numpy.full((n,) + first.shape[1:], fill, dtype=dtype)
+        for (sel, values) in pieces:
+            arr[sel] = values
+        arr[~have] = fill
+        return arr
+
+    def combine(self, M, fields, time_name, col_field,
+                colloc_dim, timetol=numpy.timedelta64(4, 's'),
+                orbit_filters=()):
+        """Add debug FCDR data to matchups
+
+        Equivalent to
+        `typhon.datasets.tovs.TOVSCollocatedDataset.combine`, but
+        reading only the pixels needed.
+
+        Parameters
+        ----------
+
+        M : xarray.Dataset
+            Matchups.
+        fields : Collection[str]
+            Fields to read from the debug FCDR.
+        time_name : str
+            Field in ``M`` with the time of each matchup.
+        col_field : str
+            Field in ``M`` with the scan position of each matchup.
+        colloc_dim : str
+            Dimension in ``M`` along the matchups.
+        timetol : timedelta64, optional
+            Maximum time difference between matchup and FCDR scanline.
+        orbit_filters : Sequence[`typhon.datasets.filters.OrbitFilter`]
+            Filters whose ``finalise`` method is applied to the result,
+            such as `~FCDR_HIRS.matchups.CalibrationCountDimensionReducer`.
+
+        Returns
+        -------
+
+        xarray.Dataset
+            FCDR data for each matchup.
+        """
+        MM = self.extract(M[time_name].values, M[col_field].values,
+            fields, colloc_dim=colloc_dim, timetol=timetol)
+        MM = MM.assign_coords(**{colloc_dim: M[colloc_dim].values})
+        for of in orbit_filters:
+            MM = of.finalise(MM)
+        return MM
@@ -39,6 +39,11 @@ See issue #22
     parser.add_argument("--src-version", action="store", type=str,
         default="0.8pre2_no_harm",
         help="Source version to use for matchup enhancement")
+
+    parser.add_argument("--read-full-files", action="store_false",
+        dest="read_pixels_only", default=True,
+        help=("Read debug FCDR files in full through typhon's combine, "
+              "rather than reading only the collocated pixels."))
     return parser
 def parse_cmdline_hirs():
     return get_parser_hirs().parse_args()
@@ -79,6 +84,11 @@ Convert HIRS-IASI matchups for harmonisation
     group.add_argument('--with-filters', action='store_true')
     group.add_argument('--without-filters', action='store_false')
 
+    parser.add_argument("--read-full-files", action="store_false",
+        dest="read_pixels_only", default=True,
+        help=("Read debug FCDR files in full through typhon's combine, "
+              "rather than reading only the collocated pixels."))
+
     return parser
 def parse_cmdline_iasi():
     return get_parser_iasi().parse_args()
@@ -165,13 +175,15 @@ class HIRSMatchupCombiner(matchups.HIRSMatchupCombiner):
                  hirs_format_version=None,
                  extra_data_versions=None,
                  extra_format_versions=None,
-                 extra_fields=None):
+                 extra_fields=None,
+                 read_pixels_only=True):
         super().__init__(start_date, end_date, prim, sec,
             hirs_data_version=hirs_data_version,
             hirs_format_version=hirs_format_version,
             extra_data_versions=extra_data_versions,
             extra_format_versions=extra_format_versions,
-            extra_fields=extra_fields)
+            extra_fields=extra_fields,
+            read_pixels_only=read_pixels_only)
         # parent has set self.mode to either "hirs" or "reference"
         if self.mode not in ("hirs", "reference"):
             raise RuntimeError("My father has been bad.")
@@ -816,7 +828,8 @@ def combine_hirs():
             debug=p.debug,
             apply_filters=p.with_filters,
             hirs_data_version=p.src_version,
-            extra_fields=p.extra_fields)
+            extra_fields=p.extra_fields,
+            read_pixels_only=p.read_pixels_only)
 
         ds = hmc.as_xarray_dataset()
     except (typhon.datasets.dataset.DataFileError, MatchupError) as e:
@@ -882,7 +895,8 @@ def combine_iasi():
         "iasi", "metopa",
         hirs_data_version=p.hirs_src_version,
         apply_filters=p.with_filters,
-        extra_fields=p.hirs_extra_fields)
+        extra_fields=p.hirs_extra_fields,
+        read_pixels_only=p.read_pixels_only)
 
     ds = hmc.as_xarray_dataset()
     for channel in range(1, 20):
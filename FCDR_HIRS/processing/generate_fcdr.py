@@ -116,25 +116,26 @@ release notes for details on versions used."""
 #
 
 import sys
+import os
 import pathlib
 #pathlib.Path("/dev/shm/gerrit/cache").mkdir(parents=True, exist_ok=True)
 from .. import common
 import argparse
-import subprocess
 import warnings
 import functools
 import operator
 import enum
 import types
 import logging
+import importlib.metadata
 
-import pkg_resources
 import datetime
 
 import numpy
 import pandas
 import xarray
 import isodate
+import typhon.config
 import typhon.datasets.dataset
 import typhon.datasets.filters
 from typhon.physics.units.common import radiance_units as rad_u
@@ -145,6 +146,12 @@ from .. import effects
 from .. import measurement_equation as me
 from .. import _fcdr_defs
 from .. import metrology
+from ..granule_cache import GranuleCache
+from ..granule_index import GranuleIndex
+from ..zarr_store import FCDRZarrStore
+from .. import threaded_write
+from .. import factored_uncertainty
+from .. import startup_profile
 
 import fiduceo.fcdr.writer.fcdr_writer
 
@@ -162,8 +169,9 @@ def get_parser():
         include_temperatures=False)
 
     parser.add_argument("modes", action="store", type=str,
-        nargs="+", choices=["easy", "debug", "none"],
-        help="What FCDR(s) to write?")
+        nargs="+", choices=["easy", "debug", "zarr", "none"],
+        help=("What FCDR(s) to write?  'zarr' appends the debug FCDR "
+              "to a per-satellite Zarr store."))
 
     parser.add_argument("--days", action="store", type=int,
         default=0,
@@ -183,6 +191,43 @@ def get_parser():
               "in the measurement equation.  This reduces the data volume by over 88%% "
               "compared to the unabridged version."))
 
+    parser.add_argument("--no-rself-snapshots", action="store_false",
+        dest="rself_snapshots", default=True,
+        help=("Do not warm-start the self-emission model from, or store "
+              "it to, snapshots in the cache directory."))
+
+    parser.add_argument("--no-granule-cache", action="store_false",
+        dest="granule_cache", default=True,
+        help=("Do not read L1B granules through, or store them to, the "
+              "cache of decoded and filtered granules in the cache "
+              "directory."))
+
+    parser.add_argument("--no-granule-index", action="store_false",
+        dest="granule_index", default=True,
+        help=("Do not look up L1B granule times in, or store them to, the "
+              "granule time index in the cache directory, but scan the "
+              "archive instead."))
+
+    parser.add_argument("--encoding-table", action="store", type=str,
+        help=("JSON file with encodings for debug and/or easy FCDR "
+              "variables, overriding the defaults.  See "
+              "optimise_hirs_fcdr_encoding."))
+
+    parser.add_argument("--compress-threads", action="store", type=int,
+        default=1,
+        help=("Number of threads for compressing variables when writing "
+              "debug and easy FCDR files.  If more than 1, variables are "
+              "compressed in parallel and the easy FCDR is written "
+              "without the FCDRWriter from FCDRTools.  Defaults to 1, "
+              "writing with a single thread with the FCDRWriter."))
+
+    parser.add_argument("--factored-uncertainties", action="store_true",
+        default=False,
+        help=("For debug version, store u_from_x components sharing a "
+              "sensitivity profile as per-scanline magnitudes and one "
+              "shared profile.  Read such files with "
+              "FCDR_HIRS.factored_uncertainty.open_debug_fcdr."))
+
     return parser
 def parse_cmdline():
     return get_parser().parse_args()
@@ -253,6 +298,45 @@ class FCDRGenerator:
 
     max_debug_corr_length : int
 
+    rself_snapshots : bool
+        Warm-start the self-emission model from the most recent snapshot
+        within the context window, and store a snapshot after each
+        step.  Of the snapshots written by a call to `process`, only the
+        `rself_snapshots_keep` with the latest windows are kept.  Snapshots are stored in the ``rself_snapshots``
+        subdirectory of the ``cachedir`` in the ``[main]`` section of the
+        configuration, per satellite.  Defaults to True.
+
+    granule_cache : bool
+        Read L1B granules through a
+        `~FCDR_HIRS.granule_cache.GranuleCache`, in the ``l1b_granules``
+        subdirectory of the ``cachedir``.  Defaults to True.
+
+    granule_index : bool
+        Look up L1B granules in a
+        `~FCDR_HIRS.granule_index.GranuleIndex`, stored in the
+        ``granule_index`` subdirectory of the ``cachedir``.  If the
+        index does not exist yet, it is built for the period processed
+        only.  Defaults to True.
+
+    encoding_table : str or pathlib.Path or None
+        JSON file with encodings per FCDR type and variable, such as
+        written by :mod:`~FCDR_HIRS.analysis.optimise_encoding`.  These
+        are applied on top of the default encodings when storing the
+        debug and easy FCDR.  Defaults to None.
+
+    compress_threads : int or None
+        Number of threads for compressing variables when writing the
+        debug and easy FCDR, see `FCDR_HIRS.threaded_write`.  If 1,
+        write with `xarray.Dataset.to_netcdf` and
+        `fiduceo.fcdr.writer.fcdr_writer.FCDRWriter.write`.  The
+        threaded writer is opt-in, because for the easy FCDR it bypasses
+        `~fiduceo.fcdr.writer.fcdr_writer.FCDRWriter.write`.  Defaults
+        to None, meaning 1.
+
+    factored_uncertainties : bool
+        Store the ``u_from_*`` components of the debug FCDR in factored
+        form, see `FCDR_HIRS.factored_uncertainty`.  Defaults to False.
+
     """
     # for now, step_size should be smaller than segment_size and I will
     # only store whole orbits within each segment
@@ -277,25 +361,46 @@ class FCDRGenerator:
     # maximum number of correlation length to store in single FCDR debug
     # file.  For the easy, it's N//2 where N is length of orbit.
     max_debug_corr_length = 1000
+    #: int : Number of most recently written self-emission snapshots kept
+    rself_snapshots_keep = 12
+    _rself_first_snapshot = None
 
     dd = None
     # FIXME: use filename convention through FCDRTools, 
     def __init__(self, sat, start_date, end_date, modes, no_harm=False,
-            abridged=False):
+            abridged=False, rself_snapshots=True, granule_cache=True,
+            granule_index=True, encoding_table=None,
+            compress_threads=None, factored_uncertainties=False):
         logger.info("Preparing to generate FCDR for {sat:s} HIRS, "
             "{start:%Y-%m-%d %H:%M:%S} – {end_time:%Y-%m-%d %H:%M:%S}. "
             "Software:".format(
             sat=sat, start=start_date, end_time=end_date))
-        pr = subprocess.run(["pip", "freeze"], stdout=subprocess.PIPE)
-        info = pr.stdout.decode("utf-8")
+        with startup_profile.section("environment info"):
+            info = common.get_environment_info()
         logger.info(info)
         self.info = info
         self.satname = sat
-        self.fcdr = fcdr.which_hirs_fcdr(sat, read="L1B", no_harm=no_harm)
+        with startup_profile.section("HIRS FCDR object"):
+            self.fcdr = fcdr.which_hirs_fcdr(sat, read="L1B", no_harm=no_harm)
         self.fcdr.my_pseudo_fields.clear() # suppress pseudo fields radiance_fid, bt_fid here
+        # the debug FCDR passes all L1B fields through, so only reduce
+        # what is read when writing the easy FCDR alone
+        self.l1b_fields = ("all" if {"debug", "zarr"} & set(modes)
+            else fcdr.l1b_fields_for_fcdr(self.fcdr))
+        with startup_profile.section("granule cache and index"):
+            if granule_cache:
+                self.fcdr.granule_cache = GranuleCache(self.fcdr)
+            if granule_index:
+                self.fcdr.granule_index = GranuleIndex(self.fcdr,
+                    since=start_date - self.window_size, until=end_date)
+        self.encoding_table = (common.load_encoding_table(encoding_table)
+            if encoding_table else {})
+        self.compress_threads = compress_threads or 1
+        self.factored_uncertainties = factored_uncertainties
         self.start_date = start_date
         self.end_date = end_date
         self.abridged = abridged
+        self.rself_snapshots = rself_snapshots
         if no_harm:
             self.data_version += "_no_harm"
 
@@ -308,9 +413,10 @@ class FCDRGenerator:
                 typhon.datasets.filters.HIRSTimeSequenceDuplicateFilter()]
         self.orbit_filters = orbit_filters
 
-        self.rself = models.RSelfTemperature(self.fcdr,
-            temperatures=self.rself_temperatures,
-            regr=self.rself_regr)
+        with startup_profile.section("self-emission model"):
+            self.rself = models.RSelfTemperatureIncremental(self.fcdr,
+                temperatures=self.rself_temperatures,
+                regr=self.rself_regr)
         self.modes = modes
 
     def process(self, start=None, end_time=None):
@@ -324,7 +430,8 @@ class FCDRGenerator:
         self.dd = typhon.datasets.dataset.DatasetDeque(
             self.fcdr, self.window_size, self.start_date,
             orbit_filters=self.orbit_filters,
-            pseudo_fields=self.pseudo_fields)
+            pseudo_fields=self.pseudo_fields,
+            fields=self.l1b_fields)
 
         start = start or self.start_date
         end_time = end_time or self.end_date
@@ -335,26 +442,169 @@ class FCDRGenerator:
         try:
             self.dd.reset(start,
                 orbit_filters=self.orbit_filters,
-                pseudo_fields=self.pseudo_fields)
+                pseudo_fields=self.pseudo_fields,
+                fields=self.l1b_fields)
         except typhon.datasets.dataset.DataFileError as e:
             logger.error("Unable to generate FCDR: {:s}".format(e.args[0]))
+        else:
+            if self.rself_snapshots:
+                self.warm_start_rself(self.dd.edges[1])
+        self._rself_first_snapshot = None
         while self.dd.center_time < end_time:
             try:
                 self.dd.move(self.step_size,
                     orbit_filters=self.orbit_filters,
-                    pseudo_fields=self.pseudo_fields)
+                    pseudo_fields=self.pseudo_fields,
+                    fields=self.l1b_fields)
                 self.make_and_store_piece(self.dd.center_time - self.segment_size,
                     self.dd.center_time)
             except (fcdr.FCDRError, typhon.datasets.dataset.DataFileError) as e:
                 logger.error("Unable to generate FCDR: {:s}".format(e.args[0]))
             else:
                 anyok = True
+                if self.rself_snapshots:
+                    self.store_rself_snapshot()
         if anyok:
             logger.info("Successfully completed, completed successfully.")
             logger.info("Everything seems fine.")
         else:
             raise fcdr.FCDRError("All has failed")
     
+    @property
+    def rself_snapshot_dir(self):
+        """pathlib.Path : Directory with self-emission model snapshots
+        """
+        return pathlib.Path(typhon.config.conf["main"]["cachedir"],
+            "rself_snapshots", self.satname)
+
+    def get_rself_snapshot_path(self, t):
+        """Get path for self-emission model snapshot at time
+
+        Parameters
+        ----------
+
+        t : datetime.datetime
+            End of the context window that the snapshot belongs to.
+
+        Returns
+        -------
+
+        pathlib.Path
+            Path to the snapshot file.
+        """
+        return self.rself_snapshot_dir / (
+            f"rself_{self.satname:s}_{t:%Y%m%d%H%M}_v{self.data_version:s}.nc")
+
+    def iter_rself_snapshots(self):
+        """Yield existing self-emission model snapshots
+
+        Yields
+        ------
+
+        (datetime.datetime, pathlib.Path)
+            End of the context window that the snapshot belongs to, and
+            path to the snapshot, for all snapshots for this satellite
+            and data version.
+        """
+        for fn in self.rself_snapshot_dir.glob(
+                f"rself_{self.satname:s}_*_v{self.data_version:s}.nc"):
+            try:
+                t_snap = datetime.datetime.strptime(
+                    fn.stem.split("_")[2], "%Y%m%d%H%M")
+            except ValueError:
+                continue
+            yield (t_snap, fn)
+
+    def store_rself_snapshot(self):
+        """Store snapshot of self-emission model for current context
+
+        Write the state of the self-emission model for the current
+        context window, as defined by ``self.dd``, with
+        `models.RSelfTemperatureIncremental.save`.  Then remove older
+        snapshots written in the same call to `process` with
+        `prune_rself_snapshots`.
+        """
+        fn = self.get_rself_snapshot_path(self.dd.edges[1])
+        fn.parent.mkdir(exist_ok=True, parents=True)
+        try:
+            self.rself.save(fn,
+                satellite=self.satname,
+                data_version=self.data_version,
+                window_start=f"{self.dd.edges[0]:%Y-%m-%dT%H:%M:%S}",
+                window_end=f"{self.dd.edges[1]:%Y-%m-%dT%H:%M:%S}")
+        except ValueError as e:
+            logger.debug(f"Not storing self-emission snapshot: {e.args[0]:s}")
+        else:
+            logger.debug(f"Stored self-emission snapshot to {fn!s}")
+            if self._rself_first_snapshot is None:
+                self._rself_first_snapshot = self.dd.edges[1]
+            self.prune_rself_snapshots(self._rself_first_snapshot,
+                self.dd.edges[1])
+
+    def prune_rself_snapshots(self, first, last):
+        """Remove older snapshots written by the current run
+
+        Of the snapshots with a window ending between ``first`` and
+        ``last``, keep those for the `rself_snapshots_keep` latest steps
+        and remove the rest.  Snapshots outside this range, such as
+        those written by runs for other periods, are left alone.
+
+        Parameters
+        ----------
+
+        first : datetime.datetime
+            End of the context window of the first snapshot written by
+            the current run.
+        last : datetime.datetime
+            End of the current context window.
+        """
+        cutoff = last - self.rself_snapshots_keep * self.step_size
+        for (t_snap, fn) in self.iter_rself_snapshots():
+            if not first <= t_snap <= cutoff:
+                continue
+            try:
+                fn.unlink()
+            except FileNotFoundError:
+                pass
+            else:
+                logger.debug(f"Removed self-emission snapshot {fn!s}")
+
+    def warm_start_rself(self, t):
+        """Restore self-emission model from nearest earlier snapshot
+
+        Look for the most recent snapshot with a window ending no later
+        than ``t`` and overlapping with the context window ending at
+        ``t``.  If one is found, restore the self-emission model from it,
+        such that fitting the first context only needs to calibrate
+        calibration lines that were not yet in the snapshot.
+
+        Parameters
+        ----------
+
+        t : datetime.datetime
+            End of the context window.
+
+        Returns
+        -------
+
+        bool
+            True if the model was restored from a snapshot.
+        """
+        earliest = t - self.window_size
+        candidates = [(t_snap, fn)
+            for (t_snap, fn) in self.iter_rself_snapshots()
+            if earliest < t_snap <= t]
+        for (t_snap, fn) in sorted(candidates, reverse=True):
+            try:
+                self.rself.load(fn)
+            except (OSError, KeyError, ValueError) as e:
+                logger.warning(f"Cannot use self-emission snapshot {fn!s}: "
+                    f"{e.args[0]!s}")
+            else:
+                logger.info(f"Warm-starting self-emission model from {fn!s}")
+                return True
+        return False
+
     def fragmentate(self, piece):
         """Yield fragments per orbit
 
@@ -444,11 +694,13 @@ class FCDRGenerator:
                 self.dd = typhon.datasets.dataset.DatasetDeque(
                     self.fcdr, self.window_size, from_,
                     orbit_filters=self.orbit_filters,
-                    pseudo_fields=self.pseudo_fields)
+                    pseudo_fields=self.pseudo_fields,
+                    fields=self.l1b_fields)
             else:
                 self.dd.reset(start,
                     orbit_filters=self.orbit_filters,
-                    pseudo_fields=self.pseudo_fields)
+                    pseudo_fields=self.pseudo_fields,
+                    fields=self.l1b_fields)
 
         subset = self.dd.data.sel(time=slice(from_, to))
         # This is not supposed to happen consistently, but may happen if
@@ -710,7 +962,7 @@ class FCDRGenerator:
             platform=self.satname,
             url="http://www.fiduceo.eu/",
             #verbose_version_info=pr.stdout.decode("utf-8"),
-            fcdr_software_version=pkg_resources.get_distribution("FCDR_HIRS").version,
+            fcdr_software_version=importlib.metadata.version("FCDR_HIRS"),
             institution="University of Reading",
             data_version=self.data_version,
             WARNING=effects.WARNING,
@@ -741,9 +993,10 @@ class FCDRGenerator:
 
         # add orig_l1b
         t_earth = piece["scanline_earth"]
-        src_filenames = pandas.unique(piece["filename"].sel(time=t_earth))
-        # call .item() to avoid https://bugs.python.org/issue29672
-        piece["scanline_map_to_origl1bfile"] = [src_filenames.tolist().index(fn.item()) for fn in piece["filename"].sel(time=t_earth)]
+        # factorize numbers in order of first appearance, like pandas.unique
+        (scanline_map, src_filenames) = pandas.factorize(
+            piece["filename"].sel(time=t_earth).values)
+        piece["scanline_map_to_origl1bfile"] = scanline_map
         piece.attrs["source"] = ", ".join(src_filenames)
 
         return piece
@@ -766,7 +1019,22 @@ class FCDRGenerator:
         fn.parent.mkdir(exist_ok=True, parents=True)
         logger.info("Storing to {!s}".format(fn))
         piece.attrs["full_info"] = self.info
-        piece.to_netcdf(str(fn))
+        common.apply_encoding_table(piece,
+            self.encoding_table.get("debug", {}))
+        if self.factored_uncertainties:
+            piece = factored_uncertainty.factorise(piece)
+        threaded_write.to_netcdf_threaded(piece, fn,
+            threads=self.compress_threads)
+
+    def store_piece_zarr(self, piece):
+        """Append debug FCDR to per-satellite Zarr store
+
+        See `FCDR_HIRS.zarr_store`.
+        """
+        if self.zarr_store is None:
+            self.zarr_store = FCDRZarrStore(self.satname, self.data_version)
+        piece.attrs["full_info"] = self.info
+        self.zarr_store.append(piece)
 
     def store_piece_easy(self, piece):
         piece_easy = self.debug2easy(piece)
@@ -785,11 +1053,22 @@ class FCDRGenerator:
         piece_easy.attrs["creator_name"] = "Gerrit Holl and the FIDUCEO team"
         piece_easy.attrs["creator_email"] = "fiduceo-coordinator@lists.reading.ac.uk"
         piece_easy.attrs["comment"] = "Beta version.  Not intended for scientific use."
+        common.apply_encoding_table(piece_easy,
+            self.encoding_table.get("easy", {}))
         try:
-            fiduceo.fcdr.writer.fcdr_writer.FCDRWriter.write(
-                piece_easy,
-                fn,
-                overwrite=True)
+            if self.compress_threads == 1:
+                fiduceo.fcdr.writer.fcdr_writer.FCDRWriter.write(
+                    piece_easy,
+                    fn,
+                    overwrite=True)
+            else:
+                # same encoding as FCDRWriter.write: zlib level 5 for
+                # all data variables unless set otherwise
+                threaded_write.to_netcdf_threaded(piece_easy, fn,
+                    encoding={k: {"zlib": True, "complevel": 5,
+                                  **piece_easy[k].encoding}
+                              for k in piece_easy.data_vars},
+                    threads=self.compress_threads)
         except FileExistsError as e:
             logger.info("Already exists: {!s}".format(e.args[0]))
         except ValueError as e:
@@ -1045,6 +1324,7 @@ class FCDRGenerator:
             {k:v for (k,v) in piece.attrs.items() if k in easy.attrs.keys()})
 
     _i = 0
+    zarr_store = None
     def get_filename_for_piece(self, piece, fcdr_type):
         # instead of using datetime-formatting codes directly, pass all
         # seperately so that the same format can be more easily used in
@@ -1100,7 +1380,13 @@ def main():
             datetime.datetime.strptime(p.to_date, p.datefmt),
             p.modes,
             no_harm=p.no_harm,
-            abridged=p.abridged)
+            abridged=p.abridged,
+            rself_snapshots=p.rself_snapshots,
+            granule_cache=p.granule_cache,
+            granule_index=p.granule_index,
+            encoding_table=p.encoding_table,
+            compress_threads=p.compress_threads,
+            factored_uncertainties=p.factored_uncertainties)
         fgen.process()
     else:
         dates = pandas.date_range(p.from_date, p.to_date, freq="MS")
@@ -1109,6 +1395,12 @@ def main():
                 d.to_pydatetime(),
                 d.to_pydatetime() + datetime.timedelta(days=p.days),
                 p.modes,
-                no_harm=p.no_harm)
+                no_harm=p.no_harm,
+                rself_snapshots=p.rself_snapshots,
+                granule_cache=p.granule_cache,
+                granule_index=p.granule_index,
+                encoding_table=p.encoding_table,
+                compress_threads=p.compress_threads,
+                factored_uncertainties=p.factored_uncertainties)
             fgen.process()
 
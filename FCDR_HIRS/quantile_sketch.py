@@ -0,0 +1,178 @@
+"""Mergeable quantile sketches
+
+Percentiles of a field for a single day, as stored by
+`~FCDR_HIRS.analysis.summarise_fcdr.FCDRSummary`, cannot be combined into
+percentiles for a month or for the lifetime of a satellite.  This module
+implements a compact summary of a distribution from which quantiles can
+be estimated and which can be merged with other such summaries: a
+t-digest (Dunning and Ertl, 2019, arXiv:1902.04023) in its merging
+variant.
+
+A t-digest is a set of centroids, each with a mean and a weight (the
+number of values it represents).  Centroids near the tails of the
+distribution represent fewer values than those near the median, such
+that extreme quantiles are estimated accurately.  The size of the
+centroids is governed by the scale function
+
+.. math::
+
+    k(q) = \\frac{\\delta}{2\\pi} \\arcsin(2q - 1),
+
+where :math:`\\delta` is the compression: a centroid may span at most
+one unit in :math:`k`.  The smallest and largest values are kept as
+centroids of their own, such that the minimum and maximum are exact.  A
+digest has therefore at most :math:`\\delta/2 + 3` centroids,
+regardless of the number of values.  Merging digests means pooling their
+centroids and compressing again.
+
+Digests are stored as arrays of means and weights, padded with NaN and
+zero, respectively, to `max_centroids` along the last axis, such that
+digests for many days and channels can be stored in a single array and
+written to NetCDF.
+"""
+
+import numpy
+
+#: float : Default compression δ
+compression = 200
+
+def max_centroids(delta=compression):
+    """Maximum number of centroids for compression δ
+
+    Parameters
+    ----------
+
+    delta : float, optional
+        Compression.  Defaults to module attribute `compression`.
+
+    Returns
+    -------
+
+    int
+        Length of the centroid axis of a digest.
+    """
+    return int(delta//2) + 3
+
+def _scale(q, delta):
+    return delta / (2*numpy.pi) * numpy.arcsin(2*q - 1)
+
+def _compress(x, w, delta):
+    """Compress sorted weighted values into centroids
+    """
+    out_mean = numpy.full(max_centroids(delta), numpy.nan)
+    out_weight = numpy.zeros(max_centroids(delta))
+    total = w.sum()
+    if total == 0:
+        return (out_mean, out_weight)
+    q = (numpy.cumsum(w) - w/2) / total
+    idx = 1 + numpy.floor(_scale(q, delta) - _scale(0, delta)).astype(numpy.int64)
+    idx = numpy.clip(idx, 1, out_mean.size-2)
+    # extremes in centroids of their own
+    idx[0] = 0
+    idx[-1] = out_mean.size-1
+    weight = numpy.bincount(idx, w, minlength=out_mean.size)
+    wsum = numpy.bincount(idx, w*x, minlength=out_mean.size)
+    used = weight > 0
+    n = used.sum()
+    out_mean[:n] = wsum[used] / weight[used]
+    out_weight[:n] = weight[used]
+    return (out_mean, out_weight)
+
+def from_values(values, delta=compression):
+    """Create digest from values
+
+    Parameters
+    ----------
+
+    values : array_like
+        Values to summarise.  Non-finite and masked values are ignored.
+    delta : float, optional
+        Compression.  Defaults to module attribute `compression`.
+
+    Returns
+    -------
+
+    means : ndarray, shape (max_centroids(delta),)
+        Centroid means, NaN for unused centroids.
+    weights : ndarray, shape (max_centroids(delta),)
+        Centroid weights, 0 for unused centroids.
+    """
+    x = numpy.ma.masked_invalid(values).compressed().astype("f8")
+    x.sort()
+    return _compress(x, numpy.ones_like(x), delta)
+
+def merge(means, weights, axis=0, delta=compression):
+    """Merge digests along an axis
+
+    Parameters
+    ----------
+
+    means : ndarray
+        Centroid means, with the centroid axis last.
+    weights : ndarray
+        Centroid weights, same shape as ``means``.
+    axis : int, optional
+        Axis along which to merge digests.  Must not be the last axis.
+        Defaults to 0.
+    delta : float, optional
+        Compression.  Defaults to module attribute `compression`.
+
+    Returns
+    -------
+
+    means : ndarray
+        Merged centroid means, with ``axis`` removed.
+    weights : ndarray
+        Merged centroid weights, with ``axis`` removed.
+    """
+    means = numpy.moveaxis(numpy.asarray(means, dtype="f8"), axis, -2)
+    weights = numpy.moveaxis(numpy.asarray(weights, dtype="f8"), axis, -2)
+    shape = means.shape[:-2]
+    means = means.reshape(-1, means.shape[-2]*means.shape[-1])
+    weights = weights.reshape(means.shape)
+    out_mean = numpy.empty((means.shape[0], max_centroids(delta)))
+    out_weight = numpy.empty_like(out_mean)
+    for i in range(means.shape[0]):
+        ok = weights[i] > 0
+        order = numpy.argsort(means[i][ok], kind="stable")
+        (out_mean[i], out_weight[i]) = _compress(
+            means[i][ok][order], weights[i][ok][order], delta)
+    return (out_mean.reshape(shape + (-1,)),
+            out_weight.reshape(shape + (-1,)))
+
+def quantiles(means, weights, prob):
+    """Estimate quantiles from digests
+
+    Parameters
+    ----------
+
+    means : ndarray
+        Centroid means, with the centroid axis last.
+    weights : ndarray
+        Centroid weights, same shape as ``means``.
+    prob : array_like
+        Probabilities between 0 and 1.
+
+    Returns
+    -------
+
+    ndarray
+        Quantiles with the centroid axis replaced by an axis along
+        ``prob``.  NaN for empty digests.
+    """
+    means = numpy.asarray(means, dtype="f8")
+    weights = numpy.asarray(weights, dtype="f8")
+    prob = numpy.atleast_1d(prob)
+    shape = means.shape[:-1]
+    means = means.reshape(-1, means.shape[-1])
+    weights = weights.reshape(means.shape)
+    out = numpy.full((means.shape[0], prob.size), numpy.nan)
+    for i in range(means.shape[0]):
+        ok = weights[i] > 0
+        if not ok.any():
+            continue
+        # centroids are kept sorted by mean
+        (m, w) = (means[i][ok], weights[i][ok])
+        centre = numpy.cumsum(w) - w/2
+        out[i] = numpy.interp(prob*w.sum(), centre, m)
+    return out.reshape(shape + (prob.size,))
@@ -0,0 +1,437 @@
+"""Running statistics that can be updated and merged
+
+Statistics over many years of data, such as the mean and spread of
+calibration counts per scan position, need not hold all data in memory
+at once.  This module implements an accumulator for the count, mean,
+variance, minimum, and maximum of each element of an array, updated one
+batch of data at a time, such as one granule at a time.  Accumulators
+covering different periods, or calculated by different workers, can be
+merged into one.  With `RunningStats.add_grouped`, each value
+contributes to one group of elements only, such as the grid cell it
+falls in.  `RunningCovariance` does the same for the covariance and
+correlation between variables.
+
+Each batch is reduced with a two-pass algorithm, and the result is
+combined with the accumulated statistics using the pairwise update by
+Chan, Golub, and LeVeque (1983, The American Statistician 37(3),
+242–247), which is Welford's algorithm generalised to batches.  Unlike
+accumulating sums of values and of squared values, this does not lose
+precision when the variance is small compared to the mean.
+"""
+
+import numpy
+import xarray
+
+class RunningStats:
+    """Accumulate count, mean, variance, and extrema per element
+
+    Parameters
+    ----------
+
+    shape : Tuple[int], optional
+        Shape of the statistics, i.e. of each sample.  Defaults to
+        scalar.
+
+    Attributes
+    ----------
+
+    count : ndarray, int
+        Number of valid values per element.
+    mean : ndarray, float
+        Mean per element, 0 where count is 0.
+    m2 : ndarray, float
+        Sum of squared deviations from the mean per element.
+    minimum : ndarray, float
+        Smallest value per element, +inf where count is 0.
+    maximum : ndarray, float
+        Largest value per element, -inf where count is 0.
+
+    Examples
+    --------
+
+    >>> rs = RunningStats((48, 20))
+    >>> for counts in batches: # each with shape (n, 48, 20)
+    ...     rs.add(counts)
+    >>> rs.merge(rs_other_period)
+    >>> (rs.mean, rs.std())
+
+    With the default scalar shape, each batch is one-dimensional:
+
+    >>> rs = RunningStats()
+    >>> rs.add(numpy.ma.masked_invalid([1., 2., numpy.nan]))
+    >>> rs.add([3.])
+    >>> rs.add(numpy.ma.masked_all((2,)))
+    >>> (int(rs.count), float(rs.mean), float(rs.variance()))
+    (3, 2.0, 1.0)
+    >>> (float(rs.minimum), float(rs.maximum))
+    (1.0, 3.0)
+    """
+
+    def __init__(self, shape=()):
+        self.count = numpy.zeros(shape, dtype="i8")
+        self.mean = numpy.zeros(shape, dtype="f8")
+        self.m2 = numpy.zeros(shape, dtype="f8")
+        self.minimum = numpy.full(shape, numpy.inf)
+        self.maximum = numpy.full(shape, -numpy.inf)
+
+    @property
+    def shape(self):
+        return self.count.shape
+
+    def _combine(self, count, mean, m2, minimum, maximum):
+        total = self.count + count
+        with numpy.errstate(invalid="ignore", divide="ignore"):
+            frac = numpy.where(total > 0, count / total, 0)
+        delta = mean - self.mean
+        self.mean = self.mean + delta * frac
+        self.m2 = self.m2 + m2 + delta**2 * self.count * frac
+        self.count = total
+        self.minimum = numpy.minimum(self.minimum, minimum)
+        self.maximum = numpy.maximum(self.maximum, maximum)
+
+    def add(self, values, axis=0):
+        """Add batch of values
+
+        Parameters
+        ----------
+
+        values : array_like
+            Values to add.  Masked and non-finite values are ignored.
+            After removing ``axis``, the shape must be equal to `shape`.
+        axis : int, optional
+            Axis along the samples in ``values``.  Defaults to 0.
+        """
+        x = numpy.ma.masked_invalid(
+            numpy.ma.asanyarray(values).astype("f8"), copy=False)
+        x = numpy.ma.masked_array(numpy.moveaxis(x.data, axis, 0),
+            numpy.moveaxis(numpy.ma.getmaskarray(x), axis, 0))
+        if x.shape[1:] != self.shape:
+            raise ValueError(f"Expected samples of shape {self.shape!s}, "
+                             f"got {x.shape[1:]!s}")
+        if x.shape[0] == 0:
+            return
+        count = x.count(axis=0)
+        # for scalar statistics, reductions return numpy scalars or
+        # numpy.ma.masked rather than masked arrays
+        with numpy.errstate(invalid="ignore", divide="ignore"):
+            mean = numpy.where(count > 0,
+                numpy.ma.asarray(x.sum(axis=0)).filled(0) / count, 0)
+        m2 = numpy.ma.asarray(((x - mean)**2).sum(axis=0)).filled(0)
+        self._combine(count, mean, m2,
+                      numpy.ma.asarray(x.min(axis=0)).filled(numpy.inf),
+                      numpy.ma.asarray(x.max(axis=0)).filled(-numpy.inf))
+
+    def add_grouped(self, values, groups):
+        """Add batch of values, each to its own group
+
+        Where `add` adds every sample to all elements, this adds each
+        sample to the elements of one group only, such as the cell of a
+        grid that it falls in.  The statistics for all groups are
+        calculated at once with `numpy.bincount`.
+
+        Parameters
+        ----------
+
+        values : array_like, shape (samples, ...)
+            Values to add.  Masked and non-finite values are ignored.
+            After removing the first axis, the shape must be equal to the
+            trailing dimensions of `shape`.
+        groups : array_like, int, shape (samples,)
+            For each sample, the group to add it to, as a flat index
+            into the leading dimensions of `shape` not covered by
+            ``values``.  Negative values are ignored.
+        """
+        x = numpy.ma.masked_invalid(
+            numpy.ma.asanyarray(values).astype("f8"), copy=False)
+        ntrail = x.ndim - 1
+        if ntrail > len(self.shape) or (
+                ntrail > 0 and x.shape[1:] != self.shape[-ntrail:]):
+            raise ValueError(f"Expected samples of shape "
+                             f"{self.shape[len(self.shape)-ntrail:]!s}, "
+                             f"got {x.shape[1:]!s}")
+        m = int(numpy.prod(x.shape[1:]))
+        size = int(numpy.prod(self.shape))
+        x = x.reshape(x.shape[0], m)
+        # flat index of each value into the statistics
+        idx = (numpy.asarray(groups, dtype="i8")[:, numpy.newaxis] * m
+               + numpy.arange(m))
+        ok = ~numpy.ma.getmaskarray(x) & (idx >= 0)
+        (idx, x) = (idx[ok], x.data[ok])
+        count = numpy.bincount(idx, minlength=size)
+        with numpy.errstate(invalid="ignore", divide="ignore"):
+            mean = numpy.where(count > 0,
+                numpy.bincount(idx, x, minlength=size) / count, 0)
+        m2 = numpy.bincount(idx, (x - mean[idx])**2, minlength=size)
+        minimum = numpy.full(size, numpy.inf)
+        numpy.minimum.at(minimum, idx, x)
+        maximum = numpy.full(size, -numpy.inf)
+        numpy.maximum.at(maximum, idx, x)
+        self._combine(*(v.reshape(self.shape)
+                        for v in (count, mean, m2, minimum, maximum)))
+
+    def merge(self, other):
+        """Merge statistics accumulated by another accumulator
+
+        Parameters
+        ----------
+
+        other : RunningStats
+            Accumulator with the same shape.
+
+        Returns
+        -------
+
+        RunningStats
+            This accumulator, updated in place.
+        """
+        if other.shape != self.shape:
+            raise ValueError(f"Cannot merge statistics of shape "
+                             f"{other.shape!s} into {self.shape!s}")
+        self._combine(other.count, other.mean, other.m2,
+                      other.minimum, other.maximum)
+        return self
+
+    def variance(self, ddof=1):
+        """Variance per element
+
+        Parameters
+        ----------
+
+        ddof : int, optional
+            Delta degrees of freedom.  Defaults to 1.
+
+        Returns
+        -------
+
+        ndarray
+            Variance, NaN where there are no more than ``ddof`` values.
+        """
+        with numpy.errstate(invalid="ignore", divide="ignore"):
+            return numpy.where(self.count > ddof,
+                               self.m2 / (self.count - ddof), numpy.nan)
+
+    def std(self, ddof=1):
+        """Standard deviation per element
+
+        See `variance`.
+        """
+        return numpy.sqrt(self.variance(ddof))
+
+    def to_xarray(self, dims, coords=None):
+        """Convert to dataset, for storage or plotting
+
+        Parameters
+        ----------
+
+        dims : Sequence[str]
+            Dimension names, one per axis of `shape`.
+        coords : Mapping, optional
+            Coordinates for the dimensions.
+
+        Returns
+        -------
+
+        xarray.Dataset
+            Dataset with variables ``count``, ``mean``, ``m2``,
+            ``minimum``, and ``maximum``, and, for convenience, ``std``.
+            `from_xarray` reconstructs the accumulator.
+        """
+        valid = self.count > 0
+        return xarray.Dataset(
+            {"count": (dims, self.count),
+             "mean": (dims, numpy.where(valid, self.mean, numpy.nan)),
+             "m2": (dims, self.m2),
+             "minimum": (dims, numpy.where(valid, self.minimum, numpy.nan)),
+             "maximum": (dims, numpy.where(valid, self.maximum, numpy.nan)),
+             "std": (dims, self.std())},
+            coords=coords)
+
+    @classmethod
+    def from_xarray(cls, ds):
+        """Reconstruct accumulator from dataset written by `to_xarray`
+
+        Parameters
+        ----------
+
+        ds : xarray.Dataset
+            Dataset as returned by `to_xarray`.
+
+        Returns
+        -------
+
+        RunningStats
+            Accumulator that can be updated and merged further.
+        """
+        rs = cls(ds["count"].shape)
+        valid = ds["count"].values > 0
+        rs.count = ds["count"].values.astype("i8")
+        rs.mean = numpy.where(valid, ds["mean"].values, 0)
+        rs.m2 = ds["m2"].values.astype("f8")
+        rs.minimum = numpy.where(valid, ds["minimum"].values, numpy.inf)
+        rs.maximum = numpy.where(valid, ds["maximum"].values, -numpy.inf)
+        return rs
+
+class RunningCovariance:
+    """Accumulate covariance and correlation between variables
+
+    Statistics are accumulated for each pair of variables separately,
+    from the samples in which both are valid, such that a variable that
+    is often or always invalid does not affect the statistics between
+    other variables.  Batches are combined with the pairwise update by
+    Chan et al., as for `RunningStats`, generalised to co-moments.
+
+    Parameters
+    ----------
+
+    n : int
+        Number of variables.
+
+    Attributes
+    ----------
+
+    count : ndarray, int, shape (n, n)
+        Number of samples in which both variables are valid.  The
+        diagonal is the number of valid values per variable.
+    mean : ndarray, float, shape (n, n)
+        Element ``[i, j]`` is the mean of variable ``i`` over the samples
+        in which both variables ``i`` and ``j`` are valid, 0 where there
+        are none.
+    comoment : ndarray, float, shape (n, n)
+        Sum of products of deviations from those means, over the samples
+        in which both variables are valid.
+    """
+
+    def __init__(self, n):
+        self.count = numpy.zeros((n, n), dtype="i8")
+        self.mean = numpy.zeros((n, n))
+        self.comoment = numpy.zeros((n, n))
+
+    @property
+    def n(self):
+        return self.count.shape[0]
+
+    def _combine(self, count, mean, comoment):
+        total = self.count + count
+        with numpy.errstate(invalid="ignore", divide="ignore"):
+            frac = numpy.where(total > 0, count / total, 0)
+        delta = mean - self.mean
+        self.mean = self.mean + delta * frac
+        self.comoment = (self.comoment + comoment
+            + delta * delta.T * self.count * frac)
+        self.count = total
+
+    def add(self, values):
+        """Add batch of samples
+
+        Parameters
+        ----------
+
+        values : array_like, shape (samples, n)
+            Samples to add.  Masked and non-finite values are ignored,
+            for the pairs of variables they belong to only.
+        """
+        x = numpy.ma.masked_invalid(
+            numpy.ma.asanyarray(values).astype("f8"), copy=False)
+        if x.ndim != 2 or x.shape[1] != self.n:
+            raise ValueError(f"Expected samples of {self.n:d} variables, "
+                             f"got shape {x.shape!s}")
+        if x.shape[0] == 0:
+            return
+        valid = (~numpy.ma.getmaskarray(x)).astype("f8")
+        count = valid.T @ valid
+        # shift by the mean per variable first, such that the sums of
+        # products below do not lose precision
+        shift = x.mean(axis=0).filled(0)
+        dev = (x - shift).filled(0)
+        with numpy.errstate(invalid="ignore", divide="ignore"):
+            # mean of variable i where both i and j are valid
+            mean = numpy.where(count > 0, (dev.T @ valid) / count, 0)
+        comoment = dev.T @ dev - mean * mean.T * count
+        self._combine(count.astype("i8"), mean + shift[:, numpy.newaxis],
+                      comoment)
+
+    def merge(self, other):
+        """Merge statistics accumulated by another accumulator
+
+        Parameters
+        ----------
+
+        other : RunningCovariance
+            Accumulator for the same number of variables.
+
+        Returns
+        -------
+
+        RunningCovariance
+            This accumulator, updated in place.
+        """
+        if other.n != self.n:
+            raise ValueError(f"Cannot merge covariance of {other.n:d} "
+                             f"variables into {self.n:d}")
+        self._combine(other.count, other.mean, other.comoment)
+        return self
+
+    def covariance(self, ddof=1):
+        """Covariance matrix
+
+        As `numpy.ma.cov` on all samples: for each pair of variables,
+        the products of the deviations of each variable from its mean
+        over all its valid values are summed over the samples in which
+        both are valid.  NaN for pairs with no more than ``ddof`` such
+        samples.
+        """
+        m = numpy.diag(self.mean)
+        # move co-moments from the means per pair to the means per
+        # variable
+        d = self.mean - m[:, numpy.newaxis]
+        comoment = self.comoment + d * d.T * self.count
+        with numpy.errstate(invalid="ignore", divide="ignore"):
+            return numpy.where(self.count > ddof,
+                               comoment / (self.count - ddof), numpy.nan)
+
+    def correlation(self):
+        """Correlation matrix
+
+        As `numpy.ma.corrcoef` on all samples, see `covariance`.  NaN
+        for variables without variance.
+        """
+        c = self.covariance()
+        d = numpy.sqrt(numpy.diag(c))
+        with numpy.errstate(invalid="ignore", divide="ignore"):
+            return c / numpy.outer(d, d)
+
+    def to_xarray(self, dims, coords=None):
+        """Convert to dataset, for storage or plotting
+
+        Parameters
+        ----------
+
+        dims : Tuple[str, str]
+            Names of the two dimensions along the variables.
+        coords : Mapping, optional
+            Coordinates for the dimensions.
+
+        Returns
+        -------
+
+        xarray.Dataset
+            Dataset with variables ``count``, ``mean``, ``comoment``, and,
+            for convenience, ``correlation``.  `from_xarray`
+            reconstructs the accumulator.
+        """
+        return xarray.Dataset(
+            {"count": (dims, self.count),
+             "mean": (dims, self.mean),
+             "comoment": (dims, self.comoment),
+             "correlation": (dims, self.correlation())},
+            coords=coords)
+
+    @classmethod
+    def from_xarray(cls, ds):
+        """Reconstruct accumulator from dataset written by `to_xarray`
+        """
+        rc = cls(ds["count"].shape[0])
+        rc.count = ds["count"].values.astype("i8")
+        rc.mean = ds["mean"].values.astype("f8")
+        rc.comoment = ds["comoment"].values.astype("f8")
+        return rc
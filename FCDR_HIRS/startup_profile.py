@@ -0,0 +1,144 @@
+"""Measure import and initialisation time of scripts
+
+Scripts such as ``generate_fcdr`` are run as many short jobs, for which
+the time spent importing modules and setting up objects matters.  This
+module records, for every module imported after `install` is called,
+the time spent importing it, both including and excluding the modules it
+imports in turn, as well as the time spent in named initialisation
+sections marked with `section`.
+
+Profiling is switched on by passing ``--profile-startup`` to any script
+using `FCDR_HIRS.common.add_to_argparse`, or by setting the environment
+variable ``FCDR_HIRS_PROFILE_STARTUP``.  Because imports happen before
+command line arguments are parsed, the package ``__init__`` checks for
+either and calls `install` as early as possible.  The report is written
+to standard error when the process exits.
+"""
+
+import atexit
+import builtins
+import contextlib
+import importlib.util
+import sys
+import time
+
+#: Dict[str, List[float]] : Cumulative and self time per imported module
+imports = {}
+
+#: Dict[str, float] : Time per initialisation section
+sections = {}
+
+_stack = []
+_original_import = None
+
+def _resolve(name, globals, level):
+    if level == 0:
+        return name
+    package = (globals or {}).get("__package__") or ""
+    try:
+        return importlib.util.resolve_name("."*level + name, package)
+    except (ImportError, ValueError):
+        return None
+
+def _import_timed(full):
+    # import parents first, such that each is attributed its own time
+    parts = full.split(".")
+    for i in range(1, len(parts)+1):
+        mod = ".".join(parts[:i])
+        if mod not in sys.modules:
+            _time(mod, _original_import, mod, None, None, (), 0)
+
+def _timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+    full = _resolve(name, globals, level)
+    if not full:
+        return _original_import(name, globals, locals, fromlist, level)
+    _import_timed(full)
+    for sub in fromlist or ():
+        # submodules in fromlist are imported by the import machinery
+        # without passing through __import__, so import them here
+        mod = f"{full:s}.{sub:s}"
+        if (sub == "*" or mod in sys.modules
+                or hasattr(sys.modules.get(full), sub)):
+            continue
+        try:
+            _import_timed(mod)
+        except ModuleNotFoundError as e:
+            if e.name != mod:
+                raise
+    return _original_import(name, globals, locals, fromlist, level)
+
+def _time(label, func, *args):
+    _stack.append(0.0)
+    t = time.perf_counter()
+    try:
+        return func(*args)
+    finally:
+        dt = time.perf_counter() - t
+        children = _stack.pop()
+        if _stack:
+            _stack[-1] += dt
+        if label not in imports:
+            imports[label] = [dt, dt - children]
+
+def install():
+    """Start recording import times
+
+    Replaces `builtins.__import__` and registers `report` to be called
+    at exit.  Calling it more than once has no further effect.
+    """
+    global _original_import
+    if _original_import is not None:
+        return
+    _original_import = builtins.__import__
+    builtins.__import__ = _timed_import
+    atexit.register(report)
+
+def is_installed():
+    """Return True if import times are being recorded
+    """
+    return _original_import is not None
+
+@contextlib.contextmanager
+def section(name):
+    """Context manager recording the duration of an initialisation step
+
+    Does nothing unless `install` was called.
+
+    Parameters
+    ----------
+
+    name : str
+        Name under which the duration is reported.
+    """
+    if not is_installed():
+        yield
+        return
+    t = time.perf_counter()
+    try:
+        yield
+    finally:
+        sections[name] = sections.get(name, 0) + time.perf_counter() - t
+
+def report(file=None, n=30):
+    """Write startup profile
+
+    Parameters
+    ----------
+
+    file : file-like, optional
+        Where to write the report.  Defaults to standard error.
+    n : int, optional
+        Number of modules to list, by decreasing self time.
+    """
+    file = file or sys.stderr
+    total = sum(v[1] for v in imports.values())
+    print(f"Startup profile: {len(imports):d} modules imported in "
+          f"{total:.3f} s", file=file)
+    print(f"{'self [s]':>10s} {'cumul. [s]':>10s}  module", file=file)
+    for (mod, (cum, own)) in sorted(imports.items(),
+            key=lambda kv: kv[1][1], reverse=True)[:n]:
+        print(f"{own:10.3f} {cum:10.3f}  {mod:s}", file=file)
+    if sections:
+        print(f"{'time [s]':>10s}  initialisation section", file=file)
+        for (name, dt) in sections.items():
+            print(f"{dt:10.3f}  {name:s}", file=file)
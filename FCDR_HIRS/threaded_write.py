@@ -0,0 +1,155 @@
+"""Write NetCDF files with variables compressed in parallel
+
+When writing a NetCDF-4 file with `xarray.Dataset.to_netcdf`, the HDF5
+library deflates every chunk of every variable in turn, in a single
+thread.  For the debug FCDR, with dozens of compressed uncertainty
+variables per orbit, this makes writing a serial bottleneck.
+
+This module writes such files in three steps:
+
+1. All variables that are not compressed, or that are small, are written
+   with `xarray.Dataset.to_netcdf` as usual.
+2. The remaining variables are defined with `netCDF4`, with the same
+   dimensions, attributes, chunking, and filters as xarray would have
+   used, but without writing any data.
+3. Their data, packed according to the CF conventions by xarray, are cut
+   into chunks, which are shuffled and deflated in a thread pool.  The
+   compressed chunks are then written with the HDF5 direct chunk write
+   through `h5py`, bypassing the HDF5 filter pipeline.
+
+zlib releases the global interpreter lock while compressing, such that
+the threads compress in parallel.  The result is an ordinary NetCDF-4
+file.
+"""
+
+import concurrent.futures
+import itertools
+import logging
+import os
+import zlib
+
+import numpy
+import xarray
+import xarray.conventions
+import netCDF4
+import h5py
+
+from . import common
+
+logger = logging.getLogger(__name__)
+
+#: int : Target uncompressed chunk size in bytes, if no chunksizes given
+target_chunk_bytes = 2**20
+
+def _default_chunks(shape, itemsize):
+    rest = int(numpy.prod(shape[1:], dtype="i8"))
+    n0 = max(1, min(shape[0], target_chunk_bytes // max(1, itemsize*rest)))
+    return (n0,) + tuple(shape[1:])
+
+def _compress_chunk(arr, chunks, offset, shuffle, level, fill):
+    block = arr[tuple(slice(o, o+c) for (o, c) in zip(offset, chunks))]
+    if block.shape != tuple(chunks):
+        # HDF5 stores edge chunks in full
+        full = numpy.full(chunks, fill, dtype=arr.dtype)
+        full[tuple(slice(0, n) for n in block.shape)] = block
+        block = full
+    buf = numpy.ascontiguousarray(block).tobytes()
+    if shuffle and arr.dtype.itemsize > 1:
+        buf = numpy.frombuffer(buf, dtype="u1").reshape(
+            -1, arr.dtype.itemsize).T.tobytes()
+    return (offset, zlib.compress(buf, level))
+
+def to_netcdf_threaded(ds, path, encoding=None, threads=None,
+                       min_nbytes=2**16):
+    """Write dataset to NetCDF-4, compressing variables in parallel
+
+    Parameters
+    ----------
+
+    ds : xarray.Dataset
+        Dataset to write.
+    path : str or pathlib.Path
+        File to write.  Will be overwritten if it exists.
+    encoding : Mapping[str, dict], optional
+        Encodings per variable, as for `xarray.Dataset.to_netcdf`.
+        These are applied on top of the encodings set on the variables.
+    threads : int, optional
+        Number of threads for compression.  Defaults to the number of
+        CPUs.  If 1, just call `xarray.Dataset.to_netcdf`.
+    min_nbytes : int, optional
+        Variables smaller than this, uncompressed, are written by
+        xarray as usual.
+    """
+    encoding = encoding or {}
+    threads = threads or os.cpu_count()
+    full_enc = {k: {**{kk: vv for (kk, vv) in v.encoding.items()
+                       if kk in common.netcdf_encoding_keys},
+                    **encoding.get(k, {})}
+                for (k, v) in ds.variables.items()}
+    parallel = [k for k in ds.data_vars
+        if full_enc[k].get("zlib")
+        and ds[k].ndim > 0
+        and ds[k].dtype.kind in "biuf"
+        and ds[k].nbytes >= min_nbytes]
+    if threads == 1 or not parallel:
+        ds.to_netcdf(str(path), encoding=encoding, engine="netcdf4")
+        return
+
+    rest = ds.drop_vars(parallel)
+    rest.to_netcdf(str(path), engine="netcdf4",
+        encoding={k: v for (k, v) in encoding.items()
+                  if k in rest.variables})
+
+    packed = {}
+    with netCDF4.Dataset(str(path), mode="a") as nc:
+        for k in parallel:
+            var = ds[k].variable.copy(deep=False)
+            var.encoding = dict(full_enc[k])
+            enc_var = xarray.conventions.encode_cf_variable(var, name=k)
+            data = numpy.asarray(enc_var.values)
+            attrs = dict(enc_var.attrs)
+            fill = attrs.pop("_FillValue", None)
+            coords = [c for c in ds.coords
+                      if c not in ds.dims
+                      and set(ds[c].dims) <= set(var.dims)]
+            if coords and "coordinates" not in attrs:
+                attrs["coordinates"] = " ".join(coords)
+            for (d, n) in zip(var.dims, var.shape):
+                if d not in nc.dimensions:
+                    nc.createDimension(d, n)
+            chunks = tuple(min(c, n) for (c, n) in zip(
+                full_enc[k].get("chunksizes")
+                or _default_chunks(data.shape, data.dtype.itemsize),
+                data.shape))
+            v = nc.createVariable(k, data.dtype, var.dims,
+                zlib=True,
+                complevel=full_enc[k].get("complevel", 4),
+                shuffle=full_enc[k].get("shuffle", True),
+                chunksizes=chunks,
+                fill_value=fill)
+            v.setncatts(attrs)
+            packed[k] = (data, chunks,
+                0 if fill is None else fill)
+
+    with h5py.File(str(path), mode="r+") as h5, \
+            concurrent.futures.ThreadPoolExecutor(threads) as executor:
+        # submit chunks of all variables at once, such that small
+        # variables do not leave threads idle
+        futures = {}
+        for (k, (data, chunks, fill)) in packed.items():
+            dset = h5[k]
+            if dset.compression != "gzip" or dset.fletcher32:
+                raise RuntimeError(f"Unexpected filters for {k:s}: "
+                    f"{dset.compression!s}, fletcher32={dset.fletcher32!s}")
+            data = data.astype(dset.dtype, copy=False)
+            for offset in itertools.product(*(range(0, n, c)
+                    for (n, c) in zip(data.shape, chunks))):
+                futures[executor.submit(_compress_chunk, data, chunks,
+                    offset, dset.shuffle, dset.compression_opts,
+                    fill)] = k
+        # h5py serialises calls into HDF5, so write from this thread only
+        for fut in concurrent.futures.as_completed(futures):
+            (offset, buf) = fut.result()
+            h5[futures[fut]].id.write_direct_chunk(offset, buf)
+    logger.debug(f"Wrote {len(parallel):d} variables to {path!s} "
+                 f"with {threads:d} compression threads")
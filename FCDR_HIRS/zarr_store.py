@@ -0,0 +1,361 @@
+"""Chunked Zarr store for the debug FCDR
+
+The debug FCDR is written as one NetCDF file per orbit.  Analysis
+tools, such as `~FCDR_HIRS.analysis.summarise_fcdr` and
+`~FCDR_HIRS.analysis.monitor_fcdr`, then have to open thousands of files
+and read entire variables even if they need only one channel.  This
+module implements an alternative storage backend, in which orbits are
+appended to one Zarr store per satellite and FCDR version.  Data are
+chunked along time and channel, such that one channel for many years can
+be read with a single lazy open.
+
+The debug FCDR has several time-like dimensions, such as
+``scanline_earth``, ``time``, and ``calibration_cycle``, which differ in
+length.  Because Zarr can only append along a single dimension at a time,
+variables are stored in one group per time-like dimension, named after
+that dimension.  Variables without a time-like dimension, such as
+correlation matrices, are stored once per piece in the group ``piece``,
+along a dimension ``piece`` with the first time in the piece as
+coordinate.  Variables with more than one time-like dimension cannot be
+stored, and appending a piece containing them fails with
+`~FCDR_HIRS.exceptions.FCDRError`.
+
+Pieces may be appended in any order.  Data later than the last time in a
+group are appended.  Data at exactly the times already in a group
+replace those in place.  Otherwise, all data in the group from the
+first time of the new data onward are removed and rewritten with the
+overlapping period replaced by the new data, such that a period can be
+reprocessed, or a gap filled, even if the times differ.  Rewriting is
+proportional to the amount of data after the start of the new data.
+
+Along with the data, each group has a variable ``written_{group}`` with
+the time at which each entry was written, such that users can find out
+whether data for a period have changed, see `FCDRZarrStore.last_written`.
+
+The store is written with consolidated metadata.  Because appending
+modifies the store in several steps, writers hold an exclusive lock on
+the file ``{store}.lock`` next to the store while appending, such that
+parallel processing jobs for the same satellite take turns.  This relies
+on `fcntl.flock`, which some network file systems do not support; on
+those, only a single job per satellite may write to the store at a time.
+
+This requires the optional dependency `zarr`.
+"""
+
+import contextlib
+import datetime
+import fcntl
+import logging
+import pathlib
+
+import numpy
+import xarray
+
+from typhon import config
+
+from .exceptions import FCDRError
+
+logger = logging.getLogger(__name__)
+
+class FCDRZarrStore:
+    """Zarr store for the debug FCDR of one satellite
+
+    Parameters
+    ----------
+
+    satname : str
+        Name of satellite.
+    data_version : str
+        Version of the FCDR.
+    path : str or pathlib.Path, optional
+        Location of the store.  Defaults to
+        ``HIRS_FCDR_zarr/{satname}_v{data_version}.zarr`` in the
+        ``fiddatadir`` in the ``[main]`` section of the configuration.
+    """
+
+    #: int : Chunk size along time-like dimensions
+    time_chunk = 4096
+
+    #: Set[str] : Dimensions along which chunks have size 1
+    single_chunk_dims = {"channel", "calibrated_channel"}
+
+    #: Set[str] : Encoding keys that carry over from NetCDF to Zarr
+    kept_encoding = {"dtype", "_FillValue", "scale_factor", "add_offset",
+                     "units", "calendar"}
+
+    def __init__(self, satname, data_version, path=None):
+        self.satname = satname
+        self.data_version = data_version
+        if path is None:
+            path = pathlib.Path(config.conf["main"]["fiddatadir"],
+                "HIRS_FCDR_zarr", f"{satname:s}_v{data_version:s}.zarr")
+        self.path = pathlib.Path(path)
+
+    @staticmethod
+    def time_dims(ds):
+        """Get time-like dimensions of dataset
+
+        Parameters
+        ----------
+
+        ds : xarray.Dataset
+            Dataset to inspect.
+
+        Returns
+        -------
+
+        Set[str]
+            Dimensions with a `numpy.datetime64` coordinate.
+        """
+        return {d for d in ds.dims
+            if d in ds.coords
+            and numpy.issubdtype(ds.coords[d].dtype, numpy.datetime64)}
+
+    def split(self, piece):
+        """Split debug FCDR into one dataset per time-like dimension
+
+        Parameters
+        ----------
+
+        piece : xarray.Dataset
+            Debug FCDR such as returned by
+            `~FCDR_HIRS.processing.generate_fcdr.FCDRGenerator.get_piece`.
+
+        Returns
+        -------
+
+        Dict[str, xarray.Dataset]
+            For each group, the dataset to store in it.
+        """
+        tdims = self.time_dims(piece)
+        groups = {}
+        for (k, v) in piece.data_vars.items():
+            vdims = tdims & set(v.dims)
+            if len(vdims) > 1:
+                raise FCDRError(f"Cannot store {k:s} in Zarr, it has "
+                                 f"several time dimensions: {vdims!s}")
+            groups.setdefault(vdims.pop() if vdims else "piece",
+                              []).append(k)
+        split = {g: piece[names] for (g, names) in groups.items()}
+        if "piece" in split:
+            t0 = min(piece.coords[d].values.min() for d in tdims)
+            split["piece"] = split["piece"].expand_dims(piece=[t0])
+        return split
+
+    def _encoding(self, ds, group):
+        enc = {}
+        for (k, v) in ds.variables.items():
+            e = {kk: vv for (kk, vv) in v.encoding.items()
+                 if kk in self.kept_encoding}
+            e["chunks"] = tuple(
+                min(self.time_chunk, n) if d == group
+                else 1 if d in self.single_chunk_dims
+                else n
+                for (d, n) in zip(v.dims, v.shape)) or None
+            if e["chunks"] is None:
+                del e["chunks"]
+            enc[k] = e
+        return enc
+
+    @contextlib.contextmanager
+    def _locked(self):
+        """Hold exclusive lock for writing to the store
+        """
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        lockfile = self.path.with_name(self.path.name + ".lock")
+        with lockfile.open("a") as fp:
+            fcntl.flock(fp, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fp, fcntl.LOCK_UN)
+
+    def append(self, piece):
+        """Append debug FCDR to store
+
+        Data along each time-like dimension that are later than the last
+        time already in the store are appended.  Data overlapping with
+        the store replace the data in the store for the period they
+        cover, such that storing the same piece twice does not duplicate
+        it.
+
+        Parameters
+        ----------
+
+        piece : xarray.Dataset
+            Debug FCDR such as returned by
+            `~FCDR_HIRS.processing.generate_fcdr.FCDRGenerator.get_piece`.
+
+        Raises
+        ------
+
+        FCDRError
+            If the piece has variables with more than one time-like
+            dimension.
+        """
+        split = self.split(piece)
+        now = numpy.datetime64(datetime.datetime.utcnow(), "ms")
+        logger.info(f"Appending to {self.path!s}")
+        with self._locked():
+            for (group, ds) in split.items():
+                ds = ds.assign({f"written_{group:s}":
+                    (group, numpy.full(ds.sizes[group], now))})
+                self._append_group(ds.sortby(group), group)
+
+    def _append_group(self, ds, group):
+        """Append sorted data to group, replacing any overlap
+        """
+        try:
+            existing = xarray.open_zarr(str(self.path), group=group,
+                                        consolidated=True)
+        except (FileNotFoundError, KeyError, OSError, ValueError):
+            existing = None
+        if existing is None:
+            ds.to_zarr(str(self.path), group=group, mode="w-",
+                       consolidated=True,
+                       encoding=self._encoding(ds, group))
+            return
+        times = existing[group].values
+        t = ds[group].values
+        if t[0] > times[-1]:
+            self._append_region(ds, group)
+            return
+        i0 = numpy.searchsorted(times, t[0], side="left")
+        i1 = numpy.searchsorted(times, t[-1], side="right")
+        if i1 - i0 == t.size and (times[i0:i1] == t).all():
+            logger.info(f"Overwriting {t.size:d} entries of {group:s} from "
+                        f"{t[0]!s}")
+            self._drop_static(ds, group).to_zarr(
+                str(self.path), group=group, mode="r+",
+                region={group: slice(int(i0), int(i1))})
+            return
+        logger.info(f"Replacing {i1-i0:d} entries of {group:s} for "
+                    f"{t[0]!s} – {t[-1]!s} by {t.size:d} new ones, "
+                    f"rewriting {times.size-i0:d} entries")
+        tail = existing.isel({group: slice(int(i1), None)}).load()
+        self._truncate(group, int(i0))
+        self._append_region(ds, group)
+        if tail[group].size > 0:
+            self._append_region(tail, group)
+
+    def _append_region(self, ds, group):
+        self._drop_static(ds, group).to_zarr(str(self.path), group=group,
+            mode="a", append_dim=group, consolidated=True)
+
+    @staticmethod
+    def _drop_static(ds, group):
+        """Drop variables without the group dimension, already stored
+        """
+        return ds.drop_vars([k for (k, v) in ds.variables.items()
+                             if group not in v.dims])
+
+    def _truncate(self, group, n):
+        """Truncate all arrays in group to ``n`` entries along group
+        """
+        import zarr
+        root = zarr.open_group(str(self.path), mode="r+", path=group)
+        for (name, arr) in root.arrays():
+            dims = arr.attrs.get("_ARRAY_DIMENSIONS", [])
+            if group in dims:
+                shape = list(arr.shape)
+                shape[dims.index(group)] = n
+                arr.resize(tuple(shape))
+
+    def groups(self):
+        """List groups in store
+
+        Returns
+        -------
+
+        List[str]
+            Names of the groups, see module documentation.
+        """
+        return [p.name for p in sorted(self.path.iterdir())
+                if p.is_dir() and not p.name.startswith(".")]
+
+    def last_written(self, start=None, end=None, fields=None):
+        """Get time at which data for a period were last written
+
+        Parameters
+        ----------
+
+        start : datetime.datetime, optional
+            Consider data from this time onward.
+        end : datetime.datetime, optional
+            Consider data until this time.
+        fields : Collection[str], optional
+            Consider only groups containing any of these fields.
+            Defaults to all groups.
+
+        Returns
+        -------
+
+        numpy.datetime64 or None
+            Latest time at which any entry in the period was written, or
+            None if there are no data in the period.
+        """
+        latest = None
+        for group in self.groups():
+            ds = xarray.open_zarr(str(self.path), group=group,
+                                  consolidated=True)
+            name = f"written_{group:s}"
+            if name not in ds.data_vars or (fields is not None and
+                    not any(f in ds.data_vars for f in fields)):
+                continue
+            w = ds[name].sel({group: slice(start, end)}).values
+            if w.size > 0 and (latest is None or w.max() > latest):
+                latest = w.max()
+        return latest
+
+    def open(self, start=None, end=None, fields=None):
+        """Open store lazily
+
+        Parameters
+        ----------
+
+        start : datetime.datetime, optional
+            Select data from this time onward.
+        end : datetime.datetime, optional
+            Select data until this time.
+        fields : Collection[str], optional
+            Fields to select.  Only groups containing any of them are
+            opened.  Defaults to all fields.
+
+        Returns
+        -------
+
+        xarray.Dataset
+            Dataset with the requested fields, backed by dask arrays.
+        """
+        parts = []
+        for group in self.groups():
+            ds = xarray.open_zarr(str(self.path), group=group,
+                                  consolidated=True)
+            if fields is not None:
+                ds = ds[[f for f in fields if f in ds.data_vars]]
+                if not ds.data_vars:
+                    continue
+            parts.append(ds)
+        return self.select_period(xarray.merge(parts), start, end)
+
+    @classmethod
+    def select_period(cls, ds, start=None, end=None):
+        """Select period along all time-like dimensions
+
+        Parameters
+        ----------
+
+        ds : xarray.Dataset
+            Dataset such as returned by `open`.
+        start : datetime.datetime, optional
+            Select data from this time onward.
+        end : datetime.datetime, optional
+            Select data until this time.
+
+        Returns
+        -------
+
+        xarray.Dataset
+            Dataset restricted to the period.
+        """
+        return ds.sel({d: slice(start, end) for d in cls.time_dims(ds)})
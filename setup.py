@@ -98,13 +98,13 @@ setup(
                       "typhon>=0.7.0",
                       "progressbar2>=3.10",
                       "netCDF4>=1.2",
+                      "h5py>=2.7",
                       "pandas>=0.21",
                       "xarray>=0.10",
                       "seaborn>=0.7",
                       "sympy>=1.1",
                       "pint>=0.8",
                       "fcdr-tools>=1.1.4",
-                      "joblib>=0.11",
                       "pyorbital",
                       "cartopy",
                       "docrep",
@@ -119,6 +119,7 @@ setup(
     extras_require={
         'dev': ['check-manifest'],
         'test': ['coverage'],
+        'zarr': ['zarr'],
     },
 
     # If there are data files included in your packages that need to be
@@ -143,6 +144,7 @@ setup(
             'plot_hirs_field_timeseries=FCDR_HIRS.analysis.timeseries:main',
             "inspect_hirs_matchups=FCDR_HIRS.analysis.inspect_hirs_matchups:main",
             "map_hirs_field=FCDR_HIRS.analysis.map:main",
+            "grid_hirs_fcdr=FCDR_HIRS.analysis.grid_fcdr:main",
             "plot_hirs_field_matrix=FCDR_HIRS.analysis.fieldmat:main",
             "plot_hirs_calibcounts_per_scanpos=FCDR_HIRS.analysis.calibcounts_stats_per_scanpos:main",
             "plot_hirs_test_rself=FCDR_HIRS.analysis.test_rself:main",
@@ -155,6 +157,7 @@ setup(
             "summarise_hirs_fcdr=FCDR_HIRS.analysis.summarise_fcdr:summarise",
             "determine_hirs_latlon_compression_ratio=FCDR_HIRS.analysis.determine_latlon_compression_ratio:main",
             "determine_hirs_unc_storage=FCDR_HIRS.analysis.determine_optimal_uncertainty_format:main",
+            "optimise_hirs_fcdr_encoding=FCDR_HIRS.analysis.optimise_encoding:main",
             "plot_hirs_flags=FCDR_HIRS.analysis.plot_flags:main",
             "hirs_info_content=FCDR_HIRS.analysis.corrmat_info_content:main",
             "hirs_logfile_analysis=FCDR_HIRS.analysis.logfile_analysis:main",